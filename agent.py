@@ -1,204 +1,537 @@
 import os
-import importlib
-import inspect
-import json
-from typing import Dict, Optional, Any
+import sys
+import asyncio
+import logging
+from typing import Dict, Optional, Any, List, Tuple
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
-from memory import ConversationMemory
+from memory import ConversationMemory, LLMSummarizer
+from prompt import PromptBuilder
+from session import AgentSession, EventCallback
+from tracing import Span, format_summary
+from tool_cache import ToolResultCache
+from tool_router import ToolRouter
+from dispatch import (ActionDispatcher, PendingActions, normalize_actions, executable_actions,
+                      is_finish, format_action, format_observation)
 from mcp.protocol import MCPMessage
-from mcp.interfaces import BaseTool
-# 导入 RAGTool 以便特殊处理
-from tools.rag_tool import RAGTool
+from mcp.interfaces import BaseTool, get_tool_executor
+from tools.registry import load_tools
+from llm import create_client, resolve_provider
+from llm.stream import DecisionStreamParser, DecisionParseError, parse_decision
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# 记忆压缩时使用的摘要方式："extractive"（默认，不调用模型）或 "llm"
+MEMORY_SUMMARIZER = os.getenv("MEMORY_SUMMARIZER", "extractive").lower()
+# 流式接收模型输出：thought 实时显示，行动一解析完整就开始执行（流式请求不经过 LLM 响应缓存）
+LLM_STREAM = os.getenv("LLM_STREAM", "false").lower() in ("1", "true", "yes")
+# 模型输出无法解析也无法修复时，要求模型重新输出 JSON 的次数
+LLM_JSON_RETRIES = int(os.getenv("LLM_JSON_RETRIES", "1"))
+# 批量运行时预取知识库上下文，每批的查询数
+RAG_PREFETCH_BATCH = int(os.getenv("RAG_PREFETCH_BATCH", "64"))
+
+REASK_PROMPT = ("Your previous reply was not valid JSON. Reply again with exactly one JSON object "
+                "in the format described in the system prompt, and nothing else.")
+INVALID_JSON_NOTE = ("Your previous reply could not be parsed as JSON and was ignored. "
+                     "Always reply with exactly one JSON object in the required format.")
+
+def resolve_llm_config() -> Tuple[str, Optional[str], Optional[str], Optional[str]]:
+    """
+    根据 .env 中的 LLM_PROVIDER 解析出 (provider, api_key, base_url, model_name)。
+    同步和异步 Agent 共用这一套配置逻辑。
+    """
+    provider = os.getenv("LLM_PROVIDER", "openai").lower() # 默认为 openai，并转为小写
+    api_key, base_url, model_name = resolve_provider(provider)
+    return provider, api_key, base_url, model_name
+
+
 class SmartAgent:
+    """
+    ReAct Agent。实例只持有可共享的部分：LLM 客户端、工具、分发器和静态系统提示词；
+    每个目标的运行状态都在独立的 AgentSession 中，因此一个实例可以被多个线程同时用来执行不同的目标。
+    """
     def __init__(self, agent_id="smart_agent_001", tools_package_path="tools"):
         self.agent_id = agent_id
-        self.memory = ConversationMemory()
-
-        provider = os.getenv("LLM_PROVIDER", "openai").lower() # 默认为 openai，并转为小写
-
-        api_key = None
-        base_url = None
-        
-        # 根据 provider 的值，从 .env 加载对应的配置
-        if provider == "openai":
-            api_key = os.getenv("OPENAI_API_KEY")
-            self.model_name = os.getenv("OPENAI_MODEL_NAME", "gpt-4o")
-            # OpenAI 官方服务不需要 base_url
-        
-        elif provider == "deepseek":
-            api_key = os.getenv("DEEPSEEK_API_KEY")
-            self.model_name = os.getenv("DEEPSEEK_MODEL_NAME", "deepseek-chat")
-            base_url = "https://api.deepseek.com" # DeepSeek 的 URL 是固定的
-            
-        elif provider == "custom":
-            api_key = os.getenv("CUSTOM_LLM_API_KEY")
-            self.model_name = os.getenv("CUSTOM_LLM_MODEL_NAME")
-            base_url = os.getenv("CUSTOM_LLM_BASE_URL") # 用户自己提供 URL
-            if not base_url:
-                raise ValueError("LLM_PROVIDER is 'custom', but CUSTOM_LLM_BASE_URL is not set!")
-        
-        else:
-            raise ValueError(f"Unsupported LLM provider '{provider}'. Please check your .env file.")
 
-        if not api_key:
-            raise ValueError(f"API key for provider '{provider}' is not set in .env file.")
+        provider, api_key, base_url, self.model_name = resolve_llm_config()
         
-        # 3. 使用加载到的配置来初始化 OpenAI 客户端
+        # 使用加载到的配置来初始化 OpenAI 客户端
         # 无论用户选择哪个 provider，我们最终都用同一个 OpenAI 客户端对象
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url # 如果是 OpenAI 官方，base_url 会是 None，客户端会自动处理
-        )
+        self.client = self._create_client(provider, api_key, base_url)
+        # 摘要在记忆压缩时同步调用，因此总是使用同步客户端（压缩有滞回，很少发生）；
+        # 异步 Agent 把整个压缩放到线程池里执行，见 AsyncSmartAgent._acompact
+        self._summarizer = (LLMSummarizer(create_client(provider, api_key, base_url), self.model_name)
+                            if MEMORY_SUMMARIZER == "llm" else None)
         
-        print(f"Agent '{self.agent_id}' is online, powered by '{provider}' with model '{self.model_name}'.")
+        logger.info("Agent '%s' is online, powered by '%s' with model '%s'.", self.agent_id, provider, self.model_name)
 
         # self.tools 现在只包含“可选工具”
         self.tools: Dict[str, BaseTool] = {}
         # self.rag_tool 是一个特殊的、自动调用的工具
-        self.rag_tool: Optional[RAGTool] = None
+        self.rag_tool: Optional[BaseTool] = None
         self._load_and_register_tools(tools_package_path)
+        # 工具结果缓存在所有会话之间共享：不同目标中重复的搜索、算式和网页不再重复执行
+        self.tool_cache = ToolResultCache()
+        self.dispatcher = ActionDispatcher(self.tools, self.tool_cache)
+        # 工具列表在加载后不再变化，因此系统提示词只需序列化一次，所有会话共享
+        self._tool_descriptions = {name: tool.get_mcp_description() for name, tool in self.tools.items()}
+        self.prompt_builder = PromptBuilder(list(self._tool_descriptions.values()))
+        # TOOL_ROUTER_TOP_K > 0 时每个目标只列出最相关的工具；工具描述的向量在这里一次算好
+        self.tool_router = ToolRouter(self.tools)
+        self.tool_router.prepare()
         
-        print(f"  - Automatic RAG tool loaded: {'Yes' if self.rag_tool else 'No'}")
-        print(f"  - Selectable tools loaded: {list(self.tools.keys())}")
+        logger.info("  - Automatic RAG tool registered: %s", "Yes" if self.rag_tool else "No")
+        logger.info("  - Selectable tools loaded: %s", list(self.tools.keys()))
 
 
     def _load_and_register_tools(self, package_path: str):
-        """加载所有工具，并对 RAGTool 进行特殊注册。"""
-        # (加载逻辑与之前相同)
-        if not os.path.exists(package_path): return
-        for filename in os.listdir(package_path):
-            if filename.endswith("_tool.py"):
-                module_name = f"{package_path}.{filename[:-3]}"
-                try:
-                    module = importlib.import_module(module_name)
-                    for _, obj in inspect.getmembers(module, inspect.isclass):
-                        if issubclass(obj, BaseTool) and obj is not BaseTool:
-                            tool_instance = obj()
-                            # --- 关键改动：分离 RAG 工具 ---
-                            if isinstance(tool_instance, RAGTool):
-                                self.rag_tool = tool_instance
-                            else:
-                                self.tools[tool_instance.name] = tool_instance
-                except Exception as e:
-                    print(f"Error loading tool from {filename}: {e}")
-
-    def _reason(self, goal: str, retrieved_context:str) -> Dict[str, Any]:
-        """
-        ReAct 循环中的“思考”步骤。
-        这个方法将代替旧的 _decide_next_step。
-        """
-        history = self.memory.format_for_prompt()
-        tool_descriptions = [tool.get_mcp_description() for tool in self.tools.values()]
-        tools_json_string = json.dumps(tool_descriptions, indent=2, ensure_ascii=False)
-
-        system_prompt = f"""
-        # 使命
-        你是一个高度智能的自主代理，你的任务是利用一系列强大的工具来完成用户的 [最终目标]。
-        你将在一个 "思考 -> 行动 -> 观察" 的循环中工作。你的首要目标是高效、准确地达成最终的成功结果。
-        1.  **思考 (Thought)**: 首先，你必须分析 [最终目标] 并回顾完整的 [历史记录]（包括你之前所有的行动和观察结果）。为你的下一步行动制定一个清晰、简洁的计划。你的思考过程需要被明确地表达出来。
-        2.  **行动 (Action)**: 根据你的思考，从 [可用工具] 列表中选择最合适的一个工具，并确定其所需的输入参数。
-        3.  **观察 (Observation)**: 在你行动后，系统会向你提供该行动的结果。这个新的观察结果将被添加到历史记录中，用于指导你接下来的思考。
-
-        [可用工具]
-        {tools_json_string}
-
-        # 关键规则与限制 (必须严格遵守)
-        - **基于事实行动**: 你的所有行动都必须**只**基于 [历史记录] 中已有的信息，或用户在 [最终目标] 中明确提供的信息。
-        - **杜绝幻觉 (NO HALLUCINATION)**: **严禁**凭空捏造 URL、文件名或任何其他事实。如果你不知道某个信息（比如一个URL），你的首要任务是使用一个工具（比如 `web_surfer_tool`）去**找到它**。不要猜测。
-        - **必须处理错误**: 如果 '观察' (Observation) 的结果显示 `status: "error"`，你**必须**在下一步的 '思考' (Thought) 中解决它。
-        - **对于 404 Not Found 错误**: 这意味着URL是无效的或已失效。**不要**再次尝试同一个URL。你的下一步应该是使用 `web_surfer_tool` 寻找正确的URL。
-        - **对于其他工具错误**: 分析错误信息。如果是参数问题，就在下一步行动中修正 `action_input`。如果某个工具持续失败，请考虑更换策略。
-        - **工具协同**: 理解工具如何协同工作。使用 `web_surfer_tool` 来发现信息和URL；使用 `link_extractor_tool` 来探索已知网页以进行导航；使用 `web_browser_tool` 来阅读已确认有效的URL内容；使用 `file_writer_tool` 来保存信息。
-        - **任务完成**: 只有当 [最终目标] 被完全、彻底地满足时，你才应该使用特殊行动 `finish`。你在结束前的最后一个 '思考' (thought) 应该为用户提供一个全面的结果总结。
-
-        # 输出格式
-        你的回应**必须**是一个**单一、有效**的JSON对象，其结构如下。不要在JSON对象的前后添加任何额外的文本。
-        {{
-            "thought": "对当前情况的详细分析，以及你为下一步行动制定的计划。解释你*为什么*要选择这个行动。",
-            "action": "你将要使用的工具名称（从 [可用工具] 列表中选择），或者 'finish'（如果目标已完成）。",
-            "action_input": {{
-                "param1": "value1",
-                "param2": "value2"
-            }}
-        }}
-
-        [最终目标]
-        {goal}
-
-        [历史记录]
-        {history}
-
-        [背景信息]
-        {retrieved_context if retrieved_context else "无相关背景信息。"}
         """
-        
-        # 注意：这里的 user_prompt 留空，因为所有信息都在 system_prompt 里了
-        user_prompt = "Please proceed with the next step." 
- 
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        decision = json.loads(response.choices[0].message.content)
+        通过工具清单加载所有工具，并对自动调用的 RAG 工具进行特殊注册。
+        清单中的工具只是惰性代理，真正的模块导入和模型加载发生在第一次调用时。
+        """
+        for tool in load_tools(package_path):
+            # --- 关键改动：分离 RAG 工具 ---
+            if tool.auto_invoke:
+                self.rag_tool = tool
+            else:
+                self.tools[tool.name] = tool
+
+    def _create_client(self, provider: str, api_key: Optional[str], base_url: Optional[str]):
+        """创建同步的 LLM 客户端（真实服务商或离线的假客户端）。"""
+        return create_client(provider, api_key, base_url)
+
+    def _create_memory(self) -> ConversationMemory:
+        """为一个目标创建带 token 预算的记忆。"""
+        return ConversationMemory(summarizer=self._summarizer)
+
+    def new_session(self, goal: Any, on_event: Optional[EventCallback] = None,
+                    session_id: Optional[str] = None) -> AgentSession:
+        """为一个目标创建独立的会话（记忆、Prompt 状态、轮次计数）。"""
+        session = AgentSession(goal, self._create_memory(), self.prompt_builder.fork(),
+                               on_event=on_event, session_id=session_id)
+        session.memory.add_message("user", f"My goal is: {goal}")
+        return session
+
+    def _completion_kwargs(self, session: AgentSession) -> Dict[str, Any]:
+        """构造本轮 chat.completions.create 的参数。"""
+        with session.tracer.span("prompt_build") as span:
+            messages = session.prompt_builder.build(session.memory.get_history(), session.memory.generation)
+            stats = session.prompt_builder.turn_stats[-1]
+            span.set(messages=len(messages), prompt_bytes=stats["prompt_bytes"], new_bytes=stats["new_bytes"],
+                     tools=stats["tools"], schema_tokens_saved=stats["schema_tokens_saved"])
+        kwargs = {
+            "model": self.model_name,
+            "messages": messages,
+            "response_format": {"type": "json_object"},
+        }
+        if LLM_STREAM:
+            # 让服务商在最后一个分块里返回 token 用量
+            kwargs.update(stream=True, stream_options={"include_usage": True})
+        return kwargs
+
+    @staticmethod
+    def _reask_kwargs(kwargs: Dict[str, Any], content: Optional[str]) -> Dict[str, Any]:
+        """
+        重新询问的参数：在原消息后面追加模型的错误输出和纠正提示。
+        原消息是不变的前缀，服务商的前缀缓存会命中，因此重新询问只需要为新增的两条消息付费。
+        """
+        messages = kwargs["messages"] + [{"role": "assistant", "content": content or ""},
+                                         {"role": "user", "content": REASK_PROMPT}]
+        return {"model": kwargs["model"], "messages": messages, "response_format": kwargs["response_format"]}
+
+    @staticmethod
+    def _usage_attributes(usage: Optional[Any], content: Optional[str]) -> Dict[str, Any]:
+        """llm span 的属性：token 用量和回复的字符数。"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "cached_tokens": getattr(details, "cached_tokens", None) if details else None,
+            "response_chars": len(content or ""),
+        }
+
+    @staticmethod
+    def _record_usage(session: AgentSession, usage: Optional[Any]):
+        """记录 token 用量并输出本轮的 Prompt 统计。"""
+        builder = session.prompt_builder
+        builder.record_usage(usage)
+        stats = builder.turn_stats[-1]
+        logger.debug("📏 Prompt: %s bytes (+%s new), tokens: %s (cached: %s)", stats["prompt_bytes"],
+                     stats["new_bytes"], stats.get("prompt_tokens"), stats.get("cached_tokens"))
+
+    @staticmethod
+    def _decode(session: AgentSession, content: Optional[str]) -> Optional[Dict[str, Any]]:
+        """解析（必要时修复）模型的回复；无法解析时返回 None。"""
+        with session.tracer.span("decode", response_chars=len(content or "")) as span:
+            try:
+                decision = parse_decision(content)
+            except DecisionParseError as e:
+                logger.warning("🩹 %s", e)
+                decision = None
+            span.set(valid=decision is not None)
         return decision
-    
-    def run(self, goal: str):
+
+    @staticmethod
+    def _invalid_decision(session: AgentSession, content: Optional[str]) -> Dict[str, Any]:
+        """重新询问后仍无法解析：本轮不执行任何行动，并提醒模型下一轮使用正确的格式，循环继续。"""
+        logger.warning("⚠️ Model output is still not valid JSON, skipping this turn.")
+        session.memory.add_message("system", INVALID_JSON_NOTE)
+        return {"thought": (content or "").strip()[:500] or "No thought provided.", "actions": []}
+
+    @staticmethod
+    def _stream_events(parser: DecisionStreamParser, chunk: Any) -> List[Tuple[str, Any]]:
+        """把一个流式分块的内容交给增量解析器（只带 usage 的最后一个分块没有 choices）。"""
+        if not chunk.choices:
+            return []
+        return parser.feed(chunk.choices[0].delta.content)
+
+    def _stream(self, session: AgentSession, kwargs: Dict[str, Any], span: Span) -> Tuple[str, PendingActions, Any]:
         """
-        执行 ReAct 循环来完成一个复杂的目标。
+        流式接收模型输出，返回 (完整回复, 提前启动的行动, token 用量)。
+        thought 逐段输出并以 thought_delta 事件推送；没有副作用的行动一解析完整就提交到工具线程池，
+        与模型继续生成剩余内容并行执行。
         """
-        self.memory.clear()
-        self.memory.add_message("user", f"My goal is: {goal}")
-        
-        max_turns = 50 # 设置一个最大循环次数，防止无限循环
-        
+        parser = DecisionStreamParser()
+        pending: PendingActions = []
+        usage = None
+        # 逐段的思考直接写到 stdout；日志级别高于 INFO（例如 --quiet）时不输出
+        live = logger.isEnabledFor(logging.INFO)
+        if live:
+            sys.stdout.write("Thought: ")
+        for chunk in self.client.chat.completions.create(**kwargs):
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if "first_chunk_ms" not in span.attributes and chunk.choices:
+                span.set(first_chunk_ms=round(span.duration_ms, 3))
+            for kind, value in self._stream_events(parser, chunk):
+                if kind == "thought":
+                    if live:
+                        sys.stdout.write(value)
+                        sys.stdout.flush()
+                    session.emit("thought_delta", turn=session.turn, delta=value)
+                elif self.dispatcher.can_start_early(value, pending):
+                    pending.append((value, self.dispatcher.submit(value, session.tracer)))
+        if live:
+            sys.stdout.write("\n")
+        if pending:
+            logger.debug("⚡ Early dispatch: %s", [action["action"] for action, _ in pending])
+        return parser.text, pending, usage
+
+    def _reason(self, session: AgentSession) -> Tuple[Dict[str, Any], PendingActions]:
+        """
+        ReAct 循环中的“思考”步骤，返回 (决策, 流式解码时已经提前启动的行动)。
+        Prompt 由 PromptBuilder 增量构建：静态前缀 + 目标 + 逐条追加的历史消息。
+        输出不是合法 JSON 时先尝试修复，修复失败再重新询问，最终仍失败则跳过本轮而不是让循环崩溃。
+        """
+        kwargs = self._completion_kwargs(session)
+        pending: PendingActions = []
+        with session.tracer.span("llm", model=self.model_name, stream=LLM_STREAM) as span:
+            if LLM_STREAM:
+                content, pending, usage = self._stream(session, kwargs, span)
+            else:
+                response = self.client.chat.completions.create(**kwargs)
+                content, usage = response.choices[0].message.content, getattr(response, "usage", None)
+            span.set(early_actions=len(pending), **self._usage_attributes(usage, content))
+        self._record_usage(session, usage)
+        decision = self._decode(session, content)
+        for _ in range(LLM_JSON_RETRIES if decision is None else 0):
+            logger.warning("🔁 Re-asking the model for valid JSON...")
+            with session.tracer.span("llm", model=self.model_name, stream=False, reask=True) as span:
+                response = self.client.chat.completions.create(**self._reask_kwargs(kwargs, content))
+                content = response.choices[0].message.content
+                span.set(**self._usage_attributes(getattr(response, "usage", None), content))
+            decision = self._decode(session, content)
+            if decision is not None:
+                break
+        return (decision if decision is not None else self._invalid_decision(session, content)), pending
+
+    @staticmethod
+    def _record_decision(session: AgentSession, decision: Dict[str, Any],
+                         echo: bool = True) -> Tuple[str, List[Dict[str, Any]]]:
+        """从决策中取出思考过程和本轮的行动列表，并把思考过程写入记忆。流式模式下思考已经实时输出过，echo 为 False。"""
+        thought = decision.get("thought", "No thought provided.")
+        if echo:
+            logger.info("Thought: %s", thought)
+        session.memory.add_message("assistant", f"Thought: {thought}")
+        return thought, normalize_actions(decision)
+
+    @staticmethod
+    def _record_actions(session: AgentSession, actions: List[Dict[str, Any]], results: List[Dict[str, Any]]):
+        """把本轮所有行动及其观察结果一次性写入记忆（先行动、后观察，顺序与行动一致）。"""
+        for action in actions:
+            session.memory.add_message("assistant", format_action(action))
+        for action, tool_result in zip(actions, results):
+            observation = format_observation(action, tool_result)
+            logger.info("👀 Observation: %s", observation)
+            session.memory.add_message("system", observation)
+
+    def _begin(self, session: AgentSession):
+        session.tracer.begin("goal", session_id=session.session_id, agent_id=self.agent_id, model=self.model_name)
+
+    def _finish(self, session: AgentSession, result: str, finished: bool) -> str:
+        if finished:
+            logger.info("✅ Task Finished.")
+            session.memory.add_message("assistant", f"Final Answer: {result}")
+        else:
+            logger.warning("⚠️ Reached max turns. Stopping.")
+        session.complete(result, finished)
+        session.tracer.finish(turns=session.turn, finished=finished)
+        # span 在目标结束时一次性导出，每轮的热路径上没有文件 I/O
+        session.tracer.export()
+        logger.info("📊 Prompt totals: %s", session.prompt_builder.totals())
+        if self.tool_router.enabled:
+            logger.info("🧭 Tool router: %s", self.tool_router.stats())
+        logger.info("🧠 Memory: %s", session.memory.stats())
+        cache_stats = self.tool_cache.stats()
+        logger.info("🧰 Tool cache: hits=%s misses=%s hit_rate=%s size=%s", cache_stats["hits"],
+                    cache_stats["misses"], cache_stats["hit_rate"], cache_stats["size"])
+        logger.info("⏱️  Trace: %s", format_summary(session.tracer.summary()))
+        return result
+
+    @staticmethod
+    def _query(goal: Any) -> str:
+        return goal.data.get("query") if hasattr(goal, "data") else str(goal)
+
+    def prefetch_context(self, goals: List[Any], batch_size: int = RAG_PREFETCH_BATCH) -> int:
+        """
+        为一批目标预先检索知识库上下文（每 batch_size 个查询一次批量嵌入 + 一次向量化检索），
+        结果进入 RAGTool 的缓存，之后每个目标的 _retrieve_context 直接命中。返回预取的查询数。
+        """
+        queries = [query for query in (self._query(goal) for goal in goals) if query]
+        if self.rag_tool is None or not queries:
+            return 0
+        try:
+            # 惰性加载的 RAGTool 在第一次访问属性时才加载索引，加载失败（例如磁盘上没有索引）也在这里处理
+            retrieve_many = getattr(self.rag_tool, "retrieve_many", None)
+            if retrieve_many is None:
+                return 0
+            for i in range(0, len(queries), batch_size):
+                retrieve_many(queries[i:i + batch_size])
+        except Exception as e:
+            # 预取只是优化，失败时每个目标照常各自检索
+            logger.warning("⚠️ RAG prefetch failed: %s", e)
+            return 0
+        return len(queries)
+
+    def _describe(self, names: List[str]) -> List[Dict[str, Any]]:
+        return [self._tool_descriptions[name] for name in names]
+
+    def _routing_text(self, session: AgentSession) -> str:
+        return self._query(session.goal) or str(session.goal)
+
+    def _select_tools(self, session: AgentSession) -> Optional[List[Dict[str, Any]]]:
+        """按目标挑选要列在系统提示词中的工具；未启用工具路由时返回 None（列出全部工具）。"""
+        if not self.tool_router.enabled:
+            return None
+        with session.tracer.span("tool_router") as span:
+            names = self.tool_router.select(self._routing_text(session))
+            span.set(tools=len(names))
+        return self._describe(names)
+
+    def _update_tools(self, session: AgentSession, actions: List[Dict[str, Any]], thought: str):
+        """
+        根据本轮的行动调整本目标的工具列表：模型用了没有列出的工具时补上（或改用全部工具），
+        TOOL_ROUTER_PER_TURN 开启时再按本轮的思考补充相关工具。
+        """
+        builder = session.prompt_builder
+        names = self.tool_router.resolve(builder.tool_names, [action["action"] for action in actions])
+        names = self.tool_router.expand(names, thought)
+        if builder.set_tools(self._describe(names)):
+            logger.debug("🧭 Tools for this goal: %s", names)
+
+    def _retrieve_context(self, session: AgentSession) -> str:
+        """为当前目标从知识库检索背景信息（结果由 RAGTool 缓存）。"""
+        if not self.rag_tool:
+            return ""
+        query = self._query(session.goal)
+        with session.tracer.span("rag", query_chars=len(query or "")) as span:
+            rag_result = self.rag_tool.execute(query=query)
+            context = rag_result.get("retrieved_context", "")
+            span.set(status=rag_result.get("status"), context_chars=len(context))
+        if rag_result.get("status") == "success":
+            logger.debug("📚 RAG cache: %s", self.rag_tool.cache_stats())
+        return context
+
+    def run(self, goal: Any, max_turns: int = 50, on_event: Optional[EventCallback] = None) -> str:
+        """
+        执行 ReAct 循环来完成一个复杂的目标。每次调用都使用一个新的会话，可以在多个线程中并发调用。
+        """
+        return self.run_session(self.new_session(goal, on_event=on_event), max_turns)
+
+    def run_session(self, session: AgentSession, max_turns: int = 50) -> str:
+        """在给定的会话中执行 ReAct 循环，结束后可以从 session.summary() 取得统计信息。"""
+        self._begin(session)
+        # 每个目标只检索一次：查询在整个 ReAct 循环中不变，没必要每轮都重新嵌入和查询向量库
+        retrieved_context = self._retrieve_context(session)
+        session.prompt_builder.start_goal(session.goal, retrieved_context, self._select_tools(session))
+
+        while session.turn < max_turns:
+            session.turn += 1
+            with session.tracer.turn_span(turn=session.turn):
+                logger.info("\n--- Turn %s/%s ---", session.turn, max_turns)
+
+                # 1. 思考 (Reason)
+                logger.info("🤔 Thinking...")
+
+                decision, pending = self._reason(session)
+                thought, actions = self._record_decision(session, decision, echo=not LLM_STREAM)
+                session.emit("thought", turn=session.turn, thought=thought)
+
+                # 2. 检查是否完成
+                if is_finish(actions):
+                    self.dispatcher.discard(pending)
+                    session.emit("final", turn=session.turn, result=thought, finished=True)
+                    return self._finish(session, thought, finished=True)
+
+                # 3. 行动 (Act)：本轮的所有行动相互独立，并行分发
+                actions = executable_actions(actions)
+                if self.tool_router.enabled:
+                    self._update_tools(session, actions, thought)
+                for action in actions:
+                    logger.info("🎬 Acting: Using tool '%s' with input %s", action["action"], action["action_input"])
+                    session.emit("action", turn=session.turn, action=action["action"], action_input=action["action_input"])
+                tool_results = self.dispatcher.dispatch(actions, pending, session.tracer)
 
-        for i in range(max_turns):
-            print(f"\n--- Turn {i+1}/{max_turns} ---")
-            
-            # 1. 思考 (Reason)
-            print("🤔 Thinking...")
-            
-            rag_result = self.rag_tool.execute(query=goal.data["query"]) 
-            retrieved_context = rag_result.get("retrieved_context", "")
-
-            # 把 context 作为参数传递给 _reason
-            decision = self._reason(goal, retrieved_context) 
-            thought = decision.get("thought", "No thought provided.")
-            action = decision.get("action")
-            action_input = decision.get("action_input", {})
-            print(f"Thought: {thought}")
-            self.memory.add_message("assistant", f"Thought: {thought}")
-
-            # 2. 检查是否完成
-            if action == "finish":
-                print("✅ Task Finished.")
-                self.memory.add_message("assistant", f"Final Answer: {thought}")
-                return thought
-
-            # 3. 行动 (Act)
-            if action in self.tools:
-                print(f"🎬 Acting: Using tool '{action}' with input {action_input}")
-                self.memory.add_message("assistant", f"Action: Using tool {action} with input {json.dumps(action_input)}")
-                
                 # 4. 观察 (Observe)
-                tool_result = self.tools[action].execute(**action_input)
-                observation = f"Tool {action} returned: {json.dumps(tool_result, ensure_ascii=False)}"
-                print(f"👀 Observation: {observation}")
-                self.memory.add_message("system", observation)
+                self._record_actions(session, actions, tool_results)
+                for action, tool_result in zip(actions, tool_results):
+                    session.emit("observation", turn=session.turn, action=action["action"], observation=tool_result)
+
+        result = "The agent reached the maximum number of turns without finishing the task."
+        session.emit("final", turn=session.turn, result=result, finished=False)
+        return self._finish(session, result, finished=False)
+
+
+class AsyncSmartAgent(SmartAgent):
+    """
+    基于 AsyncOpenAI 和 BaseTool.aexecute 的异步 Agent。
+    每次 arun 都使用独立的会话，因此同一个实例可以在一个事件循环里并发驱动大量目标。
+    """
+    def _create_client(self, provider: str, api_key: Optional[str], base_url: Optional[str]):
+        return create_client(provider, api_key, base_url, async_client=True)
+
+    def _create_memory(self) -> ConversationMemory:
+        # 追加消息时不在事件循环里压缩，每轮开始前由 _acompact 在线程池中完成
+        return ConversationMemory(summarizer=self._summarizer, auto_compact=False)
+
+    async def _acompact(self, session: AgentSession):
+        """历史超出预算时在线程池中压缩（可能调用同步的 LLM 摘要），不阻塞其他目标。"""
+        if session.memory.needs_compaction():
+            await asyncio.get_running_loop().run_in_executor(get_tool_executor(), session.memory.compact)
+
+    async def _astream(self, session: AgentSession, kwargs: Dict[str, Any],
+                       span: Span) -> Tuple[str, PendingActions, Any]:
+        """
+        _stream 的异步版本。多个目标共享一个终端，因此思考增量只通过 thought_delta 事件推送，不逐段输出；
+        提前解析出的无副作用行动作为任务在事件循环中立即开始执行。
+        """
+        parser = DecisionStreamParser()
+        pending: PendingActions = []
+        usage = None
+        async for chunk in await self.client.chat.completions.create(**kwargs):
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if "first_chunk_ms" not in span.attributes and chunk.choices:
+                span.set(first_chunk_ms=round(span.duration_ms, 3))
+            for kind, value in self._stream_events(parser, chunk):
+                if kind == "thought":
+                    await session.aemit("thought_delta", turn=session.turn, delta=value)
+                elif self.dispatcher.can_start_early(value, pending):
+                    pending.append((value, self.dispatcher.asubmit(value, session.tracer)))
+        if pending:
+            logger.debug("⚡ Early dispatch: %s", [action["action"] for action, _ in pending])
+        return parser.text, pending, usage
+
+    async def _areason(self, session: AgentSession) -> Tuple[Dict[str, Any], PendingActions]:
+        kwargs = self._completion_kwargs(session)
+        pending: PendingActions = []
+        with session.tracer.span("llm", model=self.model_name, stream=LLM_STREAM) as span:
+            if LLM_STREAM:
+                content, pending, usage = await self._astream(session, kwargs, span)
             else:
-                observation = f"Error: Unknown action '{action}'. Available tools are: {list(self.tools.keys())}"
-                print(f"👀 Observation: {observation}")
-                self.memory.add_message("system", observation)
+                response = await self.client.chat.completions.create(**kwargs)
+                content, usage = response.choices[0].message.content, getattr(response, "usage", None)
+            span.set(early_actions=len(pending), **self._usage_attributes(usage, content))
+        self._record_usage(session, usage)
+        decision = self._decode(session, content)
+        for _ in range(LLM_JSON_RETRIES if decision is None else 0):
+            logger.warning("🔁 Re-asking the model for valid JSON...")
+            with session.tracer.span("llm", model=self.model_name, stream=False, reask=True) as span:
+                response = await self.client.chat.completions.create(**self._reask_kwargs(kwargs, content))
+                content = response.choices[0].message.content
+                span.set(**self._usage_attributes(getattr(response, "usage", None), content))
+            decision = self._decode(session, content)
+            if decision is not None:
+                break
+        return (decision if decision is not None else self._invalid_decision(session, content)), pending
+
+    async def _aretrieve_context(self, session: AgentSession) -> str:
+        if not self.rag_tool:
+            return ""
+        query = self._query(session.goal)
+        with session.tracer.span("rag", query_chars=len(query or "")) as span:
+            # RAG 检索是 CPU 密集的同步调用，aexecute 会把它放到线程池里执行，避免阻塞事件循环
+            rag_result = await self.rag_tool.aexecute(query=query)
+            context = rag_result.get("retrieved_context", "")
+            span.set(status=rag_result.get("status"), context_chars=len(context))
+        return context
+
+    async def _aselect_tools(self, session: AgentSession) -> Optional[List[Dict[str, Any]]]:
+        if not self.tool_router.enabled:
+            return None
+        with session.tracer.span("tool_router") as span:
+            # 目标文本的向量通常已经由 RAG 检索算过并进入嵌入缓存；未命中时需要一次模型调用
+            names = await asyncio.get_running_loop().run_in_executor(
+                get_tool_executor(), self.tool_router.select, self._routing_text(session))
+            span.set(tools=len(names))
+        return self._describe(names)
+
+    async def arun(self, goal: Any, max_turns: int = 50, on_event: Optional[EventCallback] = None) -> str:
+        """
+        异步执行 ReAct 循环。LLM 调用和工具执行期间会让出事件循环，其他目标可以同时推进。
+        如果提供了 on_event，每一步的思考、行动、观察和最终结果都会以事件的形式回调（可以是协程函数）。
+        """
+        return await self.arun_session(self.new_session(goal, on_event=on_event), max_turns)
+
+    async def arun_session(self, session: AgentSession, max_turns: int = 50) -> str:
+        self._begin(session)
+        retrieved_context = await self._aretrieve_context(session)
+        session.prompt_builder.start_goal(session.goal, retrieved_context, await self._aselect_tools(session))
+
+        while session.turn < max_turns:
+            session.turn += 1
+            with session.tracer.turn_span(turn=session.turn):
+                logger.info("\n--- Turn %s/%s ---", session.turn, max_turns)
+                await self._acompact(session)
+                decision, pending = await self._areason(session)
+                thought, actions = self._record_decision(session, decision)
+                await session.aemit("thought", turn=session.turn, thought=thought)
+
+                if is_finish(actions):
+                    self.dispatcher.discard(pending)
+                    await session.aemit("final", turn=session.turn, result=thought, finished=True)
+                    return self._finish(session, thought, finished=True)
+
+                actions = executable_actions(actions)
+                if self.tool_router.enabled:
+                    # 每轮选择需要嵌入思考内容，放到线程池中执行
+                    await asyncio.get_running_loop().run_in_executor(
+                        get_tool_executor(), self._update_tools, session, actions, thought)
+                for action in actions:
+                    logger.info("🎬 Acting: Using tool '%s' with input %s", action["action"], action["action_input"])
+                    await session.aemit("action", turn=session.turn, action=action["action"], action_input=action["action_input"])
+                tool_results = await self.dispatcher.adispatch(actions, pending, session.tracer)
+                self._record_actions(session, actions, tool_results)
+                for action, tool_result in zip(actions, tool_results):
+                    await session.aemit("observation", turn=session.turn, action=action["action"], observation=tool_result)
+
+        result = "The agent reached the maximum number of turns without finishing the task."
+        await session.aemit("final", turn=session.turn, result=result, finished=False)
+        return self._finish(session, result, finished=False)
 
-        print("⚠️ Reached max turns. Stopping.")
-        return "The agent reached the maximum number of turns without finishing the task."
\ No newline at end of file
+    def run(self, goal: Any, max_turns: int = 50, on_event: Optional[EventCallback] = None) -> str:
+        """同步入口：在新的事件循环中执行 arun。"""
+        return asyncio.run(self.arun(goal, max_turns, on_event))
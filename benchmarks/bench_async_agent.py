@@ -0,0 +1,81 @@
+"""
+对比同步 SmartAgent.run 与 AsyncSmartAgent.arun 的吞吐量 (goals/sec)。
+
+LLM 和网页都由本地的 FakeLLMServer 提供，并注入固定延迟，因此结果只反映 Agent 引擎本身的并发能力。
+
+用法: python -m benchmarks.bench_async_agent --goals 200 --concurrency 100 --latency-ms 200
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+from benchmarks.fake_llm_server import FakeLLMServer
+from mcp.protocol import MCPMessage
+
+
+def _make_goal(i: int) -> MCPMessage:
+    return MCPMessage(sender_id="bench", receiver_id="bench_agent", task="user_query", data={"query": f"goal {i}"})
+
+
+def bench_sync(goals: int) -> float:
+    from agent import SmartAgent
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent = SmartAgent(agent_id="bench_agent")
+        start = time.perf_counter()
+        for i in range(goals):
+            agent.run(_make_goal(i))
+    return time.perf_counter() - start
+
+
+async def _run_async(agent, goals: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            return await agent.arun(_make_goal(i))
+
+    return await asyncio.gather(*(one(i) for i in range(goals)))
+
+
+def bench_async(goals: int, concurrency: int) -> float:
+    from agent import AsyncSmartAgent
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent = AsyncSmartAgent(agent_id="bench_agent")
+        start = time.perf_counter()
+        asyncio.run(_run_async(agent, goals, concurrency))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync vs async agent throughput against a fake LLM.")
+    parser.add_argument("--goals", type=int, default=200)
+    parser.add_argument("--sync-goals", type=int, default=20, help="同步模式很慢，单独设置较少的目标数。")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--page-latency-ms", type=float, default=50)
+    parser.add_argument("--tool-steps", type=int, default=1)
+    args = parser.parse_args()
+
+    with FakeLLMServer(latency_ms=args.latency_ms, page_latency_ms=args.page_latency_ms, tool_steps=args.tool_steps) as server:
+        os.environ.update({
+            "LLM_PROVIDER": "custom",
+            "CUSTOM_LLM_API_KEY": "fake",
+            "CUSTOM_LLM_MODEL_NAME": "fake",
+            "CUSTOM_LLM_BASE_URL": f"{server.base_url}/v1",
+        })
+        sync_elapsed = bench_sync(args.sync_goals)
+        async_elapsed = bench_async(args.goals, args.concurrency)
+
+    sync_rate = args.sync_goals / sync_elapsed
+    async_rate = args.goals / async_elapsed
+    print(f"sync : {args.sync_goals:5d} goals in {sync_elapsed:8.2f}s -> {sync_rate:8.2f} goals/sec")
+    print(f"async: {args.goals:5d} goals in {async_elapsed:8.2f}s -> {async_rate:8.2f} goals/sec "
+          f"(concurrency={args.concurrency})")
+    print(f"speedup: {async_rate / sync_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+共享嵌入服务的动态批处理收益：多个客户端进程同时发送单条查询，对比不凑批（max_batch=1）和动态批处理。
+
+默认使用模拟模型：每次调用固定耗时 --call-ms，每个文本再加 --text-ms，与真实 Transformer 在 CPU 上
+"一次前向的固定开销 + 与批大小近似线性的部分" 的形状一致；--model 换成真实的 sentence-transformers 模型。
+服务在本进程的后台线程中运行，客户端是独立的进程（与多个 Agent 工作进程的情形相同）。
+
+用法:
+    python -m benchmarks.bench_embedding_server --clients 16 --requests 100
+    python -m benchmarks.bench_embedding_server --clients 8 --model all-MiniLM-L6-v2
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import zlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag.embedding_server import EmbeddingClient, EmbeddingServer
+
+
+class SimulatedModel(Embeddings):
+    def __init__(self, call_ms: float, text_ms: float, dim: int = 384):
+        self.call_ms = call_ms
+        self.text_ms = text_ms
+        self.dim = dim
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep((self.call_ms + self.text_ms * len(texts)) / 1000)
+        # 向量本身只需确定且便宜，耗时全部由上面的模拟决定
+        return [np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dim).tolist()
+                for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # 与 HuggingFaceEmbeddings（未设置 query_encode_kwargs）一样，批量查询走一次前向
+        return self.embed_documents(texts)
+
+
+def client_worker(socket_path: str, client_id: int, requests: int, results):
+    client = EmbeddingClient(socket_path)
+    client.embed_query("warm up")
+    latencies = []
+    start = time.time()
+    for i in range(requests):
+        t0 = time.perf_counter()
+        client.embed_query(f"client {client_id} question {i} about product SKU-{i * 31 % 997}")
+        latencies.append((time.perf_counter() - t0) * 1000)
+    results.put((start, time.time(), latencies))
+
+
+def serve_in_thread(loop: asyncio.AbstractEventLoop, task: asyncio.Task):
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+
+
+def run(embeddings: Embeddings, model_name: str, clients: int, requests: int, max_batch: int, max_wait_ms: float):
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="bench-emb-"), "embedding.sock")
+    server = EmbeddingServer(embeddings, socket_path, model_name, max_batch=max_batch, max_wait_ms=max_wait_ms)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(server.serve())
+    thread = threading.Thread(target=serve_in_thread, args=(loop, task), daemon=True)
+    thread.start()
+    server.ready.wait()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    processes = [ctx.Process(target=client_worker, args=(socket_path, i, requests, results)) for i in range(clients)]
+    for process in processes:
+        process.start()
+    runs = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    info = server.info()
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(timeout=5)
+
+    wall = max(end for _, end, _ in runs) - min(start for start, _, _ in runs)
+    latencies = sorted(latency for _, _, run_latencies in runs for latency in run_latencies)
+    return {
+        "qps": len(latencies) / wall,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "mean_batch": info["mean_batch"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dynamic batching in the shared embedding server.")
+    parser.add_argument("--clients", type=int, default=16, help="客户端进程数。")
+    parser.add_argument("--requests", type=int, default=100, help="每个客户端顺序发送的查询数。")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--call-ms", type=float, default=8.0, help="模拟模型每次调用的固定耗时。")
+    parser.add_argument("--text-ms", type=float, default=0.3, help="模拟模型每个文本的耗时。")
+    parser.add_argument("--model", help="使用真实的 sentence-transformers 嵌入模型。")
+    args = parser.parse_args()
+
+    if args.model:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings, model_name = HuggingFaceEmbeddings(model_name=args.model), args.model
+    else:
+        embeddings = SimulatedModel(args.call_ms, args.text_ms)
+        model_name = f"simulated({args.call_ms}ms + {args.text_ms}ms/text)"
+
+    print(f"{args.clients} clients x {args.requests} queries, model={model_name}")
+    print(f"{'server':22s}{'queries/s':>11s}{'p50 ms':>9s}{'p95 ms':>9s}{'mean batch':>12s}")
+    for name, max_batch in (("no batching", 1), (f"dynamic (max {args.max_batch})", args.max_batch)):
+        result = run(embeddings, model_name, args.clients, args.requests, max_batch, args.max_wait_ms)
+        print(f"{name:22s}{result['qps']:11.1f}{result['p50_ms']:9.2f}{result['p95_ms']:9.2f}{result['mean_batch']:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+完整 ReAct 循环的离线端到端基准：LLM_PROVIDER=fake + FAKE_WEB=1，不访问任何网络服务。
+
+每个目标都会经过 RAG 检索（如果有 rag_db）、Prompt 构建、假 LLM 决策、web_surfer_tool 搜索、
+web_browser_tool 抓取与文本提取、记忆写入等全部环节，因此测得的 CPU 时间就是 Agent 自身的开销。
+报告 turns/sec、每轮 Prompt 字节数和每轮 CPU 时间，--json 可以输出机器可读的结果用于 CI 回归比较。
+
+用法: python -m benchmarks.bench_end_to_end --goals 50 --concurrency 16 --llm-latency-ms 0
+      python -m benchmarks.bench_end_to_end --stream --chunk-ms 5 --web-latency-ms 100   # 流式 + 提前分发
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+
+def _goal(i: int):
+    from mcp.protocol import MCPMessage
+    return MCPMessage(sender_id="bench", receiver_id="bench_agent", task="user_query", data={"query": f"benchmark goal {i}"})
+
+
+def _summarize(mode: str, sessions: List[Any], wall: float, cpu: float) -> Dict[str, Any]:
+    turns = sum(s.turn for s in sessions)
+    prompt_bytes = sum(s.prompt_builder.totals()["prompt_bytes"] for s in sessions)
+    return {
+        "mode": mode,
+        "goals": len(sessions),
+        "finished": sum(1 for s in sessions if s.finished),
+        "turns": turns,
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "goals_per_sec": round(len(sessions) / wall, 2) if wall else 0.0,
+        "turns_per_sec": round(turns / wall, 2) if wall else 0.0,
+        "prompt_bytes_per_turn": round(prompt_bytes / turns) if turns else 0,
+        "cpu_ms_per_turn": round(cpu * 1000 / turns, 3) if turns else 0.0,
+    }
+
+
+def bench_sync(goals: int) -> Dict[str, Any]:
+    from agent import SmartAgent
+    agent = SmartAgent(agent_id="bench_agent")
+    sessions = [agent.new_session(_goal(i)) for i in range(goals)]
+    wall, cpu = time.perf_counter(), time.process_time()
+    for session in sessions:
+        agent.run_session(session)
+    return _summarize("sync", sessions, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def bench_async(goals: int, concurrency: int) -> Dict[str, Any]:
+    from agent import AsyncSmartAgent
+    agent = AsyncSmartAgent(agent_id="bench_agent")
+    sessions = [agent.new_session(_goal(i)) for i in range(goals)]
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(session):
+            async with semaphore:
+                await agent.arun_session(session)
+
+        await asyncio.gather(*(one(s) for s in sessions))
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    asyncio.run(run_all())
+    return _summarize(f"async x{concurrency}", sessions, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the full ReAct loop.")
+    parser.add_argument("--goals", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="假 LLM 每次调用的延迟。")
+    parser.add_argument("--web-latency-ms", type=float, default=0, help="假网页/搜索每次请求的延迟。")
+    parser.add_argument("--tool-steps", type=int, default=2, help="每个目标在 finish 前阅读的网页数。")
+    parser.add_argument("--stream", action="store_true", help="流式接收假 LLM 的输出，并提前分发行动 (LLM_STREAM=1)。")
+    parser.add_argument("--chunk-ms", type=float, default=0, help="流式输出时每个分块之间的延迟。")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果。")
+    args = parser.parse_args()
+
+    # 这些配置在模块导入时读取，必须在导入 agent 之前设置
+    os.environ.update({
+        "LLM_PROVIDER": "fake",
+        "FAKE_WEB": "1",
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_WEB_LATENCY_MS": str(args.web_latency_ms),
+        "FAKE_LLM_TOOL_STEPS": str(args.tool_steps),
+        "FAKE_LLM_CHUNK_MS": str(args.chunk_ms),
+        "LLM_STREAM": "1" if args.stream else "0",
+    })
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [bench_sync(args.goals), bench_async(args.goals, args.concurrency)]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':12s} {'goals':>6s} {'turns':>6s} {'wall s':>8s} {'cpu s':>8s} {'turns/s':>9s} "
+          f"{'bytes/turn':>11s} {'cpu ms/turn':>12s}")
+    for r in results:
+        print(f"{r['mode']:12s} {r['goals']:6d} {r['turns']:6d} {r['wall_s']:8.2f} {r['cpu_s']:8.2f} "
+              f"{r['turns_per_sec']:9.1f} {r['prompt_bytes_per_turn']:11d} {r['cpu_ms_per_turn']:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
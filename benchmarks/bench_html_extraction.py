@@ -0,0 +1,114 @@
+"""
+对比 WebBrowserTool 旧的整页提取方式与新的流式提取方式。
+
+- legacy: 读取完整正文 -> apparent_encoding（对全文做编码探测）-> BeautifulSoup(html.parser) -> 截断
+- stream: 按块解码、增量解析，收集够 word_limit 个单词即停止（分别测试 html.parser 和 lxml）
+
+用法:
+    python -m benchmarks.bench_html_extraction --corpus ./saved_pages --word-limit 1000
+不指定 --corpus 时会生成若干个大小为 --page-mb 的合成页面。
+"""
+import argparse
+import glob
+import os
+import random
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from bs4 import BeautifulSoup
+from requests.compat import chardet
+
+from tools.html_text import extract_visible_text, _lxml_etree
+
+CHUNK_SIZE = 16 * 1024
+WORDS = "the quick brown fox jumps over lazy dog agent memory tool search page 网页 内容 搜索 工具".split()
+
+
+def legacy_extract(html_bytes: bytes, word_limit: int) -> str:
+    encoding = chardet.detect(html_bytes).get("encoding") or "utf-8"  # 即 response.apparent_encoding
+    soup = BeautifulSoup(html_bytes.decode(encoding, errors="replace"), "html.parser")
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    text = soup.get_text()
+    lines = (line.strip() for line in text.splitlines())
+    clean_text = "\n".join(line for line in lines if line)
+    words = clean_text.split()
+    if len(words) > word_limit:
+        return " ".join(words[:word_limit]) + "..."
+    return clean_text
+
+
+def stream_extract(html_bytes: bytes, word_limit: int, parser: str) -> str:
+    chunks = (html_bytes[i:i + CHUNK_SIZE] for i in range(0, len(html_bytes), CHUNK_SIZE))
+    text, _ = extract_visible_text(chunks, word_limit=word_limit, max_bytes=len(html_bytes), parser=parser)
+    return text
+
+
+def synthesize_page(size_bytes: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    parts = ["<html><head><meta charset='utf-8'><title>Synthetic</title>",
+             "<style>" + "body { margin: 0 } " * 500 + "</style></head><body>"]
+    size = sum(len(p) for p in parts)
+    while size < size_bytes:
+        if rng.random() < 0.1:
+            block = "<script>var x = " + ",".join(str(rng.random()) for _ in range(200)) + ";</script>"
+        else:
+            block = "<div class='row'><p>" + " ".join(rng.choice(WORDS) for _ in range(80)) + "</p><a href='/x'>link</a></div>\n"
+        parts.append(block)
+        size += len(block.encode("utf-8"))
+    parts.append("</body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def load_corpus(args) -> List[Tuple[str, bytes]]:
+    if args.corpus:
+        paths = sorted(glob.glob(os.path.join(args.corpus, "**", "*.htm*"), recursive=True))
+        return [(path, open(path, "rb").read()) for path in paths]
+    return [(f"synthetic-{i}", synthesize_page(int(args.page_mb * 1024 * 1024), i)) for i in range(args.pages)]
+
+
+def measure(fn: Callable[[bytes], str], corpus: List[Tuple[str, bytes]]) -> Tuple[float, float]:
+    """返回 (每页平均耗时 ms, 最大峰值内存 MB)。耗时和内存分开测量，避免 tracemalloc 影响计时。"""
+    start = time.perf_counter()
+    for _, html_bytes in corpus:
+        fn(html_bytes)
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(corpus)
+
+    peak = 0
+    for _, html_bytes in corpus:
+        tracemalloc.start()
+        fn(html_bytes)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return elapsed_ms, peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark legacy vs streaming HTML text extraction.")
+    parser.add_argument("--corpus", help="包含已保存 .html 文件的目录。")
+    parser.add_argument("--pages", type=int, default=5, help="未指定 --corpus 时生成的页面数。")
+    parser.add_argument("--page-mb", type=float, default=4.0, help="合成页面的大小 (MB)。")
+    parser.add_argument("--word-limit", type=int, default=1000)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    if not corpus:
+        parser.error("corpus is empty")
+    total_mb = sum(len(b) for _, b in corpus) / (1024 * 1024)
+    print(f"{len(corpus)} pages, {total_mb:.1f} MB total, word_limit={args.word_limit}")
+
+    variants = [
+        ("legacy (bs4 + apparent_encoding)", lambda b: legacy_extract(b, args.word_limit)),
+        ("stream (html.parser)", lambda b: stream_extract(b, args.word_limit, "html.parser")),
+    ]
+    if _lxml_etree is not None:
+        variants.append(("stream (lxml)", lambda b: stream_extract(b, args.word_limit, "lxml")))
+
+    for name, fn in variants:
+        elapsed_ms, peak_mb = measure(fn, corpus)
+        print(f"{name:34s} {elapsed_ms:10.2f} ms/page   peak {peak_mb:8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
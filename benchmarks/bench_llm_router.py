@@ -0,0 +1,100 @@
+"""
+多服务商路由（llm/router.py）的延迟和可用性：两个本地假 OpenAI 兼容服务器，各自注入基础延迟和长尾延迟。
+
+场景:
+- direct:   只用第一个服务商的 OpenAI 客户端（原来的单服务商方式）；
+- router:   延迟感知路由，不对冲；
+- hedge:    延迟感知路由 + 对冲请求（主服务商超过 p95 时向第二个服务商补发一次）；
+- failover: 路由 + 对冲，运行到一半时第一个服务商开始全部返回 503。
+
+用法:
+    python -m benchmarks.bench_llm_router --requests 400 --concurrency 8
+    python -m benchmarks.bench_llm_router --slow-fraction 0.05 --slow-latency-ms 2000
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import openai
+
+from benchmarks.fake_llm_server import FakeLLMServer
+from llm.router import ProviderConfig, ProviderRouter, RouterClient
+
+MESSAGES = [{"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "Which page should I read next?"}]
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float("nan")
+
+
+def run(client: Any, requests: int, concurrency: int, on_halfway=None) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+
+    def one(i: int):
+        nonlocal errors
+        if on_halfway is not None and i == requests // 2:
+            on_halfway()
+        start = time.perf_counter()
+        try:
+            client.chat.completions.create(model="bench", messages=MESSAGES)
+        except openai.OpenAIError:
+            errors += 1
+            return
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {"ok": len(latencies), "errors": errors, "rps": requests / wall, "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95), "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else float("nan")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark latency-aware routing, hedging and failover across two fake LLM servers.")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, nargs=2, default=[40, 70], help="两个服务器的基础延迟。")
+    parser.add_argument("--slow-fraction", type=float, default=0.03, help="每个服务器耗时 --slow-latency-ms 的请求比例。")
+    parser.add_argument("--slow-latency-ms", type=float, default=1500)
+    parser.add_argument("--timeout", type=float, default=10.0, help="每个服务商的超时（秒）。")
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, base latency {args.latency_ms} ms, "
+          f"{args.slow_fraction:.0%} of requests take {args.slow_latency_ms:.0f} ms")
+    print(f"{'scenario':10s}{'ok':>6s}{'errors':>8s}{'req/s':>8s}{'p50 ms':>9s}{'p95 ms':>9s}{'p99 ms':>9s}"
+          f"{'max ms':>9s}  share / hedges")
+    for scenario in ("direct", "router", "hedge", "failover"):
+        servers = [FakeLLMServer(latency_ms=latency, slow_fraction=args.slow_fraction,
+                                 slow_latency_ms=args.slow_latency_ms, seed=i).start()
+                   for i, latency in enumerate(args.latency_ms)]
+        try:
+            configs = [ProviderConfig(name=f"server{i}", model=f"model{i}", base_url=f"{server.base_url}/v1",
+                                      api_key="bench", timeout=args.timeout) for i, server in enumerate(servers)]
+            on_halfway = None
+            if scenario == "direct":
+                client = openai.OpenAI(api_key="bench", base_url=configs[0].base_url, timeout=args.timeout)
+            else:
+                client = RouterClient(ProviderRouter(configs, hedge=scenario in ("hedge", "failover")))
+                if scenario == "failover":
+                    on_halfway = lambda: setattr(servers[0], "failing", True)
+            result = run(client, args.requests, args.concurrency, on_halfway)
+            served = [server.requests_served for server in servers]
+            detail = "/".join(f"{count / max(sum(served), 1):.0%}" for count in served)
+            if isinstance(client, RouterClient):
+                detail += f"  hedges={sum(s['hedges'] for s in client.stats().values())}"
+                detail += f" wins={sum(s['hedge_wins'] for s in client.stats().values())}"
+            print(f"{scenario:10s}{result['ok']:6d}{result['errors']:8d}{result['rps']:8.1f}{result['p50']:9.1f}"
+                  f"{result['p95']:9.1f}{result['p99']:9.1f}{result['max']:9.1f}  {detail}")
+        finally:
+            for server in servers:
+                server.stop()
+
+
+if __name__ == "__main__":
+    main()
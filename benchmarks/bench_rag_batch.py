@@ -0,0 +1,92 @@
+"""
+批量检索 (HybridRetriever.retrieve_many) 与逐条检索的吞吐量对比，批大小 1–256，CPU 上运行。
+
+逐条检索时每个查询各做一次嵌入和一次向量检索；批量检索时一批查询只调用一次模型、做一次矩阵化的 top-k。
+语料和默认的哈希嵌入与 bench_rag_retrieval 相同；哈希嵌入本身没有批处理收益，
+--model 换成真实的 sentence-transformers 模型时才能看到模型前向的批处理收益。
+
+用法:
+    python -m benchmarks.bench_rag_batch --docs 20000 --queries 512 --backend mmap
+    python -m benchmarks.bench_rag_batch --backend chroma --mode vector --model all-MiniLM-L6-v2
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+from benchmarks.bench_rag_retrieval import HashingEmbeddings, synthesize_corpus, synthesize_queries
+from rag.hybrid import HybridRetriever
+from rag.mmap_store import MmapCollection
+from rag.sparse import BM25Index
+
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def build_collection(backend: str, corpus, embeddings, directory: str, batch_size: int = 512):
+    if backend == "mmap":
+        collection = MmapCollection(directory)
+    else:
+        import chromadb
+        collection = chromadb.EphemeralClient().create_collection(
+            f"bench-batch-{int(time.time() * 1000)}", metadata={"hnsw:space": "cosine"})
+    sparse = BM25Index()
+    for i in range(0, len(corpus), batch_size):
+        batch = corpus[i:i + batch_size]
+        texts = [text for _, _, text in batch]
+        collection.upsert(ids=[chunk_id for chunk_id, _, _ in batch], embeddings=embeddings.embed_documents(texts),
+                          documents=texts, metadatas=[{"topic": topic} for _, topic, _ in batch])
+        for chunk_id, topic, text in batch:
+            sparse.add(chunk_id, text, {"topic": topic})
+    if hasattr(collection, "flush"):
+        collection.flush()
+    return collection, sparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched vs per-query retrieval throughput.")
+    parser.add_argument("--docs", type=int, default=20000, help="合成语料的文本块数量。")
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--backend", choices=("mmap", "chroma"), default="mmap")
+    parser.add_argument("--mode", choices=("hybrid", "vector"), default="hybrid")
+    parser.add_argument("--model", help="使用真实的 sentence-transformers 嵌入模型（默认用哈希嵌入）。")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.model:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=args.model)
+    else:
+        embeddings = HashingEmbeddings()
+
+    corpus = synthesize_corpus(args.docs, args.seed)
+    queries = [query for _, query, _ in synthesize_queries(corpus, args.queries, args.seed)]
+    directory = tempfile.mkdtemp(prefix="bench-rag-batch-")
+    try:
+        collection, sparse = build_collection(args.backend, corpus, embeddings, directory)
+        retriever = HybridRetriever(collection, embeddings, sparse, mode=args.mode, top_k=args.k, mmr=False,
+                                    reranker_model="")
+        retriever.retrieve_many(queries[:8])  # 预热：页缓存、BLAS 线程池
+
+        start = time.perf_counter()
+        for query in queries:
+            retriever.retrieve(query)
+        baseline = len(queries) / (time.perf_counter() - start)
+        print(f"{len(corpus)} chunks, {len(queries)} queries, backend={args.backend}, mode={args.mode}, k={args.k}")
+        print(f"{'batch':>6s}{'queries/s':>12s}{'ms/batch':>10s}{'speedup':>9s}")
+        print(f"{'loop':>6s}{baseline:12.1f}{1000 / baseline:10.2f}{1.0:9.2f}")
+        for batch_size in BATCH_SIZES:
+            start = time.perf_counter()
+            batches = 0
+            for i in range(0, len(queries), batch_size):
+                retriever.retrieve_many(queries[i:i + batch_size])
+                batches += 1
+            elapsed = time.perf_counter() - start
+            rate = len(queries) / elapsed
+            print(f"{batch_size:6d}{rate:12.1f}{elapsed * 1000 / batches:10.2f}{rate / baseline:9.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+对比纯向量、纯 BM25 和混合检索（RRF 融合，可选 MMR / 交叉编码器重排序）的检索质量和延迟。
+
+合成语料由若干主题的"产品说明"组成，每个文本块带一个唯一编号 (SKU-xxxxx)。查询分两类：
+- id     按编号查询某个产品，只有一个相关文本块，考察逐字匹配；
+- topic  按主题描述查询，同一主题的所有文本块都相关，考察语义召回。
+默认的哈希嵌入只使用字母单词（数字被忽略），模拟稠密模型对编号、型号不敏感的特点，
+不需要下载任何模型；--model 可以换成真实的 sentence-transformers 模型。
+
+用法:
+    python -m benchmarks.bench_rag_retrieval --docs 5000 --queries 200 --k 5
+    python -m benchmarks.bench_rag_retrieval --model all-MiniLM-L6-v2 --reranker cross-encoder/ms-marco-MiniLM-L-6-v2
+"""
+import argparse
+import hashlib
+import random
+import re
+import statistics
+import time
+from typing import Dict, List, Set, Tuple
+
+import chromadb
+import numpy as np
+
+from rag.hybrid import HybridRetriever
+from rag.sparse import BM25Index
+
+TOPICS = {
+    "battery": "battery charge lithium capacity power hours runtime charger voltage",
+    "display": "screen display brightness resolution pixels panel color contrast",
+    "audio": "speaker sound audio bass volume headphones noise microphone",
+    "camera": "camera lens photo video zoom sensor aperture focus",
+    "network": "wifi network router signal bandwidth wireless ethernet latency",
+    "storage": "storage disk capacity drive backup files memory ssd",
+    "shipping": "shipping delivery courier package tracking warehouse parcel",
+    "warranty": "warranty repair replacement defect claim service coverage",
+}
+FILLER = "the product offers reliable quality for everyday use and customers report good value overall".split()
+
+
+class HashingEmbeddings:
+    """把字母单词哈希到固定维度的词袋向量（带随机符号）。只看字母单词，编号中的数字不参与嵌入。"""
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"[a-z]+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def synthesize_corpus(n_docs: int, seed: int) -> List[Tuple[str, str, str]]:
+    """返回 [(chunk_id, 主题, 文本)]。每个文本块还混有另一个主题的词，主题查询不会全部命中。"""
+    rng = random.Random(seed)
+    skus = rng.sample(range(10000, 99999), n_docs)
+    corpus = []
+    for i, sku in enumerate(skus):
+        topic, other = rng.sample(list(TOPICS), 2)
+        words, noise = TOPICS[topic].split(), TOPICS[other].split()
+
+        def pick() -> str:
+            roll = rng.random()
+            return rng.choice(words) if roll < 0.25 else rng.choice(noise) if roll < 0.4 else rng.choice(FILLER)
+        body = " ".join(pick() for _ in range(40))
+        corpus.append((f"doc-{i}", topic, f"Product SKU-{sku}: {body}."))
+    return corpus
+
+
+def synthesize_queries(corpus: List[Tuple[str, str, str]], n_queries: int, seed: int) -> List[Tuple[str, str, Set[str]]]:
+    """返回 [(类型, 查询, 相关文本块 ID 集合)]，id 和 topic 查询各占一半。"""
+    rng = random.Random(seed + 1)
+    by_topic: Dict[str, Set[str]] = {}
+    for chunk_id, topic, _ in corpus:
+        by_topic.setdefault(topic, set()).add(chunk_id)
+    queries = []
+    for i in range(n_queries):
+        if i % 2 == 0:
+            chunk_id, _, text = rng.choice(corpus)
+            sku = re.search(r"SKU-\d+", text).group()
+            queries.append(("id", f"what do customers say about {sku}", {chunk_id}))
+        else:
+            topic = rng.choice(list(TOPICS))
+            words = rng.sample(TOPICS[topic].split(), 3)
+            queries.append(("topic", f"questions about {' '.join(words)}", by_topic[topic]))
+    return queries
+
+
+def build_stores(corpus, embeddings, batch_size: int = 512):
+    client = chromadb.EphemeralClient()
+    name = f"bench-{random.randrange(1 << 30)}"
+    collection = client.create_collection(name, metadata={"hnsw:space": "cosine"})
+    sparse = BM25Index()
+    for i in range(0, len(corpus), batch_size):
+        batch = corpus[i:i + batch_size]
+        texts = [text for _, _, text in batch]
+        collection.add(ids=[chunk_id for chunk_id, _, _ in batch], documents=texts,
+                       embeddings=embeddings.embed_documents(texts),
+                       metadatas=[{"topic": topic} for _, topic, _ in batch])
+        for chunk_id, topic, text in batch:
+            sparse.add(chunk_id, text, {"topic": topic})
+    return collection, sparse
+
+
+def evaluate(retriever: HybridRetriever, queries, k: int) -> Dict[str, float]:
+    latencies = []
+    precision: Dict[str, List[float]] = {"id": [], "topic": []}
+    recall: Dict[str, List[float]] = {"id": [], "topic": []}
+    for kind, query, relevant in queries:
+        start = time.perf_counter()
+        chunks = retriever.retrieve(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits = sum(1 for chunk in chunks if chunk.id in relevant)
+        precision[kind].append(hits / k)
+        recall[kind].append(hits / min(len(relevant), k))
+    latencies.sort()
+    return {
+        "p@k id": statistics.mean(precision["id"]),
+        "hit id": statistics.mean(recall["id"]),
+        "p@k topic": statistics.mean(precision["topic"]),
+        "p50 ms": latencies[len(latencies) // 2],
+        "p95 ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector vs BM25 vs hybrid retrieval.")
+    parser.add_argument("--docs", type=int, default=5000, help="合成语料的文本块数量。")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5, help="每个查询返回的文本块数量。")
+    parser.add_argument("--fetch-k", type=int, default=20, help="每一路召回的候选数量。")
+    parser.add_argument("--model", help="使用真实的 sentence-transformers 嵌入模型（默认用哈希嵌入）。")
+    parser.add_argument("--reranker", help="交叉编码器模型名，指定后额外测试 hybrid+rerank。")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.model:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=args.model)
+    else:
+        embeddings = HashingEmbeddings()
+
+    corpus = synthesize_corpus(args.docs, args.seed)
+    queries = synthesize_queries(corpus, args.queries, args.seed)
+    start = time.perf_counter()
+    collection, sparse = build_stores(corpus, embeddings)
+    print(f"{len(corpus)} chunks indexed in {time.perf_counter() - start:.1f}s, "
+          f"{len(queries)} queries, k={args.k}, fetch_k={args.fetch_k}")
+
+    variants = [
+        ("vector", dict(mode="vector")),
+        ("bm25", dict(mode="bm25")),
+        ("hybrid (rrf)", dict(mode="hybrid")),
+        ("hybrid + mmr", dict(mode="hybrid", mmr=True)),
+    ]
+    if args.reranker:
+        variants.append(("hybrid + rerank", dict(mode="hybrid", reranker_model=args.reranker)))
+
+    columns = ["p@k id", "hit id", "p@k topic", "p50 ms", "p95 ms"]
+    print(f"{'variant':18s}" + "".join(f"{column:>11s}" for column in columns))
+    for name, options in variants:
+        options.setdefault("mmr", False)
+        options.setdefault("reranker_model", "")
+        retriever = HybridRetriever(collection, embeddings, sparse, top_k=args.k, fetch_k=args.fetch_k, **options)
+        result = evaluate(retriever, queries, args.k)
+        print(f"{name:18s}" + "".join(f"{result[column]:11.3f}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+对 server.py 做压测：本地 FakeLLMServer 提供 LLM 和网页，uvicorn 在后台线程中运行服务，
+用大量并发客户端提交目标，报告吞吐量 (goals/sec)、延迟分位数和被 429 拒绝的请求数。
+
+用法: python -m benchmarks.bench_server --goals 500 --clients 200 --workers 64 --max-queue 64
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import threading
+import time
+from typing import List
+
+import httpx
+import uvicorn
+
+from benchmarks.fake_llm_server import FakeLLMServer
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def _load(base_url: str, goals: int, clients: int, stream: bool):
+    latencies: List[float] = []
+    statuses: dict = {}
+    semaphore = asyncio.Semaphore(clients)
+    path = "/goals/stream" if stream else "/goals"
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300,
+                                 limits=httpx.Limits(max_connections=clients)) as client:
+        async def one(i: int):
+            body = {"sender_id": "bench", "receiver_id": "smart_agent_server", "task": "user_query",
+                    "data": {"query": f"goal {i}"}}
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with client.stream("POST", path, json=body) as response:
+                        async for _ in response.aiter_bytes():
+                            pass
+                except httpx.TransportError as e:
+                    statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+                    return
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(goals)))
+        elapsed = time.perf_counter() - start
+    return elapsed, latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the SmartAgent HTTP server against a fake LLM.")
+    parser.add_argument("--goals", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=200, help="并发客户端数量。")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--page-latency-ms", type=float, default=50)
+    parser.add_argument("--tool-steps", type=int, default=1)
+    parser.add_argument("--stream", action="store_true", help="使用 SSE 接口。")
+    args = parser.parse_args()
+
+    with FakeLLMServer(latency_ms=args.latency_ms, page_latency_ms=args.page_latency_ms, tool_steps=args.tool_steps) as llm:
+        os.environ.update({
+            "LLM_PROVIDER": "custom",
+            "CUSTOM_LLM_API_KEY": "fake",
+            "CUSTOM_LLM_MODEL_NAME": "fake",
+            "CUSTOM_LLM_BASE_URL": f"{llm.base_url}/v1",
+        })
+        from server import create_app
+
+        port = _free_port()
+        # 被 429 快速拒绝后空闲的连接可能在 uvicorn 默认的 5 秒 keep-alive 超时后被复用，导致客户端 ReadError
+        config = uvicorn.Config(create_app(workers=args.workers, max_queue=args.max_queue, warm_up=False),
+                                host="127.0.0.1", port=port, log_level="warning",
+                                timeout_keep_alive=75)
+        server = uvicorn.Server(config)
+        thread = threading.Thread(target=server.run, daemon=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread.start()
+            while not server.started:
+                time.sleep(0.05)
+            elapsed, latencies, statuses = asyncio.run(
+                _load(f"http://127.0.0.1:{port}", args.goals, args.clients, args.stream))
+            server.should_exit = True
+            thread.join()
+
+    ok = statuses.get(200, 0)
+    print(f"{args.goals} goals, {args.clients} clients, workers={args.workers}, max_queue={args.max_queue}, "
+          f"stream={args.stream}")
+    print(f"completed: {ok}  rejected (429): {statuses.get(429, 0)}  other: "
+          f"{sum(v for k, v in statuses.items() if k not in (200, 429))}")
+    print(f"throughput: {ok / elapsed:.2f} goals/sec over {elapsed:.2f}s")
+    print(f"latency: p50={_percentile(latencies, 50) * 1000:.0f} ms  p95={_percentile(latencies, 95) * 1000:.0f} ms  "
+          f"p99={_percentile(latencies, 99) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
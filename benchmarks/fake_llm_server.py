@@ -0,0 +1,188 @@
+"""
+一个本地的假 LLM / 网页服务器，用于离线压测 Agent。
+
+- POST /v1/chat/completions: 兼容 OpenAI 的接口，按脚本返回 JSON 决策：
+  先调用 `tool_steps` 次 web_browser_tool 读取本服务器上的页面，然后 finish。
+- GET /pages/<n>: 返回一个简单的 HTML 页面。
+
+两个接口都支持注入延迟，用来模拟真实 LLM 和网站的响应时间。LLM 接口还可以注入长尾延迟
+（slow_fraction 比例的请求耗时 slow_latency_ms）和错误（error_rate 比例的请求返回 503，
+failing=True 时全部返回 503），用来测试多服务商路由的对冲和故障切换（见 llm/router.py）。
+
+用法: python -m benchmarks.fake_llm_server --port 8765 --latency-ms 200 --slow-fraction 0.05 --slow-latency-ms 2000
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from llm.fake import make_completion
+
+PAGE_TEMPLATE = """<html><head><title>Page {n}</title><style>body {{ color: #333; }}</style></head>
+<body><h1>Fake page {n}</h1><p>{body}</p><script>console.log("ignored");</script></body></html>"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # 压测时不要刷屏
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已经放弃了这个请求（例如对冲请求中落后的一方被取消）
+            self.close_connection = True
+
+    def do_GET(self):
+        if not self.path.startswith("/pages/"):
+            self._send(404, b"not found", "text/plain")
+            return
+        time.sleep(self.server.page_latency)
+        n = self.path.rsplit("/", 1)[-1]
+        body = PAGE_TEMPLATE.format(n=n, body=" ".join(["lorem ipsum dolor sit amet"] * 50))
+        self._send(200, body.encode("utf-8"), "text/html; charset=utf-8")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, b"{}", "application/json")
+            return
+        time.sleep(self.server.pick_latency())
+        if self.server.should_fail():
+            error = {"error": {"message": "fake server overloaded", "type": "server_error", "code": 503}}
+            self._send(503, json.dumps(error).encode("utf-8"), "application/json")
+            return
+        decision = self.server.decide(request.get("messages", []))
+        self.server.count_request()
+        self._send(200, json.dumps(make_completion(request.get("model", "fake"), decision)).encode("utf-8"), "application/json")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency: float, page_latency: float, tool_steps: int,
+                 slow_fraction: float = 0.0, slow_latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.page_latency = page_latency
+        self.tool_steps = tool_steps
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.failing = False
+        self.requests_served = 0
+        self.errors_served = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._lock:
+            self.requests_served += 1
+
+    def pick_latency(self) -> float:
+        with self._lock:
+            slow = self._random.random() < self.slow_fraction
+        return self.slow_latency if slow else self.latency
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            failed = self.failing or self._random.random() < self.error_rate
+            if failed:
+                self.errors_served += 1
+        return failed
+
+    def decide(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """根据历史中已经执行过的行动次数，决定下一步做什么。"""
+        steps = sum(1 for m in messages if m.get("role") == "assistant" and str(m.get("content", "")).startswith("Action:"))
+        if steps < self.tool_steps:
+            return {
+                "thought": f"Read page {steps}.",
+                "action": "web_browser_tool",
+                "action_input": {"url": f"{self.base_url}/pages/{steps}", "word_limit": 100},
+            }
+        return {"thought": "All pages have been read.", "action": "finish", "action_input": {}}
+
+
+class FakeLLMServer:
+    """在后台线程中运行假服务器，可作为上下文管理器使用。"""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0,
+                 page_latency_ms: float = 0, tool_steps: int = 1, slow_fraction: float = 0.0,
+                 slow_latency_ms: float = 0, error_rate: float = 0.0, seed: int = 0):
+        self._server = _Server((host, port), latency_ms / 1000, page_latency_ms / 1000, tool_steps,
+                               slow_fraction, slow_latency_ms / 1000, error_rate, seed)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return self._server.base_url
+
+    @property
+    def requests_served(self) -> int:
+        return self._server.requests_served
+
+    @property
+    def errors_served(self) -> int:
+        return self._server.errors_served
+
+    @property
+    def failing(self) -> bool:
+        return self._server.failing
+
+    @failing.setter
+    def failing(self, value: bool):
+        """模拟服务商整体故障：之后的所有 LLM 请求都返回 503。"""
+        self._server.failing = value
+
+    def start(self) -> "FakeLLMServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible LLM and web server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="每次 LLM 调用的延迟。")
+    parser.add_argument("--page-latency-ms", type=float, default=0, help="每次网页请求的延迟。")
+    parser.add_argument("--tool-steps", type=int, default=1, help="finish 之前调用工具的次数。")
+    parser.add_argument("--slow-fraction", type=float, default=0.0, help="耗时 --slow-latency-ms 的 LLM 调用比例。")
+    parser.add_argument("--slow-latency-ms", type=float, default=0, help="长尾 LLM 调用的延迟。")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的 LLM 调用比例。")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.host, args.port, args.latency_ms, args.page_latency_ms, args.tool_steps,
+                           args.slow_fraction, args.slow_latency_ms, args.error_rate)
+    print(f"Fake LLM server listening on {server.base_url} (OpenAI base_url: {server.base_url}/v1)")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,39 +1,447 @@
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_huggingface import HuggingFaceEmbeddings as SentenceTransformerEmbeddings
-from langchain_community.vectorstores import Chroma
+"""
+增量构建 RAG 向量索引。
+
+索引目录中保存一份清单 (index_manifest.json)，记录每个源文件的内容哈希以及它产生的文本块 ID。
+每次运行只会重新切分、嵌入新增或修改过的文件，并删除已被移除的文件对应的文本块；
+切分参数、嵌入模型或向量库后端发生变化时会自动全量重建。
+同一批文本块还会写入 BM25 关键词索引 (bm25_index.json)，供 RAGTool 做混合检索（见 rag/hybrid.py）。
+
+变化的文件以流水线方式处理，各阶段之间用有界队列连接，正在处理的文档、文本块和向量不会随语料增长：
+    扫描（流式计算哈希）→ 解析 + 切分（进程池，--workers）→ 批量嵌入（线程）→ 写入向量库和 BM25（主线程）
+下游阻塞时上游会在队列满时暂停。但仍有两部分与语料大小成正比：BM25 索引整个保存在内存中、最后写成一个 JSON 文件，
+清单也记录了每个文本块的 ID；语料很大时它们决定了构建的内存峰值。
+运行结束时报告每个阶段的吞吐量和每个队列的平均/最大深度，
+一眼就能看出瓶颈在哪个阶段。
+
+用法:
+    python build_rag_index.py                      # 增量更新
+    python build_rag_index.py --full               # 强制全量重建
+    python build_rag_index.py --batch-size 128 --multiprocess
+    python build_rag_index.py --backend mmap       # 使用内存映射的 NumPy 向量库代替 Chroma
+    python build_rag_index.py --workers 8 --queue-size 2048
+"""
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from rag.backends import BACKENDS, open_collection, reset_collection, resolve_backend
+from rag.embeddings import EMBEDDING_MODEL, get_embeddings
+from rag.sparse import SPARSE_INDEX_FILENAME, BM25Index
 
 # 定义数据库的持久化路径
 PERSIST_DIRECTORY = "./rag_db"
 DATA_PATH = "./data"
+MANIFEST_FILENAME = "index_manifest.json"
+# 与 langchain 的 Chroma 封装使用同一个集合，RAGTool 可以直接读取
+COLLECTION_NAME = "langchain"
+CHUNK_SIZE = 250
+CHUNK_OVERLAP = 20
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# 解析阶段和嵌入阶段之间的队列容量（文本块数）；嵌入和写入之间最多积压的批数
+DEFAULT_QUEUE_SIZE = 1024
+EMBED_QUEUE_BATCHES = 4
+# --multiprocess 时每次交给模型的文本块数 = batch_size × 这个倍数（进程池每次调用都有启动开销）
+MULTIPROCESS_EMBED_GROUP = 16
+# mmap 后端每写入这么多文本块落盘一次，暂存在内存中的向量不会随语料增长
+FLUSH_EVERY = 50000
+_HASH_BLOCK = 1 << 20
+_QUEUE_POLL_SECONDS = 0.1
+
+# (chunk_id, 文本, 元数据)
+Chunk = Tuple[str, str, Dict[str, Any]]
+# 队列结束标记
+_DONE = object()
+
+
+class StageTimer:
+    """
+    记录每个阶段处理的条目数和耗时，以及流水线中每个队列的深度，用于输出吞吐量报告。
+    各阶段在不同的线程中运行，所以记录时加锁。parse / split 的耗时是各工作进程耗时之和。
+    """
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.queues: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, unit: str, count: int, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"unit": unit, "count": 0, "seconds": 0.0})
+            entry["count"] += count
+            entry["seconds"] += seconds
+
+    def sample_queue(self, name: str, q: queue.Queue):
+        depth = q.qsize()
+        with self._lock:
+            entry = self.queues.setdefault(name, {"capacity": q.maxsize, "samples": 0, "total": 0, "max": 0})
+            entry["samples"] += 1
+            entry["total"] += depth
+            entry["max"] = max(entry["max"], depth)
+
+    def report(self, wall_seconds: Optional[float] = None):
+        print("\n阶段吞吐量:")
+        for stage, entry in self.stages.items():
+            rate = entry["count"] / entry["seconds"] if entry["seconds"] > 0 else float("inf")
+            print(f"  {stage:8s} {entry['count']:8d} {entry['unit']:10s} {entry['seconds']:8.2f}s  {rate:10.1f} {entry['unit']}/s")
+        if self.queues:
+            print("队列深度（接近容量说明下游是瓶颈，接近 0 说明上游是瓶颈）:")
+            for name, entry in self.queues.items():
+                average = entry["total"] / entry["samples"] if entry["samples"] else 0.0
+                print(f"  {name:8s} 平均 {average:8.1f}  最大 {entry['max']:6d}  容量 {entry['capacity']:6d}")
+        if wall_seconds is not None:
+            print(f"总耗时 {wall_seconds:.2f}s")
+
+
+def _hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hash_file(path: str) -> str:
+    """分块计算文件的 sha256，不把整个文件读进内存。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _chunk_id(rel_path: str, index: int) -> str:
+    """文本块 ID 由文件路径和块序号决定，文件修改后先删除旧块再写入新块。"""
+    return f"{_hash_bytes(rel_path.encode('utf-8'))[:16]}-{index}"
+
+
+def load_manifest(persist_directory: str) -> Dict[str, Any]:
+    path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(persist_directory: str, manifest: Dict[str, Any]):
+    path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def discover_files(data_path: str) -> Dict[str, str]:
+    """返回 {相对路径: 绝对路径}。"""
+    paths = sorted(glob.glob(os.path.join(data_path, "**", "*.txt"), recursive=True))
+    return {os.path.relpath(path, data_path): path for path in paths}
+
+
+def index_settings(backend: str) -> Dict[str, Any]:
+    """会影响索引内容的参数；任何一项变化都需要全量重建。"""
+    return {"model": EMBEDDING_MODEL, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "backend": backend}
+
+
+def plan_changes(files: Dict[str, str], manifest: Dict[str, Any], timer: StageTimer) -> Tuple[Dict[str, str], List[str]]:
+    """
+    对比当前文件和清单，返回 (需要重新索引的文件 {相对路径: 哈希}, 已删除的文件列表)。
+    这里只计算哈希，文件内容在解析阶段才读取。
+    """
+    known = manifest.get("files", {})
+    changed: Dict[str, str] = {}
+    start = time.perf_counter()
+    for rel_path, path in files.items():
+        digest = _hash_file(path)
+        if known.get(rel_path, {}).get("sha256") != digest:
+            changed[rel_path] = digest
+    timer.add("scan", "docs", len(files), time.perf_counter() - start)
+    removed = [rel_path for rel_path in known if rel_path not in files]
+    return changed, removed
+
+
+# 每个解析进程各自持有一个切分器
+_splitter: Optional[RecursiveCharacterTextSplitter] = None
+
+
+def parse_and_split(rel_path: str, path: str, digest: str) -> Tuple[str, List[Chunk], float, float]:
+    """
+    在工作进程中读取并切分一个文件。返回 (相对路径, 文本块, 解析耗时, 切分耗时)。
+    文本块用普通元组表示，进程间传递的开销比 Document 小。
+    """
+    global _splitter
+    if _splitter is None:
+        _splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        text = f.read().decode("utf-8", errors="replace")
+    parsed = time.perf_counter()
+    chunks = []
+    for i, piece in enumerate(_splitter.split_text(text)):
+        chunk_id = _chunk_id(rel_path, i)
+        chunks.append((chunk_id, piece, {"source": path, "chunk_id": chunk_id, "sha256": digest}))
+    return rel_path, chunks, parsed - start, time.perf_counter() - parsed
 
-def build_index():
+
+def iter_parsed(changed: Dict[str, str], files: Dict[str, str], workers: int,
+                timer: StageTimer) -> Iterator[Tuple[str, List[Chunk]]]:
+    """
+    按顺序产出每个文件的文本块。workers > 1 时由进程池并行解析，同时最多有 workers × 2 个文件在处理中，
+    下游消费得慢时这里也会停下来，不会提前把整个语料读进内存。
+    """
+    tasks = ((rel_path, files[rel_path], digest) for rel_path, digest in changed.items())
+
+    def record(result):
+        rel_path, chunks, parse_seconds, split_seconds = result
+        timer.add("parse", "docs", 1, parse_seconds)
+        timer.add("split", "chunks", len(chunks), split_seconds)
+        return rel_path, chunks
+
+    if workers <= 1 or len(changed) <= 1:
+        for task in tasks:
+            yield record(parse_and_split(*task))
+        return
+    # spawn：流水线的其他线程已经在运行，fork 一个多线程进程不安全
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(pool.submit(parse_and_split, *task))
+            if len(in_flight) >= workers * 2:
+                yield record(in_flight.popleft().result())
+        while in_flight:
+            yield record(in_flight.popleft().result())
+
+
+def _put(q: queue.Queue, item: Any, failed: threading.Event) -> bool:
+    """放入有界队列，队列满时阻塞；流水线中任何一个阶段出错后放弃并返回 False。"""
+    while not failed.is_set():
+        try:
+            q.put(item, timeout=_QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, failed: threading.Event) -> Any:
+    while not failed.is_set():
+        try:
+            return q.get(timeout=_QUEUE_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(changed: Dict[str, str], files: Dict[str, str], collection, embeddings, sparse: BM25Index,
+                 batch_size: int, embed_batch: int, workers: int, queue_size: int,
+                 timer: StageTimer) -> Dict[str, List[str]]:
+    """
+    解析 → 切分 → 嵌入 → 写入 的流式流水线，返回 {相对路径: 文本块 ID 列表}。
+    解析和嵌入各在一个线程中运行，写入在当前线程；任何阶段抛出的异常都会终止整条流水线并在这里重新抛出。
+    """
+    chunk_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    batch_queue: queue.Queue = queue.Queue(maxsize=EMBED_QUEUE_BATCHES)
+    failed = threading.Event()
+    errors: List[BaseException] = []
+    file_chunks: Dict[str, List[str]] = {}
+
+    def parse_stage():
+        try:
+            for rel_path, chunks in iter_parsed(changed, files, workers, timer):
+                file_chunks[rel_path] = [chunk[0] for chunk in chunks]
+                for chunk in chunks:
+                    if not _put(chunk_queue, chunk, failed):
+                        return
+            _put(chunk_queue, _DONE, failed)
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+
+    def embed_stage():
+        try:
+            done = False
+            while not done:
+                timer.sample_queue("chunks", chunk_queue)
+                batch: List[Chunk] = []
+                while len(batch) < embed_batch:
+                    chunk = _get(chunk_queue, failed)
+                    if chunk is _DONE:
+                        done = True
+                        break
+                    batch.append(chunk)
+                if batch:
+                    start = time.perf_counter()
+                    vectors = embeddings.embed_documents([chunk[1] for chunk in batch])
+                    timer.add("embed", "embeddings", len(batch), time.perf_counter() - start)
+                    if not _put(batch_queue, (batch, vectors), failed):
+                        return
+            _put(batch_queue, _DONE, failed)
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+
+    threads = [threading.Thread(target=parse_stage, name="index-parse", daemon=True),
+               threading.Thread(target=embed_stage, name="index-embed", daemon=True)]
+    for thread in threads:
+        thread.start()
+    try:
+        since_flush = 0
+        while True:
+            timer.sample_queue("batches", batch_queue)
+            item = _get(batch_queue, failed)
+            if item is _DONE:
+                break
+            batch, vectors = item
+            upsert_batch(collection, batch, vectors, batch_size, timer)
+            update_sparse_index(sparse, batch, timer)
+            since_flush += len(batch)
+            if hasattr(collection, "flush") and since_flush >= FLUSH_EVERY:
+                flush_collection(collection, since_flush, timer)
+                since_flush = 0
+        if hasattr(collection, "flush") and since_flush:
+            flush_collection(collection, since_flush, timer)
+    except BaseException as e:
+        errors.append(e)
+        failed.set()
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return file_chunks
+
+
+def upsert_batch(collection, batch: List[Chunk], vectors: List[List[float]], batch_size: int, timer: StageTimer):
+    start = time.perf_counter()
+    for i in range(0, len(batch), batch_size):
+        part = batch[i:i + batch_size]
+        collection.upsert(
+            ids=[chunk[0] for chunk in part],
+            embeddings=vectors[i:i + batch_size],
+            documents=[chunk[1] for chunk in part],
+            metadatas=[chunk[2] for chunk in part],
+        )
+    timer.add("upsert", "chunks", len(batch), time.perf_counter() - start)
+
+
+def flush_collection(collection, count: int, timer: StageTimer):
+    """mmap 后端的暂存写入落盘（Chroma 写入时已经持久化，没有 flush）。"""
+    start = time.perf_counter()
+    collection.flush()
+    timer.add("flush", "chunks", count, time.perf_counter() - start)
+
+
+def update_sparse_index(sparse: BM25Index, chunks: List[Chunk], timer: StageTimer):
+    """把新文本块写入 BM25 索引（旧文本块已在删除阶段与向量集合一起移除）。"""
+    start = time.perf_counter()
+    for chunk_id, text, metadata in chunks:
+        sparse.add(chunk_id, text, metadata)
+    timer.add("sparse", "chunks", len(chunks), time.perf_counter() - start)
+
+
+def build_index(data_path: str = DATA_PATH, persist_directory: str = PERSIST_DIRECTORY,
+                batch_size: int = DEFAULT_BATCH_SIZE, multiprocess: bool = False, full: bool = False,
+                backend: Optional[str] = None, workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE):
     print("开始构建向量索引...")
-    
-    # 1. 加载文档
-    print(f"从 '{DATA_PATH}' 加载文档...")
-    loader = DirectoryLoader(DATA_PATH, glob="**/*.txt", show_progress=True)
-    documents = loader.load()
-    if not documents:
+    timer = StageTimer()
+    build_start = time.perf_counter()
+
+    files = discover_files(data_path)
+    if not files:
         print("错误：在 data 目录中没有找到任何 .txt 文件。")
         return
 
-    # 2. 文本分割
-    print("分割文档...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=250, chunk_overlap=20)
-    texts = text_splitter.split_documents(documents)
+    os.makedirs(persist_directory, exist_ok=True)
+    manifest = load_manifest(persist_directory)
+    backend = resolve_backend(persist_directory, backend)
+    print(f"向量库后端: {backend}")
+    sparse_path = os.path.join(persist_directory, SPARSE_INDEX_FILENAME)
+    sparse = BM25Index.load_or_create(sparse_path)
+
+    # 没有清单（旧版本脚本建的库）、切分参数或模型变化、或者用户要求时，全量重建
+    settings = index_settings(backend)
+    # 旧版本的清单没有记录后端，那时只有 chroma
+    previous = {"backend": "chroma", **manifest.get("settings", {})}
+    if full or not manifest or previous != settings:
+        print("全量重建索引...")
+        reset_collection(persist_directory, previous["backend"], COLLECTION_NAME)
+        reset_collection(persist_directory, backend, COLLECTION_NAME)
+        manifest = {"settings": settings, "files": {}}
+        sparse = BM25Index()
+    collection = open_collection(persist_directory, backend, COLLECTION_NAME)
+    if not len(sparse) and manifest["files"]:
+        # 旧版本建的库只有向量索引：从集合中读出已有的文本块补建 BM25 索引
+        existing = collection.get(include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(existing["ids"], existing["documents"], existing["metadatas"]):
+            sparse.add(chunk_id, text or "", metadata or {})
 
-    # 3. 初始化嵌入模型
-    print("初始化嵌入模型 (all-MiniLM-L6-v2)...")
-    embeddings = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+    # 1. 扫描文件，找出新增/修改/删除的文件
+    print(f"扫描 '{data_path}' 中的文档...")
+    changed, removed = plan_changes(files, manifest, timer)
+    print(f"  {len(files)} 个文件：{len(changed)} 个新增或修改，{len(removed)} 个已删除，"
+          f"{len(files) - len(changed)} 个未变化。")
+
+    # 2. 删除已移除或已修改文件的旧文本块
+    stale_ids = []
+    for rel_path in removed + [p for p in changed if p in manifest["files"]]:
+        stale_ids.extend(manifest["files"][rel_path]["chunk_ids"])
+    if stale_ids:
+        start = time.perf_counter()
+        collection.delete(ids=stale_ids)
+        sparse.remove(stale_ids)
+        timer.add("delete", "chunks", len(stale_ids), time.perf_counter() - start)
+    for rel_path in removed:
+        del manifest["files"][rel_path]
+
+    if changed:
+        # 3. 初始化嵌入函数。带缓存时模型只在出现未命中的文本块时才加载
+        print(f"初始化嵌入模型 ({EMBEDDING_MODEL})...")
+        embeddings = get_embeddings(
+            EMBEDDING_MODEL,
+            multi_process=multiprocess,
+            encode_kwargs={"batch_size": batch_size},
+        )
+
+        # 4. 流水线：解析 + 切分 → 批量嵌入 → 写入向量数据库和 BM25 索引
+        print(f"解析、嵌入并写入向量数据库 '{persist_directory}'（{workers} 个解析进程）...")
+        embed_batch = batch_size * MULTIPROCESS_EMBED_GROUP if multiprocess else batch_size
+        file_chunks = run_pipeline(changed, files, collection, embeddings, sparse,
+                                   batch_size, embed_batch, workers, queue_size, timer)
+
+        for rel_path, digest in changed.items():
+            manifest["files"][rel_path] = {"sha256": digest, "chunk_ids": file_chunks.get(rel_path, [])}
+
+        if hasattr(embeddings, "stats"):
+            cache = embeddings.stats()
+            print(f"嵌入缓存: 命中 {cache['hits']}，未命中 {cache['misses']}，"
+                  f"命中率 {cache['hit_rate']:.0%}，共 {cache['entries']} 条")
+
+    if hasattr(collection, "flush") and stale_ids and not changed:
+        # 只有删除时，mmap 后端的暂存删除在这里落盘
+        flush_collection(collection, len(stale_ids), timer)
+    sparse.save(sparse_path)
+    save_manifest(persist_directory, manifest)
+    timer.report(time.perf_counter() - build_start)
 
-    # 4. 创建并持久化向量数据库
-    print(f"创建向量数据库并将其持久化到 '{PERSIST_DIRECTORY}'...")
-    db = Chroma.from_documents(texts, embeddings, persist_directory=PERSIST_DIRECTORY)
-    db.persist()
-    
     print("\n索引构建完成！")
-    print(f"数据库已保存在 '{PERSIST_DIRECTORY}' 文件夹中。")
+    print(f"数据库已保存在 '{persist_directory}' 文件夹中。")
+
 
 if __name__ == "__main__":
-    build_index()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Incrementally build the RAG vector index.")
+    parser.add_argument("--data", default=DATA_PATH, help="源文档目录。")
+    parser.add_argument("--persist", default=PERSIST_DIRECTORY, help="向量数据库目录。")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每批嵌入的文本块数量。")
+    parser.add_argument("--multiprocess", action="store_true", help="使用多进程计算嵌入（多核 CPU 上更快）。")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="解析和切分文档的进程数，1 表示在线程中顺序处理。")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="解析与嵌入之间的队列容量（文本块数）。")
+    parser.add_argument("--full", action="store_true", help="忽略清单，强制全量重建。")
+    parser.add_argument("--backend", choices=BACKENDS,
+                        help="向量库后端（默认依次取 RAG_BACKEND、上次构建时的后端、chroma）。")
+    args = parser.parse_args()
+    build_index(args.data, args.persist, args.batch_size, args.multiprocess, args.full, args.backend,
+                args.workers, args.queue_size)
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from mcp.interfaces import BaseTool, get_tool_executor
+from tool_cache import ToolResultCache
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+# 没有传入 Tracer 时使用：照常计时但不保存 span
+_NO_TRACER = Tracer(enabled=False)
+
+# 每一轮最多并行执行的行动数量，防止模型一次性下发过多请求
+MAX_PARALLEL_ACTIONS = int(os.getenv("MAX_PARALLEL_ACTIONS", "5"))
+
+
+def normalize_actions(decision: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    把模型的决策统一转换成行动列表 [{"action": ..., "action_input": {...}}, ...]。
+    同时兼容新的 "actions" 列表格式和旧的单个 "action" 格式。
+    """
+    raw_actions = decision.get("actions")
+    if not isinstance(raw_actions, list):
+        raw_actions = [{"action": decision.get("action"), "action_input": decision.get("action_input", {})}]
+
+    actions = []
+    for item in raw_actions:
+        if not isinstance(item, dict):
+            continue
+        action_input = item.get("action_input") or {}
+        if not isinstance(action_input, dict):
+            action_input = {}
+        actions.append({"action": item.get("action"), "action_input": action_input})
+    return actions
+
+
+def is_finish(actions: List[Dict[str, Any]]) -> bool:
+    """只有当 'finish' 是本轮唯一的行动时，目标才算完成。"""
+    return bool(actions) and all(a["action"] == "finish" for a in actions)
+
+
+def executable_actions(actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """去掉混在其他行动中的 'finish'，并限制本轮的行动数量。"""
+    return [a for a in actions if a["action"] != "finish"][:MAX_PARALLEL_ACTIONS]
+
+
+# 流式解码时已经提前启动的行动：(行动, Future 或 asyncio.Task)
+PendingActions = List[Tuple[Dict[str, Any], Any]]
+
+
+def _take_pending(pending: Optional[PendingActions], action: Dict[str, Any]) -> Any:
+    """取出与 action 完全相同的已启动行动（只用一次），没有则返回 None。"""
+    for i, (started, handle) in enumerate(pending or []):
+        if started == action:
+            del pending[i]
+            return handle
+    return None
+
+
+class ActionDispatcher:
+    """
+    并行执行一轮中的多个独立行动。
+
+    同步模式使用共享的工具线程池，异步模式使用 asyncio.gather；
+    两种模式都会遵守每个工具声明的 max_concurrency 上限。
+    结果按照行动的原始顺序返回。
+    提供 cache 时，声明为可缓存的工具先查询结果缓存，命中就不再执行（也不占用并发名额）。
+    """
+    def __init__(self, tools: Dict[str, BaseTool], cache: Optional[ToolResultCache] = None):
+        self.tools = tools
+        self.cache = cache
+        self._limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._limits_lock = threading.Lock()
+        # asyncio.Semaphore 绑定在事件循环上，因此按事件循环分别保存
+        self._async_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+    def _limit_for(self, tool: BaseTool) -> threading.BoundedSemaphore:
+        with self._limits_lock:
+            if tool.name not in self._limits:
+                self._limits[tool.name] = threading.BoundedSemaphore(tool.max_concurrency)
+            return self._limits[tool.name]
+
+    def _async_limit_for(self, tool: BaseTool) -> asyncio.Semaphore:
+        limits = self._async_limits.setdefault(asyncio.get_running_loop(), {})
+        if tool.name not in limits:
+            limits[tool.name] = asyncio.Semaphore(tool.max_concurrency)
+        return limits[tool.name]
+
+    def _unknown_action_result(self, action: Optional[str]) -> Dict[str, Any]:
+        return {"status": "error", "message": f"Unknown action '{action}'. Available tools are: {list(self.tools.keys())}"}
+
+    def _cached(self, tool: BaseTool, action_input: Dict[str, Any]) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """返回 (缓存键, 命中的结果)。不可缓存或未启用缓存时键为 None。"""
+        if self.cache is None:
+            return None, None
+        key = self.cache.key_for(tool, action_input)
+        return key, (self.cache.get(key) if key is not None else None)
+
+    def _remember(self, tool: BaseTool, key: Any, result: Dict[str, Any]) -> Dict[str, Any]:
+        if key is not None:
+            self.cache.put(tool, key, result)
+        return result
+
+    @staticmethod
+    def _end_span(tracer: Tracer, span: Any, result: Dict[str, Any], cached: bool) -> Dict[str, Any]:
+        tracer.end(span, cached=cached, result_status=result.get("status"),
+                   result_bytes=len(json.dumps(result, ensure_ascii=False, default=str)))
+        return result
+
+    def _execute_one(self, action: Dict[str, Any], tracer: Optional[Tracer] = None,
+                     early: bool = False) -> Dict[str, Any]:
+        tool = self.tools.get(action["action"])
+        if tool is None:
+            return self._unknown_action_result(action["action"])
+        tracer = tracer or _NO_TRACER
+        span = tracer.start("tool", tool=tool.name, early=early)
+        key, cached = self._cached(tool, action["action_input"])
+        if cached is not None:
+            return self._end_span(tracer, span, cached, cached=True)
+        with self._limit_for(tool):
+            try:
+                result = self._remember(tool, key, tool.execute(**action["action_input"]))
+            except Exception as e:
+                result = {"status": "error", "message": f"工具执行出错: {e}"}
+        return self._end_span(tracer, span, result, cached=False)
+
+    async def _aexecute_one(self, action: Dict[str, Any], tracer: Optional[Tracer] = None,
+                            early: bool = False) -> Dict[str, Any]:
+        tool = self.tools.get(action["action"])
+        if tool is None:
+            return self._unknown_action_result(action["action"])
+        tracer = tracer or _NO_TRACER
+        span = tracer.start("tool", tool=tool.name, early=early)
+        key, cached = self._cached(tool, action["action_input"])
+        if cached is not None:
+            return self._end_span(tracer, span, cached, cached=True)
+        async with self._async_limit_for(tool):
+            try:
+                result = self._remember(tool, key, await tool.aexecute(**action["action_input"]))
+            except asyncio.CancelledError:
+                # 被丢弃的提前行动
+                tracer.end(span, cancelled=True)
+                raise
+            except Exception as e:
+                result = {"status": "error", "message": f"工具执行出错: {e}"}
+        return self._end_span(tracer, span, result, cached=False)
+
+    def can_start_early(self, action: Dict[str, Any], pending: PendingActions) -> bool:
+        """
+        流式解码中解析出的行动是否可以立即执行。模型在输出结束前可能改变主意，
+        因此只提前执行声明为可缓存（即没有副作用，见 tool_cache.py）的工具，数量不超过 MAX_PARALLEL_ACTIONS；
+        finish、未知工具和 file_writer_tool 这类有副作用的工具都等最终决策确定后再执行。
+        """
+        tool = self.tools.get(action["action"])
+        return tool is not None and tool.cacheable and len(pending) < MAX_PARALLEL_ACTIONS
+
+    @staticmethod
+    def discard(pending: Optional[PendingActions]):
+        """
+        丢弃最终决策中没有出现的提前行动：尚未开始的直接取消；已经在线程中运行、无法取消的，
+        结束后记录一条日志（它们没有副作用，结果照常进入工具缓存）。
+        """
+        for action, handle in pending or []:
+            if handle.cancel():
+                logger.debug("🗑️ Cancelled early action not in the final decision: %s", action["action"])
+            elif not handle.done():
+                handle.add_done_callback(lambda _, name=action["action"]: logger.debug(
+                    "🗑️ Early action not in the final decision finished anyway: %s", name))
+
+    def submit(self, action: Dict[str, Any], tracer: Optional[Tracer] = None) -> Future:
+        """在共享的工具线程池中立即开始执行一个行动（流式解码时提前分发）。"""
+        return get_tool_executor().submit(self._execute_one, action, tracer, True)
+
+    def asubmit(self, action: Dict[str, Any], tracer: Optional[Tracer] = None) -> "asyncio.Task":
+        """submit 的异步版本，返回在当前事件循环中运行的任务。"""
+        return asyncio.ensure_future(self._aexecute_one(action, tracer, True))
+
+    def dispatch(self, actions: List[Dict[str, Any]], pending: Optional[PendingActions] = None,
+                 tracer: Optional[Tracer] = None) -> List[Dict[str, Any]]:
+        """
+        同步地并行执行所有行动，返回与 actions 顺序一致的结果列表。
+        pending 中已经提前启动的相同行动不会重复执行，直接等待它的结果；其余的提前行动被丢弃。
+        """
+        pending = list(pending or [])
+        started = [_take_pending(pending, action) for action in actions]
+        self.discard(pending)
+        if len(actions) == 1 and started[0] is None:
+            # 单个行动直接在当前线程执行，省去线程切换的开销
+            return [self._execute_one(actions[0], tracer)]
+        futures = [future or get_tool_executor().submit(self._execute_one, action, tracer)
+                   for future, action in zip(started, actions)]
+        return [future.result() for future in futures]
+
+    async def adispatch(self, actions: List[Dict[str, Any]], pending: Optional[PendingActions] = None,
+                        tracer: Optional[Tracer] = None) -> List[Dict[str, Any]]:
+        """dispatch 的异步版本。"""
+        pending = list(pending or [])
+        tasks = [_take_pending(pending, action) or self._aexecute_one(action, tracer) for action in actions]
+        self.discard(pending)
+        return list(await asyncio.gather(*tasks))
+
+
+def format_action(action: Dict[str, Any]) -> str:
+    return f"Action: Using tool {action['action']} with input {json.dumps(action['action_input'], ensure_ascii=False)}"
+
+
+def format_observation(action: Dict[str, Any], tool_result: Dict[str, Any]) -> str:
+    return f"Tool {action['action']} returned: {json.dumps(tool_result, ensure_ascii=False)}"
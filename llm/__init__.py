@@ -0,0 +1,71 @@
+# llm/__init__.py
+"""
+LLM 客户端的创建入口。SmartAgent 通过 create_client 拿到一个具有 chat.completions.create 接口的对象，
+真实服务商 (openai / deepseek / custom) 返回 OpenAI SDK 客户端，fake / replay 返回离线的假客户端，
+router 返回在多个服务商之间路由、重试和对冲请求的客户端（见 llm/router.py）。
+设置了 LLM_CACHE_MODE 时，客户端外面还会包一层响应缓存（见 llm/cache.py）。
+"""
+import os
+from typing import Any, Optional, Tuple
+
+from openai import OpenAI, AsyncOpenAI
+
+from llm.cache import wrap_with_cache
+
+OFFLINE_PROVIDERS = ("fake", "replay")
+ROUTER_PROVIDER = "router"
+
+
+def resolve_provider(provider: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """根据 .env 解析一个服务商的 (api_key, base_url, model_name)。"""
+    api_key = None
+    base_url = None
+
+    # 根据 provider 的值，从 .env 加载对应的配置
+    if provider == "openai":
+        api_key = os.getenv("OPENAI_API_KEY")
+        model_name = os.getenv("OPENAI_MODEL_NAME", "gpt-4o")
+        # OpenAI 官方服务不需要 base_url
+
+    elif provider == "deepseek":
+        api_key = os.getenv("DEEPSEEK_API_KEY")
+        model_name = os.getenv("DEEPSEEK_MODEL_NAME", "deepseek-chat")
+        base_url = "https://api.deepseek.com" # DeepSeek 的 URL 是固定的
+
+    elif provider == "custom":
+        api_key = os.getenv("CUSTOM_LLM_API_KEY")
+        model_name = os.getenv("CUSTOM_LLM_MODEL_NAME")
+        base_url = os.getenv("CUSTOM_LLM_BASE_URL") # 用户自己提供 URL
+        if not base_url:
+            raise ValueError("LLM_PROVIDER is 'custom', but CUSTOM_LLM_BASE_URL is not set!")
+
+    elif provider in OFFLINE_PROVIDERS:
+        # 离线的假 LLM（见 llm/fake.py），用于基准测试和 CI，不需要密钥
+        api_key = "offline"
+        model_name = os.getenv("FAKE_LLM_MODEL_NAME", f"{provider}-llm")
+
+    elif provider == ROUTER_PROVIDER:
+        # 每个服务商的密钥和模型在路由配置中；这里的模型名只用于日志，请求时会被替换成各服务商的模型
+        from llm.router import load_provider_configs
+        api_key = ROUTER_PROVIDER
+        model_name = ",".join(config.model for config in load_provider_configs())
+
+    else:
+        raise ValueError(f"Unsupported LLM provider '{provider}'. Please check your .env file.")
+
+    if not api_key:
+        raise ValueError(f"API key for provider '{provider}' is not set in .env file.")
+
+    return api_key, base_url, model_name
+
+
+def create_client(provider: str, api_key: Optional[str], base_url: Optional[str], async_client: bool = False) -> Any:
+    """创建 LLM 客户端。如果是 OpenAI 官方，base_url 会是 None，客户端会自动处理。"""
+    if provider in OFFLINE_PROVIDERS:
+        from llm.fake import create_fake_client
+        return wrap_with_cache(create_fake_client(provider, async_client=async_client), is_async=async_client)
+    if provider == ROUTER_PROVIDER:
+        from llm.router import create_router_client
+        return wrap_with_cache(create_router_client(async_client=async_client), is_async=async_client)
+    client_class = AsyncOpenAI if async_client else OpenAI
+    return wrap_with_cache(client_class(api_key=api_key, base_url=base_url), is_async=async_client)
@@ -0,0 +1,225 @@
+# llm/cache.py
+"""
+LLM 响应的持久化缓存（录制与回放）。
+
+缓存键是 sha256(model + messages + response_format)，值是完整的 ChatCompletion JSON，存放在 sqlite 中，
+支持 TTL 和按条目数淘汰。重复运行相同的目标（回归测试、工具崩溃后的重试）时，
+已经见过的 Prompt 直接从磁盘返回，不再支付 LLM 的延迟和费用。
+
+LLM_CACHE_MODE:
+    off     不使用缓存（默认）
+    on      先查缓存，未命中时调用 LLM 并写入缓存
+    record  总是调用 LLM，并用新结果覆盖缓存（刷新录制）
+    replay  严格回放：只读缓存，未命中时抛出 LLMCacheMiss，保证回归测试不会意外访问真实 LLM
+
+流式请求 (stream=True，即 LLM_STREAM=true) 不会被缓存：on / record 模式下直接转发给真实客户端，
+replay 模式下总是抛出 LLMCacheMiss。需要回放时请关闭 LLM_STREAM 录制和回放。
+"""
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "off").lower()
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./.llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # 单位：秒，<= 0 表示永不过期
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000"))
+
+CACHE_MODES = ("off", "on", "record", "replay")
+# 超出条目上限后淘汰到上限的这个比例，避免之后每次写入都触发淘汰
+_EVICT_LOW_WATER = 0.9
+
+
+class LLMCacheMiss(LookupError):
+    """严格回放模式下，请求在缓存中不存在。"""
+
+
+def cache_key(kwargs: Dict[str, Any]) -> str:
+    """只有决定模型输出的参数参与计算：模型名、消息列表和输出格式。"""
+    material = {
+        "model": kwargs.get("model"),
+        "messages": kwargs.get("messages"),
+        "response_format": kwargs.get("response_format"),
+    }
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseStore:
+    """
+    基于 sqlite 的响应存储。线程安全；过期条目在读取时惰性删除，写入时按最近访问时间淘汰超出的条目。
+    条目数在写入时累加而不是每次 COUNT(*)；超出上限时重新计数（包括其他进程写入的条目）后再淘汰。
+    """
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: Optional[float] = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                self._entries -= self._conn.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self._lock, self._conn:
+            exists = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            if not exists:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self._entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                excess = self._entries - int(self.max_entries * _EVICT_LOW_WATER)
+                if self._entries > self.max_entries and excess > 0:
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                        (excess,),
+                    )
+                    self._entries -= excess
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+            self._entries = 0
+
+
+class _CachedCompletions:
+    def __init__(self, owner: "CachedChatClient"):
+        self._owner = owner
+
+    def create(self, **kwargs: Any) -> Any:
+        cached, key = self._owner._lookup(kwargs)
+        if cached is not None:
+            return cached
+        response = self._owner.inner.chat.completions.create(**kwargs)
+        return self._owner._store(key, response)
+
+
+class _AsyncCachedCompletions(_CachedCompletions):
+    async def create(self, **kwargs: Any) -> Any:
+        # sqlite 读写只需要亚毫秒级的时间，直接在事件循环中执行
+        cached, key = self._owner._lookup(kwargs)
+        if cached is not None:
+            return cached
+        response = await self._owner.inner.chat.completions.create(**kwargs)
+        return self._owner._store(key, response)
+
+
+class CachedChatClient:
+    """
+    包装任意具有 chat.completions.create 接口的客户端（同步或异步都可以），在调用前后读写响应缓存。
+    流式请求 (stream=True) 不经过缓存；严格回放模式下流式请求直接抛出 LLMCacheMiss。
+    """
+    def __init__(self, inner: Any, store: ResponseStore, mode: str = "on", is_async: Optional[bool] = None):
+        if mode not in CACHE_MODES or mode == "off":
+            raise ValueError(f"Unsupported LLM cache mode '{mode}'.")
+        self.inner = inner
+        self.store = store
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        if is_async is None:
+            # AsyncOpenAI 的 create 是被装饰过的普通函数，iscoroutinefunction 对它返回 False
+            is_async = isinstance(inner, AsyncOpenAI) or inspect.iscoroutinefunction(inner.chat.completions.create)
+        completions_class = _AsyncCachedCompletions if is_async else _CachedCompletions
+        self.chat = SimpleNamespace(completions=completions_class(self))
+
+    def __getattr__(self, item: str) -> Any:
+        # 其他属性（例如 with_options、models）交给被包装的客户端
+        return getattr(self.inner, item)
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _lookup(self, kwargs: Dict[str, Any]):
+        """返回 (缓存的响应或 None, 缓存键)。不可缓存的请求返回的键为 None。"""
+        if kwargs.get("stream"):
+            if self.mode == "replay":
+                # 流式响应从未被录制过，放行就会访问真实 LLM
+                raise LLMCacheMiss("Streamed requests are not cached; disable LLM_STREAM in strict replay mode.")
+            return None, None
+        key = cache_key(kwargs)
+        if self.mode != "record":
+            cached = self.store.get(key)
+            if cached is not None:
+                self._count(hit=True)
+                return ChatCompletion.model_validate_json(cached), key
+        self._count(hit=False)
+        if self.mode == "replay":
+            raise LLMCacheMiss(f"LLM cache miss in strict replay mode (key {key[:12]}…).")
+        return None, key
+
+    def _store(self, key: Optional[str], response: Any) -> Any:
+        if key is not None and hasattr(response, "model_dump_json"):
+            self.store.put(key, response.model_dump_json())
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": self.store.count(),
+        }
+
+
+_stores: Dict[str, ResponseStore] = {}
+_stores_lock = threading.Lock()
+
+
+def wrap_with_cache(client: Any, mode: str = LLM_CACHE_MODE, path: str = LLM_CACHE_PATH,
+                    is_async: Optional[bool] = None) -> Any:
+    """
+    按 LLM_CACHE_MODE 给客户端套上响应缓存；mode 为 off 时原样返回。同一路径的存储在进程内共享。
+    is_async 为 None 时根据客户端自动判断。
+    """
+    if mode == "off":
+        return client
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ResponseStore(path)
+        store = _stores[path]
+    return CachedChatClient(client, store, mode, is_async=is_async)
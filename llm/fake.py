@@ -0,0 +1,215 @@
+# llm/fake.py
+"""
+不需要网络的 LLM 客户端，接口与 openai.OpenAI / AsyncOpenAI 的 chat.completions.create 一致。
+
+- LLM_PROVIDER=fake:   内置的确定性策略：先搜索，再逐个阅读搜索结果中的网页，最后 finish。
+- LLM_PROVIDER=replay: 按轮次回放 LLM_REPLAY_FILE 中预先写好的 JSON 决策。
+
+两者都支持注入固定延迟 (FAKE_LLM_LATENCY_MS)，配合 FAKE_WEB=1 可以在 CI 中离线跑通完整的 ReAct 循环。
+stream=True 时按 FAKE_LLM_CHUNK_CHARS 把输出切成 ChatCompletionChunk 逐块返回，FAKE_LLM_LATENCY_MS 相当于首个分块的延迟。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from memory import estimate_tokens
+
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+# fake 策略在 finish 之前阅读的网页数量
+FAKE_LLM_TOOL_STEPS = int(os.getenv("FAKE_LLM_TOOL_STEPS", "2"))
+# fake 策略每个 thought 的单词数，用来模拟真实的输出长度
+FAKE_LLM_THOUGHT_WORDS = int(os.getenv("FAKE_LLM_THOUGHT_WORDS", "40"))
+LLM_REPLAY_FILE = os.getenv("LLM_REPLAY_FILE", "")
+# 流式输出时每个分块的字符数和分块之间的延迟，用来模拟逐 token 生成
+FAKE_LLM_CHUNK_CHARS = int(os.getenv("FAKE_LLM_CHUNK_CHARS", "16"))
+FAKE_LLM_CHUNK_MS = float(os.getenv("FAKE_LLM_CHUNK_MS", "0"))
+
+_LINK_RE = re.compile(r"Link: (https?://[^\s\\\"]+)")
+_FILLER = "analyze the observations so far and decide which independent step moves the goal forward".split()
+
+
+def make_completion(model: str, decision: Union[Dict[str, Any], str], prompt_tokens: int = 0) -> Dict[str, Any]:
+    """构造一个 OpenAI chat.completion 格式的响应体。decision 是字符串时原样作为模型输出（用于模拟不合法的 JSON）。"""
+    content = decision if isinstance(decision, str) else json.dumps(decision, ensure_ascii=False)
+    completion_tokens = estimate_tokens(content)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def _turn_index(messages: List[Dict[str, Any]]) -> int:
+    """已经完成的轮数 = 历史中 "Thought:" 消息的数量。"""
+    return sum(1 for m in messages if m.get("role") == "assistant" and str(m.get("content", "")).startswith("Thought:"))
+
+
+def _goal_text(messages: List[Dict[str, Any]]) -> str:
+    for m in messages:
+        if m.get("role") == "user":
+            return str(m.get("content", ""))
+    return ""
+
+
+class FakePolicy:
+    """确定性的决策策略：搜索 -> 阅读 tool_steps 个结果网页 -> finish。决策只取决于消息内容。"""
+    def __init__(self, tool_steps: int = FAKE_LLM_TOOL_STEPS, thought_words: int = FAKE_LLM_THOUGHT_WORDS):
+        self.tool_steps = tool_steps
+        self.thought_words = thought_words
+
+    def _thought(self, prefix: str) -> str:
+        filler = " ".join(_FILLER[i % len(_FILLER)] for i in range(self.thought_words))
+        return f"{prefix} {filler}"
+
+    def decide(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        turn = _turn_index(messages)
+        if turn == 0:
+            query = hashlib.sha1(_goal_text(messages).encode("utf-8")).hexdigest()[:8]
+            return {"thought": self._thought("Search for the goal first."),
+                    "actions": [{"action": "web_surfer_tool", "action_input": {"search_query": f"topic {query}"}}]}
+
+        links = [link for m in messages if m.get("role") == "user" for link in _LINK_RE.findall(str(m.get("content", "")))]
+        if turn <= self.tool_steps and turn - 1 < len(links):
+            return {"thought": self._thought(f"Read result {turn}."),
+                    "actions": [{"action": "web_browser_tool", "action_input": {"url": links[turn - 1], "word_limit": 200}}]}
+        return {"thought": self._thought("I have enough information to answer."),
+                "actions": [{"action": "finish", "action_input": {}}]}
+
+
+class ReplayPolicy:
+    """
+    按轮次回放预先写好的决策。文件内容可以是决策列表（所有目标共用），
+    也可以是 {目标中的子串: 决策列表} 的字典，"*" 作为默认值。超出列表长度时重复最后一个决策。
+    列表中的字符串会原样作为模型输出，可以用来测试 Agent 对不合法 JSON 的容错。
+    """
+    def __init__(self, script: Union[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]):
+        self.script = script
+
+    @classmethod
+    def from_file(cls, path: str) -> "ReplayPolicy":
+        if not path:
+            raise ValueError("LLM_PROVIDER is 'replay', but LLM_REPLAY_FILE is not set!")
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _decisions(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if isinstance(self.script, list):
+            return self.script
+        goal = _goal_text(messages)
+        for key, decisions in self.script.items():
+            if key != "*" and key in goal:
+                return decisions
+        if "*" not in self.script:
+            raise KeyError("No replay script matches this goal and no '*' default is defined.")
+        return self.script["*"]
+
+    def decide(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        decisions = self._decisions(messages)
+        return decisions[min(_turn_index(messages), len(decisions) - 1)]
+
+
+class _Completions:
+    def __init__(self, owner: "FakeChatClient"):
+        self._owner = owner
+
+    def create(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, **kwargs: Any) -> Any:
+        if stream:
+            return self._stream(model, messages)
+        completion = self._owner.complete(model, messages)
+        delay = self._owner.latency + self._owner.generation_time(completion)
+        if delay:
+            time.sleep(delay)
+        return completion
+
+    def _stream(self, model: str, messages: List[Dict[str, Any]]) -> Iterator[ChatCompletionChunk]:
+        if self._owner.latency:
+            time.sleep(self._owner.latency)
+        for chunk in self._owner.complete_chunks(model, messages):
+            yield chunk
+            if self._owner.chunk_latency:
+                time.sleep(self._owner.chunk_latency)
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, **kwargs: Any) -> Any:
+        if stream:
+            return self._astream(model, messages)
+        completion = self._owner.complete(model, messages)
+        delay = self._owner.latency + self._owner.generation_time(completion)
+        if delay:
+            await asyncio.sleep(delay)
+        return completion
+
+    async def _astream(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[ChatCompletionChunk]:
+        if self._owner.latency:
+            await asyncio.sleep(self._owner.latency)
+        for chunk in self._owner.complete_chunks(model, messages):
+            yield chunk
+            if self._owner.chunk_latency:
+                await asyncio.sleep(self._owner.chunk_latency)
+
+
+class FakeChatClient:
+    """同步的假客户端：client.chat.completions.create(...) 返回真正的 ChatCompletion 对象。"""
+    _completions_class = _Completions
+
+    def __init__(self, policy: Any, latency_ms: float = FAKE_LLM_LATENCY_MS,
+                 chunk_chars: int = FAKE_LLM_CHUNK_CHARS, chunk_latency_ms: float = FAKE_LLM_CHUNK_MS):
+        self.policy = policy
+        self.latency = latency_ms / 1000
+        self.chunk_chars = max(chunk_chars, 1)
+        self.chunk_latency = chunk_latency_ms / 1000
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=self._completions_class(self))
+
+    def complete(self, model: str, messages: List[Dict[str, Any]]) -> ChatCompletion:
+        self.requests += 1
+        decision = self.policy.decide(messages)
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+        return ChatCompletion.model_validate(make_completion(model, decision, prompt_tokens))
+
+    def generation_time(self, completion: ChatCompletion) -> float:
+        """非流式请求也要等全部分块“生成”完才返回，这样流式与非流式的总耗时一致，便于对比。"""
+        chars = len(completion.choices[0].message.content or "")
+        return -(-chars // self.chunk_chars) * self.chunk_latency
+
+    def complete_chunks(self, model: str, messages: List[Dict[str, Any]]) -> List[ChatCompletionChunk]:
+        """把完整的回复切成流式分块：内容分块、带 finish_reason 的结束分块，以及只带 usage 的最后一个分块。"""
+        completion = self.complete(model, messages)
+        content = completion.choices[0].message.content or ""
+        base = {"id": completion.id, "object": "chat.completion.chunk", "created": completion.created, "model": model}
+        chunks = [
+            {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": content[i:i + self.chunk_chars]},
+                                  "finish_reason": None}]}
+            for i in range(0, len(content), self.chunk_chars)
+        ]
+        chunks.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        chunks.append({**base, "choices": [], "usage": completion.usage.model_dump()})
+        return [ChatCompletionChunk.model_validate(chunk) for chunk in chunks]
+
+
+class AsyncFakeChatClient(FakeChatClient):
+    """异步的假客户端，延迟用 asyncio.sleep 模拟，不阻塞事件循环。"""
+    _completions_class = _AsyncCompletions
+
+
+def create_fake_client(provider: str, async_client: bool = False, latency_ms: Optional[float] = None) -> FakeChatClient:
+    policy = ReplayPolicy.from_file(LLM_REPLAY_FILE) if provider == "replay" else FakePolicy()
+    client_class = AsyncFakeChatClient if async_client else FakeChatClient
+    return client_class(policy, FAKE_LLM_LATENCY_MS if latency_ms is None else latency_ms)
@@ -0,0 +1,434 @@
+# llm/router.py
+"""
+多服务商路由：LLM_PROVIDER=router 时，Agent 的 LLM 客户端在多个服务商 / 模型之间选择、重试和对冲请求。
+
+- 连接池：每个服务商只创建一个 OpenAI SDK 客户端，在所有会话和线程之间共享，HTTP 连接保持复用。
+- 超时与重试：每个服务商有自己的超时（SDK 自身的重试关闭，由路由统一处理）。连接错误、超时、408、409、429 和 5xx
+  会换到下一个服务商重试；同一个服务商再次重试前按指数退避等待。401、403 和 404 通常是某个服务商的密钥、权限或
+  模型名配置有误，只换到其他服务商重试，所有服务商都试过后直接抛出。400、422 等请求本身的错误直接抛出，
+  也不计入服务商的失败次数。
+- 延迟感知：按每个服务商最近成功请求耗时的指数滑动平均 (EWMA) 排序，优先使用最快的；还没有样本的服务商优先试用，
+  另有 LLM_ROUTER_EXPLORE 的概率随机选择，让较慢的服务商的统计保持更新。
+  连续失败 LLM_ROUTER_FAILURE_THRESHOLD 次的服务商暂停使用 LLM_ROUTER_COOLDOWN_S 秒。
+- 对冲请求 (LLM_ROUTER_HEDGE=true)：主服务商在其 p95 延迟内还没有返回时，向第二个服务商发送同样的请求，
+  先成功的响应胜出（异步客户端会取消另一个请求）。只用于非流式请求，代价是尾部请求多花一次调用。
+
+服务商配置来自 LLM_ROUTER_CONFIG 指向的 JSON 文件:
+    {"providers": [
+        {"name": "primary", "provider": "openai"},
+        {"name": "backup", "base_url": "http://127.0.0.1:8001/v1", "model": "qwen2.5", "api_key_env": "BACKUP_KEY",
+         "timeout": 20}
+    ]}
+（带 provider 字段的条目沿用 .env 中该服务商的密钥、地址和模型），或者 LLM_ROUTER_PROVIDERS=openai,deepseek。
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Deque, Dict, List, Optional
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+LLM_ROUTER_CONFIG = os.getenv("LLM_ROUTER_CONFIG", "")
+LLM_ROUTER_PROVIDERS = os.getenv("LLM_ROUTER_PROVIDERS", "")
+# 每个服务商的默认超时（秒），可以在配置文件中按服务商覆盖
+LLM_ROUTER_TIMEOUT = float(os.getenv("LLM_ROUTER_TIMEOUT", "60"))
+# 一次请求最多尝试的次数（包括换到其他服务商），以及同一服务商重试前的基础退避时间
+LLM_ROUTER_MAX_ATTEMPTS = int(os.getenv("LLM_ROUTER_MAX_ATTEMPTS", "3"))
+LLM_ROUTER_BACKOFF_MS = float(os.getenv("LLM_ROUTER_BACKOFF_MS", "200"))
+LLM_ROUTER_HEDGE = os.getenv("LLM_ROUTER_HEDGE", "false").lower() in ("1", "true", "yes")
+# 对冲的触发点：主服务商延迟分布的分位数，以及开始对冲前至少需要的样本数
+LLM_ROUTER_HEDGE_QUANTILE = float(os.getenv("LLM_ROUTER_HEDGE_QUANTILE", "0.95"))
+LLM_ROUTER_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_ROUTER_HEDGE_MIN_SAMPLES", "20"))
+LLM_ROUTER_EXPLORE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))
+LLM_ROUTER_FAILURE_THRESHOLD = int(os.getenv("LLM_ROUTER_FAILURE_THRESHOLD", "3"))
+LLM_ROUTER_COOLDOWN_S = float(os.getenv("LLM_ROUTER_COOLDOWN_S", "30"))
+# 每个服务商保留的延迟样本数；EWMA 的平滑系数
+LATENCY_WINDOW = 200
+EWMA_ALPHA = 0.2
+# 这些状态码说明是服务商暂时的问题（超时、冲突、限流），稍后或换一个服务商可能成功
+RETRYABLE_STATUS = (408, 409, 429)
+# 这些状态码说明是某个服务商的配置问题（密钥、权限、模型名），只有换一个服务商才可能成功
+PROVIDER_CONFIG_STATUS = (401, 403, 404)
+
+
+@dataclass
+class ProviderConfig:
+    """一个服务商 / 模型。"""
+    name: str
+    model: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    timeout: float = LLM_ROUTER_TIMEOUT
+    provider: str = "custom"
+
+
+def load_provider_configs(path: str = LLM_ROUTER_CONFIG, names: str = LLM_ROUTER_PROVIDERS) -> List[ProviderConfig]:
+    """读取路由配置：优先使用 JSON 配置文件，否则使用 LLM_ROUTER_PROVIDERS 中列出的服务商。"""
+    from llm import resolve_provider
+
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f).get("providers", [])
+    else:
+        entries = [{"name": name.strip(), "provider": name.strip()} for name in names.split(",") if name.strip()]
+    if not entries:
+        raise ValueError("LLM_PROVIDER is 'router', but neither LLM_ROUTER_CONFIG nor LLM_ROUTER_PROVIDERS is set!")
+
+    configs = []
+    for i, entry in enumerate(entries):
+        provider = entry.get("provider", "custom")
+        api_key = entry.get("api_key") or (os.getenv(entry["api_key_env"]) if entry.get("api_key_env") else None)
+        base_url, model = entry.get("base_url"), entry.get("model")
+        if "provider" in entry:
+            default_key, default_url, default_model = resolve_provider(provider)
+            api_key, base_url, model = api_key or default_key, base_url or default_url, model or default_model
+        if not model:
+            raise ValueError(f"Router provider #{i} ('{entry.get('name', provider)}') has no model.")
+        configs.append(ProviderConfig(name=entry.get("name") or provider, model=model, base_url=base_url,
+                                      api_key=api_key or "none", timeout=float(entry.get("timeout", LLM_ROUTER_TIMEOUT)),
+                                      provider=provider))
+    return configs
+
+
+def is_provider_config_error(error: BaseException) -> bool:
+    return isinstance(error, openai.APIStatusError) and error.status_code in PROVIDER_CONFIG_STATUS
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    连接错误、超时、限流、服务端错误和服务商的配置错误值得换个服务商重试，并计入该服务商的失败次数；
+    请求本身有问题时重试也没有用。
+    """
+    if isinstance(error, openai.APIConnectionError):  # 包括 APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return (error.status_code >= 500 or error.status_code in RETRYABLE_STATUS
+                or error.status_code in PROVIDER_CONFIG_STATUS)
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+class ProviderState:
+    """一个服务商的延迟样本、健康状态和计数。流式请求只统计到首个响应的时间，与非流式分开记录。"""
+    def __init__(self, config: ProviderConfig, window: int = LATENCY_WINDOW):
+        self.config = config
+        self.latencies: Dict[bool, Deque[float]] = {False: deque(maxlen=window), True: deque(maxlen=window)}
+        self.ewma: Dict[bool, Optional[float]] = {False: None, True: None}
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.unavailable_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def record_success(self, seconds: float, stream: bool):
+        with self._lock:
+            self.requests += 1
+            self.consecutive_failures = 0
+            self.latencies[stream].append(seconds)
+            previous = self.ewma[stream]
+            self.ewma[stream] = seconds if previous is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * previous
+
+    def record_failure(self, threshold: int = LLM_ROUTER_FAILURE_THRESHOLD, cooldown: float = LLM_ROUTER_COOLDOWN_S):
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= threshold:
+                self.unavailable_until = time.monotonic() + cooldown
+
+    def record_hedge(self, won: bool):
+        """记录一次以本服务商为对冲目标的请求，以及对冲请求是否先返回。"""
+        with self._lock:
+            self.hedges += 1
+            if won:
+                self.hedge_wins += 1
+
+    def available(self, now: float) -> bool:
+        return now >= self.unavailable_until
+
+    def expected_latency(self, stream: bool) -> float:
+        # 没有样本的服务商视为最快，保证每个服务商都会被试用
+        return self.ewma[stream] or 0.0
+
+    def quantile(self, q: float, stream: bool, min_samples: int = LLM_ROUTER_HEDGE_MIN_SAMPLES) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.latencies[stream])
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p95 = self.quantile(0.5, False, 1), self.quantile(0.95, False, 1)
+        return {
+            "model": self.config.model,
+            "requests": self.requests,
+            "failures": self.failures,
+            "available": self.available(time.monotonic()),
+            "ewma_ms": round(self.ewma[False] * 1000, 1) if self.ewma[False] is not None else None,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+class ProviderRouter:
+    """路由策略本身（选择顺序、退避、对冲时机），与同步 / 异步的调用方式无关，可在多个客户端之间共享。"""
+    def __init__(self, providers: List[ProviderConfig], max_attempts: int = LLM_ROUTER_MAX_ATTEMPTS,
+                 backoff_ms: float = LLM_ROUTER_BACKOFF_MS, hedge: bool = LLM_ROUTER_HEDGE,
+                 hedge_quantile: float = LLM_ROUTER_HEDGE_QUANTILE, explore: float = LLM_ROUTER_EXPLORE):
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider.")
+        self.states = [ProviderState(config) for config in providers]
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff_ms / 1000
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.explore = explore
+
+    def order(self, stream: bool, tried: List[ProviderState]) -> List[ProviderState]:
+        """本次尝试的服务商顺序：可用且本次请求还没试过的按预期延迟排序，其余的排在后面作为最后手段。"""
+        now = time.monotonic()
+        fresh = sorted((s for s in self.states if s.available(now) and s not in tried),
+                       key=lambda s: s.expected_latency(stream))
+        if len(fresh) > 1 and random.random() < self.explore:
+            fresh.insert(0, fresh.pop(random.randrange(1, len(fresh))))
+        rest = [s for s in self.states if s not in fresh]
+        rest.sort(key=lambda s: (s in tried, not s.available(now), s.expected_latency(stream)))
+        return fresh + rest
+
+    def backoff_seconds(self, retry: int) -> float:
+        """同一服务商第 retry 次重试前的等待时间：指数退避加随机抖动，避免所有会话同时重试。"""
+        return self.backoff * (2 ** retry) * random.uniform(0.5, 1.0)
+
+    def hedge_delay(self, primary: ProviderState, stream: bool) -> Optional[float]:
+        if not self.hedge or stream or len(self.states) < 2:
+            return None
+        return primary.quantile(self.hedge_quantile, stream)
+
+    @staticmethod
+    def request_kwargs(state: ProviderState, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {**kwargs, "model": state.config.model}
+
+    def stats(self) -> Dict[str, Any]:
+        return {state.name: state.stats() for state in self.states}
+
+
+def _create_sdk_client(config: ProviderConfig, async_client: bool) -> Any:
+    if config.provider in ("fake", "replay"):
+        from llm.fake import create_fake_client
+        return create_fake_client(config.provider, async_client=async_client)
+    client_class = openai.AsyncOpenAI if async_client else openai.OpenAI
+    # 重试由路由负责：SDK 自己的重试会让超时成倍增加，也无法换到其他服务商
+    return client_class(api_key=config.api_key, base_url=config.base_url, timeout=config.timeout, max_retries=0)
+
+
+class _RouterClientBase:
+    def __init__(self, router: ProviderRouter, async_client: bool):
+        self.router = router
+        self.clients = {state.name: _create_sdk_client(state.config, async_client) for state in router.states}
+
+    def _plan(self, stream: bool, tried: List[ProviderState]):
+        """返回 (主服务商, 对冲服务商或 None, 对冲延迟或 None, 重试前的退避时间)。"""
+        order = self.router.order(stream, tried)
+        primary = order[0]
+        # 只向可用且本次请求还没失败过的服务商对冲
+        now = time.monotonic()
+        secondary = next((s for s in order[1:] if s.available(now) and s not in tried), None)
+        delay = self.router.hedge_delay(primary, stream) if secondary is not None else None
+        wait_seconds = self.router.backoff_seconds(tried.count(primary)) if primary in tried else 0.0
+        return primary, secondary, delay, wait_seconds
+
+    def _should_retry(self, error: BaseException, attempt: int, tried: List[ProviderState]) -> bool:
+        """tried 已经包含本次失败的服务商。"""
+        if not is_retryable(error) or attempt == self.router.max_attempts - 1:
+            return False
+        # 密钥、权限和模型名错误在同一个服务商上重试没有意义
+        return not is_provider_config_error(error) or any(s not in tried for s in self.router.states)
+
+    @staticmethod
+    def _record_failure(state: ProviderState, error: BaseException):
+        # 请求本身的错误（例如 400）与服务商的健康无关，不能让它进入冷却
+        if is_retryable(error):
+            state.record_failure()
+
+    def _log_retry(self, state: ProviderState, error: BaseException, attempt: int):
+        logger.warning("⚠️ LLM provider '%s' failed (attempt %s/%s): %s", state.name, attempt + 1,
+                       self.router.max_attempts, error)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.router.stats()
+
+
+class RouterClient(_RouterClientBase):
+    """同步客户端，chat.completions.create 的接口与 OpenAI SDK 一致。对冲请求在专用线程池中发出。"""
+    def __init__(self, router: ProviderRouter):
+        super().__init__(router, async_client=False)
+        self._hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _call(self, state: ProviderState, kwargs: Dict[str, Any]) -> Any:
+        stream = bool(kwargs.get("stream"))
+        start = time.perf_counter()
+        try:
+            response = self.clients[state.name].chat.completions.create(**self.router.request_kwargs(state, kwargs))
+        except Exception as e:
+            self._record_failure(state, e)
+            raise
+        state.record_success(time.perf_counter() - start, stream)
+        return response
+
+    def _hedged(self, primary: ProviderState, secondary: ProviderState, kwargs: Dict[str, Any], delay: float,
+                failed: List[ProviderState]) -> Any:
+        """对冲请求；失败的服务商按失败顺序追加到 failed 中（两个都失败时两个都在）。"""
+        first = self._hedge_executor.submit(self._call, primary, kwargs)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        except Exception:
+            failed.append(primary)
+            raise
+        # 同步的 HTTP 请求无法取消：落后的请求在后台完成，结果丢弃，但它的延迟仍然计入统计
+        second = self._hedge_executor.submit(self._call, secondary, kwargs)
+        states = {first: primary, second: secondary}
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        won = False
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        won = future is second
+                        return future.result()
+                    failed.append(states[future])
+                    error = future.exception()
+            raise error
+        finally:
+            secondary.record_hedge(won)
+
+    def create(self, **kwargs: Any) -> Any:
+        stream = bool(kwargs.get("stream"))
+        tried: List[ProviderState] = []
+        for attempt in range(self.router.max_attempts):
+            primary, secondary, delay, wait_seconds = self._plan(stream, tried)
+            failed: List[ProviderState] = []
+            if wait_seconds:
+                time.sleep(wait_seconds)
+            try:
+                if delay is not None:
+                    return self._hedged(primary, secondary, kwargs, delay, failed)
+                return self._call(primary, kwargs)
+            except Exception as e:
+                # 对冲的两个请求都失败时，两个服务商都算本次请求已经试过
+                tried.extend(failed or [primary])
+                if not self._should_retry(e, attempt, tried):
+                    raise
+                self._log_retry(failed[-1] if failed else primary, e, attempt)
+
+
+class AsyncRouterClient(_RouterClientBase):
+    """异步客户端。对冲时先返回的请求胜出，另一个请求被取消。"""
+    def __init__(self, router: ProviderRouter):
+        super().__init__(router, async_client=True)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def _call(self, state: ProviderState, kwargs: Dict[str, Any]) -> Any:
+        stream = bool(kwargs.get("stream"))
+        start = time.perf_counter()
+        try:
+            response = await self.clients[state.name].chat.completions.create(**self.router.request_kwargs(state, kwargs))
+        except Exception as e:
+            self._record_failure(state, e)
+            raise
+        state.record_success(time.perf_counter() - start, stream)
+        return response
+
+    async def _hedged(self, primary: ProviderState, secondary: ProviderState, kwargs: Dict[str, Any],
+                      delay: float, failed: List[ProviderState]) -> Any:
+        """对冲请求；失败的服务商按失败顺序追加到 failed 中（两个都失败时两个都在）。"""
+        first = asyncio.ensure_future(self._call(primary, kwargs))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            if first.exception() is not None:
+                failed.append(primary)
+            return first.result()
+        second = asyncio.ensure_future(self._call(secondary, kwargs))
+        states = {first: primary, second: secondary}
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        won = False
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        won = task is second
+                        return task.result()
+                    failed.append(states[task])
+                    error = task.exception()
+            raise error
+        finally:
+            secondary.record_hedge(won)
+            for task in pending:
+                task.cancel()
+
+    async def create(self, **kwargs: Any) -> Any:
+        stream = bool(kwargs.get("stream"))
+        tried: List[ProviderState] = []
+        for attempt in range(self.router.max_attempts):
+            primary, secondary, delay, wait_seconds = self._plan(stream, tried)
+            failed: List[ProviderState] = []
+            if wait_seconds:
+                await asyncio.sleep(wait_seconds)
+            try:
+                if delay is not None:
+                    return await self._hedged(primary, secondary, kwargs, delay, failed)
+                return await self._call(primary, kwargs)
+            except Exception as e:
+                # 对冲的两个请求都失败时，两个服务商都算本次请求已经试过
+                tried.extend(failed or [primary])
+                if not self._should_retry(e, attempt, tried):
+                    raise
+                self._log_retry(failed[-1] if failed else primary, e, attempt)
+
+
+_shared_router: Optional[ProviderRouter] = None
+_shared_router_lock = threading.Lock()
+
+
+def get_router() -> ProviderRouter:
+    """进程内共享的路由器：同步客户端（摘要）和异步客户端使用同一份延迟统计。"""
+    global _shared_router
+    with _shared_router_lock:
+        if _shared_router is None:
+            _shared_router = ProviderRouter(load_provider_configs())
+            logger.info("🔀 LLM router: %s (hedge=%s)", [f"{s.name}:{s.config.model}" for s in _shared_router.states],
+                        _shared_router.hedge)
+        return _shared_router
+
+
+def router_stats() -> Optional[Dict[str, Any]]:
+    """共享路由器中每个服务商的统计；没有使用路由时返回 None。"""
+    return _shared_router.stats() if _shared_router is not None else None
+
+
+def create_router_client(async_client: bool = False, router: Optional[ProviderRouter] = None) -> Any:
+    router = router or get_router()
+    return AsyncRouterClient(router) if async_client else RouterClient(router)
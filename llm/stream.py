@@ -0,0 +1,243 @@
+# llm/stream.py
+"""
+流式决策的增量解析与容错。
+
+模型按 {"thought": "...", "actions": [{"action": ..., "action_input": {...}}, ...]} 的格式逐块输出，
+DecisionStreamParser 在每个分块到达时只扫描新增的字符：
+- thought 字段的内容一边生成一边以增量的形式返回，UI 可以实时显示；
+- actions 列表中的每个行动在它的右花括号到达时立即返回，Agent 不必等 JSON 结束就可以开始执行工具；
+- 旧的单行动格式 (action + action_input) 在两个字段都完整后返回。
+
+parse_decision 负责最终的解析：先按标准 JSON 解析，失败时尝试修复常见的问题
+（Markdown 代码块、前后的多余文字、末尾多余的逗号、被截断的字符串和括号）。
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# 解析事件：("thought", 新增的思考文本) 或 ("action", {"action": ..., "action_input": {...}})
+StreamEvent = Tuple[str, Any]
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+class DecisionParseError(ValueError):
+    """模型输出无法解析（也无法修复）成决策字典。"""
+
+
+def _decode_partial_string(raw: str) -> Tuple[str, int]:
+    """
+    解码一个尚未结束的 JSON 字符串片段，返回 (解码结果, 已解码的原始字符数)。
+    末尾不完整的转义序列不计入已解码的部分，留到下一次再解码。
+    """
+    if "\\" not in raw:
+        return raw, len(raw)
+    # 最长的转义序列是代理对 \uXXXX\uXXXX，最多回退 12 个字符就能找到安全的截断位置；
+    # 以高位代理结尾的片段要等低位代理到达后一起解码，否则会得到两个落单的代理字符
+    for cut in range(len(raw), max(len(raw) - 12, 0) - 1, -1):
+        try:
+            decoded = json.loads(f'"{raw[:cut]}"')
+        except ValueError:
+            continue
+        if decoded and "\ud800" <= decoded[-1] <= "\udbff":
+            continue
+        return decoded, cut
+    return "", 0
+
+
+class DecisionStreamParser:
+    """
+    流式决策的增量解析器。feed 每次只扫描新增的字符，不会重复解析已经收到的部分；
+    finish 在流结束后返回完整的决策（必要时经过修复）。
+    """
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        # 顶层对象的状态：下一个字符串是键还是值、当前的键、当前值的起始位置
+        self._expect_key = True
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self.fields: Dict[str, Any] = {}
+        # thought 字符串中还没有解码返回的部分的起始位置（不在 thought 中时为 None）
+        self._thought_start: Optional[int] = None
+        # actions 列表中当前行动对象的起始位置
+        self._action_start: Optional[int] = None
+        self._legacy_sent = False
+        self.done = False
+        self.actions: List[Dict[str, Any]] = []
+
+    def feed(self, delta: Optional[str]) -> List[StreamEvent]:
+        """追加一段模型输出，返回这段文本带来的新事件。"""
+        if not delta:
+            return []
+        self.text += delta
+        events: List[StreamEvent] = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            self._scan(text, pos, text[pos], events)
+        self._pos = len(text)
+        if self._in_string and self._thought_start is not None:
+            self._emit_thought(text, len(text), events)
+        return events
+
+    def _scan(self, text: str, pos: int, ch: str, events: List[StreamEvent]):
+        stack = self._stack
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                self._close_string(text, pos, events)
+            return
+        if not stack:
+            # 忽略 JSON 之前和之后的文字（例如 Markdown 代码块标记）
+            if ch == "{" and not self.done:
+                stack.append("{")
+                self._expect_key = True
+            return
+
+        top_level = len(stack) == 1
+        if ch == '"':
+            self._in_string = True
+            self._string_start = pos + 1
+            if top_level and not self._expect_key:
+                self._value_start = pos
+                if self._key == "thought":
+                    self._thought_start = pos + 1
+        elif ch in "{[":
+            if top_level:
+                self._value_start = pos
+            elif self._key == "actions" and stack == ["{", "["] and ch == "{":
+                self._action_start = pos
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if len(stack) == 1:
+                self._close_value(text, pos + 1, events)
+            elif len(stack) == 2 and self._action_start is not None and self._key == "actions":
+                self._close_action(text[self._action_start:pos + 1], events)
+                self._action_start = None
+            elif not stack:
+                # 顶层对象结束，最后一个字段是数字、布尔值或 null 时在这里收尾
+                self.done = True
+                self._close_value(text, pos, events)
+        elif top_level and ch == ":":
+            # 数字、布尔值和 null 从冒号之后开始；字符串和容器会在遇到引号或括号时覆盖这个位置
+            self._expect_key = False
+            self._value_start = pos + 1
+        elif top_level and ch == ",":
+            if self._value_start is not None:
+                self._close_value(text, pos, events)
+            self._expect_key = True
+
+    def _close_string(self, text: str, pos: int, events: List[StreamEvent]):
+        if len(self._stack) != 1:
+            return
+        if self._expect_key:
+            try:
+                self._key = json.loads(text[self._string_start - 1:pos + 1])
+            except ValueError:
+                self._key = None
+            return
+        if self._thought_start is not None and self._key == "thought":
+            self._emit_thought(text, pos, events)
+            self._thought_start = None
+        self._close_value(text, pos + 1, events)
+
+    def _close_value(self, text: str, end: int, events: List[StreamEvent]):
+        if self._value_start is None or self._key is None:
+            return
+        try:
+            self.fields[self._key] = json.loads(text[self._value_start:end])
+        except ValueError:
+            pass
+        self._value_start = None
+        if (not self._legacy_sent and "action" in self.fields and "action_input" in self.fields
+                and not isinstance(self.fields.get("actions"), list)):
+            self._legacy_sent = True
+            self._close_action({"action": self.fields["action"], "action_input": self.fields["action_input"]}, events)
+
+    def _close_action(self, raw: Any, events: List[StreamEvent]):
+        try:
+            item = json.loads(raw) if isinstance(raw, str) else raw
+        except ValueError:
+            return
+        if not isinstance(item, dict) or not isinstance(item.get("action"), str):
+            return
+        action_input = item.get("action_input") or {}
+        action = {"action": item["action"], "action_input": action_input if isinstance(action_input, dict) else {}}
+        self.actions.append(action)
+        events.append(("action", action))
+
+    def _emit_thought(self, text: str, end: int, events: List[StreamEvent]):
+        # 只解码上次之后新增的部分，每个字符只解码一次
+        decoded, consumed = _decode_partial_string(text[self._thought_start:end])
+        self._thought_start += consumed
+        if decoded:
+            events.append(("thought", decoded))
+
+    def finish(self) -> Dict[str, Any]:
+        """流结束后返回完整的决策；无法解析时抛出 DecisionParseError。"""
+        return parse_decision(self.text)
+
+
+def repair_json(text: str) -> str:
+    """
+    尽量把不合法的模型输出修复成合法的 JSON 对象文本：
+    去掉第一个 '{' 之前和对象结束之后的文字，补全被截断的字符串和括号，删除末尾多余的逗号。
+    """
+    start = text.find("{")
+    if start < 0:
+        raise DecisionParseError("No JSON object found in model output.")
+    stack: List[str] = []
+    in_string = escape = False
+    end = len(text)
+    for pos in range(start, len(text)):
+        ch = text[pos]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+            if not stack:
+                end = pos + 1
+                break
+    repaired = text[start:end]
+    if in_string:
+        repaired = repaired.rstrip("\\") + '"'
+    repaired = repaired.rstrip()
+    if repaired.endswith(":"):
+        repaired += " null"
+    repaired = repaired.rstrip(",") + "".join(reversed(stack))
+    return _TRAILING_COMMA_RE.sub(r"\1", repaired)
+
+
+def parse_decision(text: Optional[str]) -> Dict[str, Any]:
+    """把模型输出解析成决策字典：先按标准 JSON 解析，失败时修复后再试一次。"""
+    if not text:
+        raise DecisionParseError("Model returned an empty response.")
+    try:
+        decision = json.loads(text)
+    except ValueError:
+        try:
+            decision = json.loads(repair_json(text))
+        except ValueError as e:
+            raise DecisionParseError(f"Model output is not valid JSON: {e}") from e
+    if not isinstance(decision, dict):
+        raise DecisionParseError("Model output is valid JSON but not an object.")
+    return decision
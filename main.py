@@ -1,8 +1,16 @@
 import json
+import time
+import asyncio
 import argparse  # 导入命令行参数解析库
+import logging
+from typing import Any, Dict, List
 
-from agent import SmartAgent
+from agent import SmartAgent, AsyncSmartAgent
 from mcp.protocol import MCPMessage
+from tools.registry import profile_startup
+from tracing import LOG_LEVEL, configure_logging
+
+logger = logging.getLogger(__name__)
 
 def run_simulation_case(agent: SmartAgent, user_task: str, user_data: dict):
     """
@@ -19,7 +27,14 @@ def run_simulation_case(agent: SmartAgent, user_task: str, user_data: dict):
         data=user_data
     )
     
-    response = agent.handle_message(user_request)
+    session = agent.new_session(user_request)
+    result = agent.run_session(session)
+    response = MCPMessage(
+        sender_id=agent.agent_id,
+        receiver_id=user_request.sender_id,
+        task=user_task,
+        data={"result": result, **session.summary()},
+    )
     
     print("\n--- Final MCP Response from Agent ---")
     print(json.dumps(response.model_dump(), indent=2, ensure_ascii=False))
@@ -54,6 +69,153 @@ def run_all_simulations(agent: SmartAgent):
     print("✅ Simulation Suite Finished.")
 
 
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def load_goals(path: str) -> List[Dict[str, Any]]:
+    """
+    读取 JSONL 格式的目标文件。每行一个目标，支持两种写法：
+        {"id": "q1", "query": "苹果公司是谁创立的？"}
+        {"id": "calc", "task": "calculate", "data": {"expression": "3.14 * 10**2"}}
+    """
+    goals = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line)
+            entry.setdefault("id", str(line_no))
+            if "data" not in entry:
+                entry["data"] = {"query": entry.get("query", "")}
+            goals.append(entry)
+    return goals
+
+
+async def _run_batch(agent: AsyncSmartAgent, goals: List[Dict[str, Any]], concurrency: int,
+                     results_file, trace_file, max_turns: int) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    records: List[Dict[str, Any]] = []
+
+    async def one(entry: Dict[str, Any]):
+        async with semaphore:
+            request = MCPMessage(sender_id="batch_runner", receiver_id=agent.agent_id,
+                                 task=entry.get("task", "user_query"), data=entry["data"])
+            events: List[Dict[str, Any]] = []
+
+            def on_event(event: Dict[str, Any]):
+                # 流式模式下的 thought_delta 与完整的 thought 事件内容重复，不写入 trace
+                if event["type"] != "thought_delta":
+                    events.append(event)
+
+            session = agent.new_session(request, on_event=on_event)
+            try:
+                await agent.arun_session(session, max_turns=max_turns)
+                status = "finished" if session.finished else "max_turns"
+                error = None
+            except Exception as e:
+                session.complete(None, finished=False)
+                status, error = "error", str(e)
+
+        totals = session.prompt_builder.totals()
+        trace_summary = session.tracer.summary()
+        result = {
+            "id": entry["id"],
+            "session_id": session.session_id,
+            "status": status,
+            "result": session.result,
+            "error": error,
+            "latency_ms": round(session.elapsed * 1000, 1),
+            "turns": session.turn,
+            **{key: totals[key] for key in ("prompt_bytes", "prompt_tokens", "completion_tokens", "cached_tokens")},
+            # 各阶段（rag / prompt_build / llm / decode / tool）的总耗时
+            "phase_ms": {name: group["total_ms"] for name, group in trace_summary["phases"].items()
+                         if name not in ("goal", "turn")},
+        }
+        records.append(result)
+        # 每完成一个目标就写入一行，中途中断也不会丢失已完成的结果
+        results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        results_file.flush()
+        if trace_file:
+            trace = {"id": entry["id"], "session_id": session.session_id, "events": events,
+                     "turn_stats": session.prompt_builder.turn_stats, "memory": session.memory.stats(),
+                     "timing": trace_summary}
+            trace_file.write(json.dumps(trace, ensure_ascii=False, default=str) + "\n")
+            trace_file.flush()
+        logger.info("[%d/%d] %s: %s in %.0f ms, %d turns", len(records), len(goals), entry["id"], status,
+                    result["latency_ms"], session.turn)
+
+    await asyncio.gather(*(one(entry) for entry in goals))
+    return records
+
+
+def print_batch_report(records: List[Dict[str, Any]], elapsed: float, concurrency: int):
+    """打印整个批次的吞吐量、延迟分位数、轮次和 token 用量。"""
+    latencies = [r["latency_ms"] for r in records]
+    turns = [r["turns"] for r in records]
+    statuses: Dict[str, int] = {}
+    for r in records:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+
+    print("\n" + "=" * 60)
+    print(f"📦 Batch report: {len(records)} goals, concurrency {concurrency}, {elapsed:.2f}s")
+    print(f"  status:      {statuses}")
+    print(f"  throughput:  {len(records) / elapsed if elapsed else 0:.2f} goals/sec")
+    print(f"  latency:     p50={_percentile(latencies, 50):.0f} ms  p95={_percentile(latencies, 95):.0f} ms  "
+          f"p99={_percentile(latencies, 99):.0f} ms")
+    if turns:
+        print(f"  turns/goal:  mean={sum(turns) / len(turns):.2f}  max={max(turns)}")
+    for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "prompt_bytes"):
+        total = sum(r[key] or 0 for r in records)
+        print(f"  {key + ':':18s} total={total}  per goal={total / len(records) if records else 0:.0f}")
+    phases: Dict[str, float] = {}
+    for r in records:
+        for name, total_ms in r.get("phase_ms", {}).items():
+            phases[name] = phases.get(name, 0.0) + total_ms
+    if phases and records:
+        print("  time/goal:   " + "  ".join(f"{name}={total / len(records):.0f} ms" for name, total in phases.items()))
+    print("=" * 60)
+
+
+def run_batch(agent: AsyncSmartAgent, goals_path: str, concurrency: int, output_path: str,
+              trace_path: str = None, max_turns: int = 50):
+    """
+    批量运行模式：从 JSONL 文件读取目标，以给定的并发度在一个共享的 AsyncSmartAgent 上执行，
+    结果和每个目标的轨迹写入 JSONL，最后打印汇总报告。这是标准的压测/回归工具。
+    """
+    goals = load_goals(goals_path)
+    print(f"🚀 Running {len(goals)} goals from '{goals_path}' with concurrency {concurrency}...")
+
+    # 所有目标的知识库上下文先批量检索一遍，之后每个目标的 RAG 阶段直接命中缓存
+    start = time.perf_counter()
+    prefetched = agent.prefetch_context([MCPMessage(sender_id="batch_runner", receiver_id=agent.agent_id,
+                                                    task=entry.get("task", "user_query"), data=entry["data"])
+                                         for entry in goals])
+    if prefetched:
+        print(f"📚 Prefetched RAG context for {prefetched} goals in {time.perf_counter() - start:.2f}s")
+
+    trace_file = open(trace_path, "w", encoding="utf-8") if trace_path else None
+    try:
+        with open(output_path, "w", encoding="utf-8") as results_file:
+            start = time.perf_counter()
+            records = asyncio.run(_run_batch(agent, goals, concurrency, results_file, trace_file, max_turns))
+            elapsed = time.perf_counter() - start
+    finally:
+        if trace_file:
+            trace_file.close()
+
+    print_batch_report(records, elapsed, concurrency)
+    if hasattr(agent.client, "stats"):
+        print(f"💾 LLM cache: {agent.client.stats()}")
+    print(f"🧰 Tool cache: {agent.tool_cache.stats()}")
+    print(f"Results written to '{output_path}'" + (f", traces to '{trace_path}'" if trace_path else ""))
+    return records
+
+
 def start_interactive_mode(agent: SmartAgent):
     """
     启动交互模式，接收用户输入并尝试解决问题。
@@ -102,14 +264,39 @@ if __name__ == "__main__":
         action='store_true',  # 当出现 --simulate 参数时，其值为 True
         help="Run the predefined simulation suite instead of interactive mode."
     )
+    parser.add_argument(
+        '--batch',
+        metavar='GOALS_JSONL',
+        help="Run every goal in a JSONL file and report throughput/latency/token usage."
+    )
+    parser.add_argument('--concurrency', type=int, default=8, help="Number of goals run concurrently in batch mode.")
+    parser.add_argument('--output', default="batch_results.jsonl", help="Where batch mode writes per-goal results.")
+    parser.add_argument('--trace', default=None, help="Optional JSONL file for per-goal event traces in batch mode.")
+    parser.add_argument('--max-turns', type=int, default=50, help="Maximum ReAct turns per goal in batch mode.")
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        help="Report agent startup time and a per-tool breakdown of import/init/warm-up time, then exit."
+    )
+    parser.add_argument('--log-level', default=LOG_LEVEL, help="Agent log level, e.g. DEBUG / INFO / WARNING.")
+    parser.add_argument('--quiet', action='store_true', help="Only log warnings and errors (same as --log-level WARNING).")
     args = parser.parse_args()
+    configure_logging(args.log_level, quiet=args.quiet)
 
-    # 初始化 Agent (无论哪种模式都需要)
+    # 初始化 Agent (无论哪种模式都需要)。批量模式需要异步 Agent 来并发执行目标
     print("Initializing SmartAgent, please wait...")
-    my_agent = SmartAgent()
+    start = time.perf_counter()
+    my_agent = AsyncSmartAgent() if args.batch else SmartAgent()
+    startup_ms = (time.perf_counter() - start) * 1000
     
     # 根据命令行参数决定运行哪个模式
-    if args.simulate:
+    if args.profile_startup:
+        print(f"\n⏱️  SmartAgent() ready in {startup_ms:.1f} ms (tools are loaded lazily from the manifest)")
+        # 逐个工具强制加载，展示如果没有清单，这些开销都会发生在启动阶段
+        profile_startup("tools")
+    elif args.batch:
+        run_batch(my_agent, args.batch, args.concurrency, args.output, args.trace, args.max_turns)
+    elif args.simulate:
         run_all_simulations(my_agent)
     else:
         start_interactive_mode(my_agent)
\ No newline at end of file
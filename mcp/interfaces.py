@@ -1,10 +1,41 @@
+import asyncio
+import functools
+import os
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+# 同步工具在异步 Agent 中运行时所使用的共享线程池。
+# 默认的事件循环线程池太小（min(32, CPU+4)），无法支撑数百个并发目标。
+TOOL_THREAD_POOL_SIZE = int(os.getenv("TOOL_THREAD_POOL_SIZE", "64"))
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """惰性创建并返回工具共享线程池。"""
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(max_workers=TOOL_THREAD_POOL_SIZE, thread_name_prefix="tool")
+    return _tool_executor
 
 class BaseTool(ABC):
     """
     所有工具类必须遵守的接口规范 (Interface Specification)。
     """
+    # 同一个工具允许同时执行的最大调用数（一轮中的多个行动会被并行分发）
+    max_concurrency: int = 4
+    # 为 True 的工具不会出现在 LLM 的工具列表中，而是由 Agent 自动调用（例如 RAG 检索）
+    auto_invoke: bool = False
+    # 结果缓存策略（见 tool_cache.py）：是否可以缓存、有效期（秒，None 表示永不过期）、参数的规范化方式。
+    # 默认不缓存，只有没有副作用、结果只取决于参数的工具才应该开启。
+    cacheable: bool = False
+    cache_ttl: Optional[float] = None
+    cache_normalize: str = "exact"
+
     def __init__(self, name: str, description: str, parameters: List[Dict[str, Any]]):
         self.name = name
         self.description = description
@@ -25,4 +56,19 @@ class BaseTool(ABC):
         """
         工具的核心执行逻辑。子类必须实现此方法。
         """
-        pass
\ No newline at end of file
+        pass
+
+    def warm_up(self):
+        """
+        预先加载工具所需的重量级资源（模型、数据库连接等）。
+        默认什么也不做；这些资源通常在第一次 execute 时才加载，常驻服务可以提前调用此方法。
+        """
+        pass
+
+    async def aexecute(self, **kwargs: Any) -> Dict[str, Any]:
+        """
+        execute 的异步版本，供 AsyncSmartAgent 使用。
+        默认把同步的 execute 放到共享线程池中执行；拥有原生异步实现的工具可以重写此方法。
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_tool_executor(), functools.partial(self.execute, **kwargs))
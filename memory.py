@@ -1,28 +1,215 @@
-from typing import List, Dict, Any
+import logging
+import os
+from typing import List, Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 记忆的 token 预算（估算值）。超过预算时压缩较早的历史，<= 0 表示不限制
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "6000"))
+# 最近的若干条消息始终原样保留
+MEMORY_KEEP_RECENT = int(os.getenv("MEMORY_KEEP_RECENT", "8"))
+# 压缩后的目标占用比例：压到预算的这个比例以下，避免每追加一条消息就压缩一次（滞回）
+MEMORY_LOW_WATERMARK = float(os.getenv("MEMORY_LOW_WATERMARK", "0.7"))
+# 较早的工具观察结果被截断到的 token 数
+MEMORY_OBSERVATION_TOKENS = int(os.getenv("MEMORY_OBSERVATION_TOKENS", "150"))
+
+SUMMARY_PREFIX = "[Summary of earlier history]"
+SUMMARY_PROMPT = """请把下面这段 Agent 的历史记录压缩成一段简洁的摘要，保留已经确认的事实、找到的 URL、
+已保存的文件名、失败过的尝试以及尚未完成的事项。只输出摘要本身。
+
+{history}"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 字符约 4 个一个 token，其余字符（中文等）约 1 个一个 token。"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """按 token 估算截断文本，保留开头部分并注明省略了多少字符。"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 先按 ASCII 比例取一个上界，再逐步缩短
+    end = min(len(text), max_tokens * 4)
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end = end * 3 // 4
+    return f"{text[:end]} …[truncated {len(text) - end} chars]"
+
+
+def extractive_summary(messages: List[Dict[str, Any]], line_chars: int = 160) -> str:
+    """不调用模型的摘要：每条消息只保留第一行的开头部分。"""
+    lines = []
+    for msg in messages:
+        first_line = msg["content"].strip().split("\n", 1)[0]
+        if first_line.startswith(SUMMARY_PREFIX):
+            # 之前的摘要整体保留（去掉标题行）
+            lines.extend(msg["content"].split("\n")[1:])
+            continue
+        if len(first_line) > line_chars:
+            first_line = first_line[:line_chars] + "…"
+        lines.append(f"- {msg['role'].capitalize()}: {first_line}")
+    return "\n".join(lines)
+
+
+class LLMSummarizer:
+    """用 LLM 压缩历史记录。失败时退回到抽取式摘要，不影响主循环。"""
+    def __init__(self, client: Any, model_name: str, max_tokens: int = 400):
+        self.client = client
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+
+    def __call__(self, messages: List[Dict[str, Any]]) -> str:
+        history = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": SUMMARY_PROMPT.format(history=history)}],
+                max_tokens=self.max_tokens,
+            )
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.warning("⚠️ LLM summarization failed, falling back to extractive summary: %s", e)
+            return extractive_summary(messages)
+
 
 class ConversationMemory:
-    """一个简单的内存组件，用于存储对话历史。"""
-    def __init__(self):
-        self.history: List[Dict[str, Any]] = []
+    """
+    带 token 预算的对话记忆。
+
+    历史记录超过预算时，按以下顺序压缩，直到降到预算的 low_watermark 比例以下：
+    1. 截断较早的工具观察结果（role 为 "system" 的消息）；
+    2. 把最早的若干条消息合并成一条摘要（LLM 摘要或抽取式摘要）；
+    3. 仍然超出时，截断最近窗口中除最后一条以外的观察结果。
+    单条观察结果在写入时就被限制在预算的一半以内。
+    第一条消息（目标）和最近 keep_recent 条消息始终保留。
+    每次压缩都会改变 generation，PromptBuilder 据此知道历史被改写、需要重建消息。
+    压缩后仍高于水位线（例如最近窗口本身就超出预算）时，要等历史再增长 (预算 - 水位线) 之后才会重试，
+    否则每追加一条消息都会重新摘要一次。
+    auto_compact 为 False 时 add_message 不压缩，由调用方检查 needs_compaction() 后自行调用 compact()
+    （异步 Agent 把压缩放到线程池里，避免 LLM 摘要阻塞事件循环）。
+    """
+    def __init__(self, token_budget: Optional[int] = MEMORY_TOKEN_BUDGET,
+                 keep_recent: int = MEMORY_KEEP_RECENT,
+                 low_watermark: float = MEMORY_LOW_WATERMARK,
+                 observation_tokens: int = MEMORY_OBSERVATION_TOKENS,
+                 summarizer: Optional[Callable[[List[Dict[str, Any]]], str]] = None,
+                 auto_compact: bool = True):
+        self.token_budget = token_budget if token_budget and token_budget > 0 else None
+        self.keep_recent = keep_recent
+        self.low_watermark = low_watermark
+        self.observation_tokens = observation_tokens
+        self.summarizer = summarizer or extractive_summary
+        self.auto_compact = auto_compact
+        self.clear()
 
     def add_message(self, role: str, content: str):
-        """添加一条消息到历史记录。"""
-        self.history.append({"role": role, "content": content})
+        """添加一条消息到历史记录，必要时压缩较早的历史。"""
+        if role == "system" and self.token_budget:
+            # 单条观察结果（例如整个网页）最多占用一半预算，否则压缩永远无法回到水位线以下
+            content = _truncate(content, self.token_budget // 2)
+        tokens = estimate_tokens(content)
+        self.history.append({"role": role, "content": content, "tokens": tokens})
+        self.total_tokens += tokens
+        self._formatted_lines.append(self._format_line(self.history[-1]))
+        self._formatted = None
+        if self.auto_compact and self.needs_compaction():
+            self.compact()
+
+    def needs_compaction(self) -> bool:
+        """历史是否超出预算（以及上一次无效压缩之后设置的退避阈值）。"""
+        return bool(self.token_budget) and self.total_tokens > max(self.token_budget, self._retry_above)
 
     def get_history(self) -> List[Dict[str, Any]]:
-        """获取完整的历史记录。"""
+        """获取当前（可能已压缩的）历史记录。"""
         return self.history
-    
+
+    @staticmethod
+    def _format_line(msg: Dict[str, Any]) -> str:
+        return f"{msg['role'].capitalize()}: {msg['content']}"
+
     def format_for_prompt(self) -> str:
-        """将历史记录格式化为字符串，以便放入 Prompt。"""
+        """将历史记录格式化为字符串，以便放入 Prompt。结果会被缓存，直到历史再次变化。"""
         if not self.history:
             return "No history yet."
-        
-        formatted_history = ""
-        for msg in self.history:
-            formatted_history += f"{msg['role'].capitalize()}: {msg['content']}\n"
-        return formatted_history.strip()
+        if self._formatted is None:
+            self._formatted = "\n".join(self._formatted_lines).strip()
+        return self._formatted
+
+    def compact(self):
+        """把历史压缩到 token_budget * low_watermark 以下（尽力而为）。"""
+        target = int(self.token_budget * self.low_watermark)
+        before = list(self.history)
+        # 可压缩的范围：第一条消息（目标）之后、最近窗口之前
+        old_end = max(1, len(self.history) - self.keep_recent)
+
+        # 1. 截断较早的观察结果
+        for i in range(1, old_end):
+            if self.total_tokens <= target:
+                break
+            self._truncate_message(i, self.observation_tokens)
+
+        # 2. 把较早的消息合并成一条摘要
+        if self.total_tokens > target and old_end > 2:
+            old = self.history[1:old_end]
+            summary = f"{SUMMARY_PREFIX}\n{self.summarizer(old)}"
+            summary_msg = {"role": "system", "content": summary, "tokens": estimate_tokens(summary)}
+            self.history[1:old_end] = [summary_msg]
+            self.summaries += 1
+            # 摘要本身也可能超出：按剩余预算截断
+            budget_left = target - sum(m["tokens"] for m in self.history if m is not summary_msg)
+            self._recount()
+            if self.total_tokens > target:
+                self._truncate_message(1, max(budget_left, self.observation_tokens))
+
+        # 3. 最近窗口里的大块观察结果（最后一条除外）
+        for i in range(len(self.history) - self.keep_recent, len(self.history) - 1):
+            if self.total_tokens <= target:
+                break
+            if i > 0:
+                self._truncate_message(i, self.observation_tokens)
+
+        self._recount()
+        # 压缩不到水位线以下时退避：历史再增长一个滞回区间之前不再重试
+        self._retry_above = self.total_tokens + self.token_budget - target if self.total_tokens > target else 0
+        if self._retry_above:
+            logger.debug("🧠 Compaction stopped at %s tokens (target %s), next attempt above %s",
+                         self.total_tokens, target, self._retry_above)
+        # 消息被改写时总是换成新的字典，按对象身份就能判断历史是否真的变化；没有变化时不打断前缀缓存
+        if len(before) == len(self.history) and all(a is b for a, b in zip(before, self.history)):
+            return
+        self._formatted_lines = [self._format_line(msg) for msg in self.history]
+        self._formatted = None
+        self.generation += 1
+
+    def _truncate_message(self, index: int, max_tokens: int):
+        msg = self.history[index]
+        if msg["role"] != "system" or msg["tokens"] <= max_tokens:
+            return
+        content = _truncate(msg["content"], max_tokens)
+        tokens = estimate_tokens(content)
+        self.total_tokens += tokens - msg["tokens"]
+        # 创建新的字典而不是原地修改，避免影响已经交给调用方的旧消息
+        self.history[index] = {"role": msg["role"], "content": content, "tokens": tokens}
+
+    def _recount(self):
+        self.total_tokens = sum(msg["tokens"] for msg in self.history)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "messages": len(self.history),
+            "tokens": self.total_tokens,
+            "budget": self.token_budget,
+            "compactions": self.generation,
+            "summaries": self.summaries,
+        }
 
     def clear(self):
         """清空历史记录。"""
-        self.history = []
\ No newline at end of file
+        self.history: List[Dict[str, Any]] = []
+        self.total_tokens = 0
+        self.generation = 0  # 每次压缩（历史被改写）时加一
+        self.summaries = 0
+        self._retry_above = 0  # 上一次压缩无效时，历史超过这个值才再次压缩
+        self._formatted_lines: List[str] = []
+        self._formatted: Optional[str] = None
@@ -0,0 +1,247 @@
+import copy
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import LRUCache
+from dispatch import MAX_PARALLEL_ACTIONS
+from memory import estimate_tokens
+
+# 工具 schema 在系统提示词中的写法：compact（每个工具一行紧凑 JSON，参数写成 {名称: "类型, 描述"}）
+# 或 full（旧的 indent=2 完整 JSON）
+TOOL_SCHEMA_STYLE = os.getenv("TOOL_SCHEMA_STYLE", "compact").lower()
+TOOL_SCHEMA_STYLES = ("compact", "full")
+
+# 静态的系统提示词。它只依赖于工具列表，在 Agent 加载时序列化一次，之后每一轮都保持字节级不变，
+# 这样服务商端的前缀缓存 (prompt caching) 才能命中。
+SYSTEM_PROMPT_TEMPLATE = """# 使命
+你是一个高度智能的自主代理，你的任务是利用一系列强大的工具来完成用户的 [最终目标]。
+你将在一个 "思考 -> 行动 -> 观察" 的循环中工作。你的首要目标是高效、准确地达成最终的成功结果。
+1.  **思考 (Thought)**: 首先，你必须分析 [最终目标] 并回顾完整的 [历史记录]（包括你之前所有的行动和观察结果）。为你的下一步行动制定一个清晰、简洁的计划。你的思考过程需要被明确地表达出来。
+2.  **行动 (Action)**: 根据你的思考，从 [可用工具] 列表中选择最合适的工具，并确定其所需的输入参数。如果有多个**互不依赖**的行动（例如同时阅读三个网页），请在同一轮中一起给出，它们会被并行执行。
+3.  **观察 (Observation)**: 在你行动后，系统会向你提供每个行动的结果。这些新的观察结果将被添加到历史记录中，用于指导你接下来的思考。
+
+[最终目标] 和 [背景信息] 在系统消息之后的第一条用户消息中给出；之后的所有对话消息就是 [历史记录]。
+
+[可用工具]
+{tools_json_string}
+
+# 关键规则与限制 (必须严格遵守)
+- **基于事实行动**: 你的所有行动都必须**只**基于 [历史记录] 中已有的信息，或用户在 [最终目标] 中明确提供的信息。
+- **杜绝幻觉 (NO HALLUCINATION)**: **严禁**凭空捏造 URL、文件名或任何其他事实。如果你不知道某个信息（比如一个URL），你的首要任务是使用一个工具（比如 `web_surfer_tool`）去**找到它**。不要猜测。
+- **必须处理错误**: 如果 '观察' (Observation) 的结果显示 `status: "error"`，你**必须**在下一步的 '思考' (Thought) 中解决它。
+- **对于 404 Not Found 错误**: 这意味着URL是无效的或已失效。**不要**再次尝试同一个URL。你的下一步应该是使用 `web_surfer_tool` 寻找正确的URL。
+- **对于其他工具错误**: 分析错误信息。如果是参数问题，就在下一步行动中修正 `action_input`。如果某个工具持续失败，请考虑更换策略。
+- **工具协同**: 理解工具如何协同工作。使用 `web_surfer_tool` 来发现信息和URL；使用 `link_extractor_tool` 来探索已知网页以进行导航；使用 `web_browser_tool` 来阅读已确认有效的URL内容；使用 `file_writer_tool` 来保存信息。
+- **任务完成**: 只有当 [最终目标] 被完全、彻底地满足时，你才应该使用特殊行动 `finish`。你在结束前的最后一个 '思考' (thought) 应该为用户提供一个全面的结果总结。
+
+# 输出格式
+你的回应**必须**是一个**单一、有效**的JSON对象，其结构如下。不要在JSON对象的前后添加任何额外的文本。
+{{
+    "thought": "对当前情况的详细分析，以及你为下一步行动制定的计划。解释你*为什么*要选择这些行动。",
+    "actions": [
+        {{
+            "action": "你将要使用的工具名称（从 [可用工具] 列表中选择），或者 'finish'（如果目标已完成）。",
+            "action_input": {{
+                "param1": "value1",
+                "param2": "value2"
+            }}
+        }}
+    ]
+}}
+- `actions` 中的行动会被**并行**执行，因此只能放入彼此独立的行动；如果后一个行动依赖前一个行动的结果，请分多轮进行。
+- 每轮最多 {max_parallel_actions} 个行动。
+- 目标完成时，`actions` 中只放一个 `finish` 行动。"""
+
+GOAL_PROMPT_TEMPLATE = """[最终目标]
+{goal}
+
+[背景信息]
+{retrieved_context}"""
+
+# 每轮末尾追加的固定提示，不写入历史，因此不会破坏下一轮的前缀
+NEXT_STEP_MESSAGE = {"role": "user", "content": "Please proceed with the next step."}
+
+# ConversationMemory 中的角色 -> Chat API 中的角色。
+# 工具观察结果在记忆中以 "system" 存储，作为用户消息发送，以免与系统提示词混淆。
+ROLE_MAPPING = {"user": "user", "assistant": "assistant", "system": "user"}
+
+
+def _message_size(message: Dict[str, str]) -> int:
+    """单条消息序列化后的字节数（与发送给服务商的 JSON 大致相当）。"""
+    return len(json.dumps(message, ensure_ascii=False).encode("utf-8"))
+
+
+def render_tool_schema(tool_descriptions: List[Dict[str, Any]], style: str = TOOL_SCHEMA_STYLE) -> str:
+    """把工具描述序列化成系统提示词中的 [可用工具] 一节。"""
+    if style not in TOOL_SCHEMA_STYLES:
+        raise ValueError(f"Unsupported TOOL_SCHEMA_STYLE '{style}'. Choose one of {TOOL_SCHEMA_STYLES}.")
+    if style == "full":
+        return json.dumps(tool_descriptions, indent=2, ensure_ascii=False)
+    lines = []
+    for tool in tool_descriptions:
+        parameters = {param["name"]: f"{param.get('type', 'string')}, {param.get('description', '')}".rstrip(", ")
+                      for param in tool.get("parameters", [])}
+        lines.append(json.dumps({"name": tool["name"], "description": tool["description"], "parameters": parameters},
+                                ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines)
+
+
+class PromptBuilder:
+    """
+    增量式、只追加的 Prompt 构建器。
+
+    消息结构为：[静态系统提示词] + [目标与背景信息] + [历史记录中的每一条消息] + [下一步提示]。
+    前两部分在一个目标内保持不变，历史记录只在末尾追加，因此每一轮只需要序列化新增的消息，
+    并且服务商可以复用之前所有轮次的前缀缓存。
+
+    启用工具路由时，每个目标的系统提示词只包含选中的工具（start_goal 的 tool_descriptions）；
+    目标中途补充工具（set_tools）会替换系统消息，这一轮的前缀缓存因此失效，之后重新稳定。
+    每轮统计中的 schema_bytes_saved / schema_tokens_saved 是相对于“全部工具 + full 格式”的节省量。
+    """
+    def __init__(self, tool_descriptions: List[Dict[str, Any]], schema_style: str = TOOL_SCHEMA_STYLE):
+        self.schema_style = schema_style
+        self.all_tools = list(tool_descriptions)
+        # 不同工具组合的系统消息只序列化一次，所有 fork 出的构建器共享
+        self._system_cache = LRUCache(maxsize=256)
+        baseline = self._render_system(self.all_tools, "full")
+        self._baseline_size = _message_size(baseline)
+        self._baseline_tokens = estimate_tokens(baseline["content"])
+        self._default_system = self._system_for(self.all_tools)
+        self.reset()
+
+    @staticmethod
+    def _render_system(tool_descriptions: List[Dict[str, Any]], style: str) -> Dict[str, str]:
+        return {
+            "role": "system",
+            "content": SYSTEM_PROMPT_TEMPLATE.format(
+                tools_json_string=render_tool_schema(tool_descriptions, style),
+                max_parallel_actions=MAX_PARALLEL_ACTIONS,
+            ),
+        }
+
+    def _system_for(self, tool_descriptions: List[Dict[str, Any]]) -> Tuple[Dict[str, str], int, int, List[str]]:
+        """返回 (系统消息, 字节数, 估算 token 数, 工具名列表)，按工具组合缓存。"""
+        names = [tool["name"] for tool in tool_descriptions]
+        key = tuple(names)
+        entry = self._system_cache.get(key)
+        if entry is None:
+            message = self._render_system(tool_descriptions, self.schema_style)
+            entry = (message, _message_size(message), estimate_tokens(message["content"]), names)
+            self._system_cache.set(key, entry)
+        return entry
+
+    @property
+    def tool_names(self) -> List[str]:
+        """当前系统提示词中列出的工具。"""
+        return self._tool_names
+
+    def _use_system(self, entry: Tuple[Dict[str, str], int, int, List[str]]):
+        self.system_message, self._system_size, self._system_tokens, self._tool_names = entry
+
+    def reset(self):
+        """清空当前目标的所有状态。"""
+        self._use_system(self._default_system)
+        self._messages: List[Dict[str, str]] = [self.system_message]
+        self._total_bytes = self._system_size
+        self._prefix_len = 1  # 在整个目标内不变的前缀消息条数
+        self._prefix_bytes = self._system_size
+        self._synced = 0  # 已经转换成 Chat 消息的历史记录条数
+        self._generation = 0  # 已同步的记忆版本，记忆被压缩后需要重建
+        self.rebuilds = 0
+        self.tool_changes = 0
+        self.turn_stats: List[Dict[str, Any]] = []
+
+    def fork(self) -> "PromptBuilder":
+        """为一个新会话创建构建器：共享已序列化的系统提示词，其余状态独立。"""
+        clone = copy.copy(self)
+        clone.reset()
+        return clone
+
+    def start_goal(self, goal: Any, retrieved_context: str, tool_descriptions: Optional[List[Dict[str, Any]]] = None):
+        """
+        开始一个新目标：固定系统提示词、目标和背景信息这几段（在整个目标内不变的）前缀。
+        tool_descriptions 为本目标可用的工具（默认全部工具）。
+        """
+        self.reset()
+        if tool_descriptions is not None:
+            self.set_tools(tool_descriptions)
+        goal_message = {
+            "role": "user",
+            "content": GOAL_PROMPT_TEMPLATE.format(
+                goal=goal,
+                retrieved_context=retrieved_context if retrieved_context else "无相关背景信息。",
+            ),
+        }
+        self._messages.append(goal_message)
+        self._total_bytes += _message_size(goal_message)
+        self._prefix_len = len(self._messages)
+        self._prefix_bytes = self._total_bytes
+
+    def set_tools(self, tool_descriptions: List[Dict[str, Any]]) -> bool:
+        """替换系统提示词中的工具列表，返回列表是否发生了变化。"""
+        entry = self._system_for(tool_descriptions)
+        if entry[3] == self._tool_names:
+            return False
+        delta = entry[1] - self._system_size
+        self._use_system(entry)
+        self._messages[0] = self.system_message
+        self._total_bytes += delta
+        self._prefix_bytes += delta
+        self.tool_changes += 1
+        return True
+
+    def build(self, history: List[Dict[str, Any]], generation: int = 0) -> List[Dict[str, str]]:
+        """
+        把历史记录中新增的条目追加为 Chat 消息，并返回本轮要发送的完整消息列表。
+        每轮的工作量只与新增的消息数量成正比。
+        generation 是记忆的版本号：记忆压缩（改写了较早的历史）后版本号变化，此时丢弃已同步的历史消息并重建。
+        """
+        if generation != self._generation or len(history) < self._synced:
+            del self._messages[self._prefix_len:]
+            self._total_bytes = self._prefix_bytes
+            self._synced = 0
+            self._generation = generation
+            self.rebuilds += 1
+
+        new_bytes = 0
+        for msg in history[self._synced:]:
+            chat_message = {"role": ROLE_MAPPING.get(msg["role"], "user"), "content": msg["content"]}
+            self._messages.append(chat_message)
+            new_bytes += _message_size(chat_message)
+        self._synced = len(history)
+        self._total_bytes += new_bytes
+
+        messages = self._messages + [NEXT_STEP_MESSAGE]
+        self.turn_stats.append({
+            "turn": len(self.turn_stats) + 1,
+            "messages": len(messages),
+            "prompt_bytes": self._total_bytes + _message_size(NEXT_STEP_MESSAGE),
+            "new_bytes": new_bytes,
+            "tools": len(self._tool_names),
+            "schema_bytes_saved": self._baseline_size - self._system_size,
+            "schema_tokens_saved": self._baseline_tokens - self._system_tokens,
+        })
+        return messages
+
+    def record_usage(self, usage: Optional[Any]):
+        """把服务商返回的 token 用量（包括前缀缓存命中的 token 数）记到本轮统计里。"""
+        if not self.turn_stats or usage is None:
+            return
+        stats = self.turn_stats[-1]
+        stats["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+        stats["completion_tokens"] = getattr(usage, "completion_tokens", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        stats["cached_tokens"] = getattr(details, "cached_tokens", None) if details else None
+
+    def totals(self) -> Dict[str, int]:
+        """当前目标累计发送的字节数和 token 数。"""
+        return {
+            "turns": len(self.turn_stats),
+            "prompt_bytes": sum(s["prompt_bytes"] for s in self.turn_stats),
+            "prompt_tokens": sum(s.get("prompt_tokens") or 0 for s in self.turn_stats),
+            "completion_tokens": sum(s.get("completion_tokens") or 0 for s in self.turn_stats),
+            "cached_tokens": sum(s.get("cached_tokens") or 0 for s in self.turn_stats),
+            "schema_bytes_saved": sum(s["schema_bytes_saved"] for s in self.turn_stats),
+            "schema_tokens_saved": sum(s["schema_tokens_saved"] for s in self.turn_stats),
+        }
@@ -0,0 +1,60 @@
+# rag/backends.py
+"""
+向量库后端的选择：chroma（默认）或 mmap（rag/mmap_store.py 中的纯 NumPy 实现）。
+
+两种后端都提供 Chroma 集合的接口，build_rag_index.py 和 RAGTool 只通过 open_collection 获取集合。
+后端按以下顺序确定：显式参数（--backend）> 环境变量 RAG_BACKEND > 索引清单中记录的后端 > chroma，
+因此用 --backend mmap 建好索引后，RAGTool 不需要额外配置就会读取同一个后端。
+"""
+import json
+import os
+import shutil
+from typing import Any, Optional
+
+RAG_BACKEND = os.getenv("RAG_BACKEND", "").lower()
+
+BACKENDS = ("chroma", "mmap")
+DEFAULT_BACKEND = "chroma"
+MMAP_DIRNAME = "mmap"
+# 与 build_rag_index.py 中的清单文件同名
+MANIFEST_FILENAME = "index_manifest.json"
+
+
+def index_exists(persist_directory: str) -> bool:
+    """索引目录里是否真的有索引：只看清单和 Chroma 的数据库文件，嵌入缓存等其它文件不算。"""
+    return any(os.path.exists(os.path.join(persist_directory, name))
+               for name in (MANIFEST_FILENAME, "chroma.sqlite3"))
+
+
+def resolve_backend(persist_directory: str, backend: Optional[str] = None) -> str:
+    backend = (backend or RAG_BACKEND).lower()
+    if not backend:
+        try:
+            with open(os.path.join(persist_directory, MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+                backend = json.load(f).get("settings", {}).get("backend", DEFAULT_BACKEND)
+        except (OSError, ValueError):
+            backend = DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported RAG_BACKEND '{backend}'. Choose one of {BACKENDS}.")
+    return backend
+
+
+def open_collection(persist_directory: str, backend: str, name: str) -> Any:
+    """打开（不存在时创建）集合。mmap 后端的写入需要调用 collection.flush() 才会落盘。"""
+    if backend == "mmap":
+        from rag.mmap_store import MmapCollection
+        return MmapCollection(os.path.join(persist_directory, MMAP_DIRNAME, name))
+    import chromadb
+    return chromadb.PersistentClient(path=persist_directory).get_or_create_collection(name)
+
+
+def reset_collection(persist_directory: str, backend: str, name: str):
+    """删除集合中的全部数据（全量重建时使用）。"""
+    if backend == "mmap":
+        shutil.rmtree(os.path.join(persist_directory, MMAP_DIRNAME, name), ignore_errors=True)
+        return
+    import chromadb
+    try:
+        chromadb.PersistentClient(path=persist_directory).delete_collection(name)
+    except Exception:
+        pass  # 集合不存在
@@ -0,0 +1,333 @@
+# rag/embedding_server.py
+"""
+共享的嵌入模型服务：模型只在一个进程中加载一次，多个 Agent 进程和索引器通过 Unix 套接字请求向量。
+
+每个工作进程各自加载 all-MiniLM-L6-v2 时，N 个进程就要 N 份模型内存和 N 次加载时间；改为连接同一个服务后，
+模型只加载一次，同时到达的请求被动态合并成一个批次，由一次模型前向计算完成（PyTorch 在一次前向中使用多个核心）。
+
+动态批处理：批处理循环取出第一个请求后，继续收集请求直到凑满 max_batch 个文本、等满 max_wait_ms，
+或者每个已连接的客户端都已经在这一批中（每条连接同一时间只有一个请求，再等也不会有新请求）——
+因此单个客户端顺序请求时不会额外等待。文档和查询分开计算，同一批中重复的文本只计算一次。
+
+协议：每帧为 4 字节大端长度 + 负载。请求是 JSON（{"op": "embed", "kind": "doc" | "query", "texts": [...]}
+或 {"op": "info"}）；embed 的响应是一个 JSON 头（{"status": "ok", "count": n, "dim": d}）加一个
+n × d 的小端 float32 数组帧，出错时只有 JSON 头（{"status": "error", "message": ...}）。
+
+用法:
+    python -m rag.embedding_server --socket ./rag_db/embedding.sock
+    EMBEDDING_SERVER_SOCKET=./rag_db/embedding.sock python main.py --batch goals.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag.embeddings import EMBEDDING_MODEL, EMBEDDING_SERVER_SOCKET, embed_queries
+from tracing import LOG_LEVEL, configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "./rag_db/embedding.sock"
+# 一个批次最多包含的文本数，以及为凑批最多等待的毫秒数
+EMBEDDING_SERVER_MAX_BATCH = int(os.getenv("EMBEDDING_SERVER_MAX_BATCH", "64"))
+EMBEDDING_SERVER_MAX_WAIT_MS = float(os.getenv("EMBEDDING_SERVER_MAX_WAIT_MS", "5"))
+# 客户端等待响应的超时时间（秒）
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "60"))
+
+KINDS = ("doc", "query")
+_FRAME_HEADER = struct.Struct("!I")
+_VECTOR_DTYPE = np.dtype("<f4")
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (length,) = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+    return await reader.readexactly(length)
+
+
+def _write_frame(writer: asyncio.StreamWriter, payload: bytes):
+    writer.write(_FRAME_HEADER.pack(len(payload)) + payload)
+
+
+class EmbeddingServer:
+    """
+    在 Unix 套接字上提供嵌入计算的 asyncio 服务。模型调用在一个专用线程中串行执行，事件循环只负责收发和凑批。
+    """
+    def __init__(self, embeddings: Embeddings, socket_path: str = DEFAULT_SOCKET_PATH, model_name: str = EMBEDDING_MODEL,
+                 max_batch: int = EMBEDDING_SERVER_MAX_BATCH, max_wait_ms: float = EMBEDDING_SERVER_MAX_WAIT_MS):
+        self.embeddings = embeddings
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.ready = threading.Event()
+        self.connections = 0
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.dim: Optional[int] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-model")
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "model": self.model_name,
+            "dim": self.dim,
+            "connections": self.connections,
+            "requests": self.requests,
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch": round(self.texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+    async def serve(self):
+        """监听套接字直到任务被取消。启动前会清理上次异常退出留下的套接字文件。"""
+        self._remove_stale_socket()
+        self._queue = asyncio.Queue()
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        # 只允许当前用户连接
+        os.chmod(self.socket_path, 0o600)
+        batcher = asyncio.create_task(self._batch_loop())
+        self.ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._executor.shutdown(wait=False)
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.socket_path):
+            directory = os.path.dirname(self.socket_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            os.unlink(self.socket_path)  # 没有进程在监听
+        else:
+            raise RuntimeError(f"Another embedding server is already listening on '{self.socket_path}'.")
+        finally:
+            probe.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = json.loads(await _read_frame(reader))
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                op = request.get("op")
+                if op == "info":
+                    _write_frame(writer, json.dumps(self.info()).encode("utf-8"))
+                elif op == "embed" and request.get("kind") in KINDS and isinstance(request.get("texts"), list):
+                    await self._respond_embed(writer, request["kind"], [str(text) for text in request["texts"]])
+                else:
+                    _write_frame(writer, json.dumps({"status": "error", "message": f"Bad request: {op!r}"}).encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass  # 客户端在等待响应时断开
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _respond_embed(self, writer: asyncio.StreamWriter, kind: str, texts: List[str]):
+        self.requests += 1
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kind, texts, future))
+        try:
+            vectors: np.ndarray = await future
+        except Exception as e:
+            logger.warning("⚠️ 嵌入计算失败: %s", e)
+            _write_frame(writer, json.dumps({"status": "error", "message": str(e)}).encode("utf-8"))
+            return
+        header = {"status": "ok", "count": int(vectors.shape[0]), "dim": int(vectors.shape[1])}
+        _write_frame(writer, json.dumps(header).encode("utf-8"))
+        _write_frame(writer, vectors.astype(_VECTOR_DTYPE, copy=False).tobytes())
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            size = len(pending[0][1])
+            deadline = loop.time() + self.max_wait
+            # 每条连接同一时间只有一个请求：所有连接都已在本批中时，继续等待没有意义
+            while size < self.max_batch and len(pending) < self.connections:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                size += len(item[1])
+            await self._run_batch(pending)
+
+    async def _run_batch(self, pending: List[Tuple[str, List[str], asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        self.batches += 1
+        for kind in KINDS:
+            items = [item for item in pending if item[0] == kind]
+            if not items:
+                continue
+            unique = list(dict.fromkeys(text for _, texts, _ in items for text in texts))
+            self.texts += len(unique)
+            try:
+                matrix = await loop.run_in_executor(self._executor, self._embed, kind, unique) if unique else None
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            rows = {text: i for i, text in enumerate(unique)}
+            for _, texts, future in items:
+                if future.done():
+                    continue
+                if matrix is None or not texts:
+                    future.set_result(np.zeros((0, self.dim or 0), dtype=_VECTOR_DTYPE))
+                else:
+                    future.set_result(matrix[[rows[text] for text in texts]])
+
+    def _embed(self, kind: str, texts: List[str]) -> np.ndarray:
+        vectors = self.embeddings.embed_documents(texts) if kind == "doc" else embed_queries(self.embeddings, texts)
+        matrix = np.asarray(vectors, dtype=_VECTOR_DTYPE)
+        self.dim = int(matrix.shape[1])
+        return matrix
+
+
+class EmbeddingClient(Embeddings):
+    """
+    通过 Unix 套接字向 EmbeddingServer 请求向量的 Embeddings。每个线程使用自己的连接，
+    因此多个线程的并发请求会在服务端合并成同一批次。服务重启后会自动重连一次。
+    """
+    def __init__(self, socket_path: str = EMBEDDING_SERVER_SOCKET or DEFAULT_SOCKET_PATH,
+                 timeout: float = EMBEDDING_SERVER_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _recv_exactly(self, sock: socket.socket, size: int) -> bytes:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError("Embedding server closed the connection.")
+            received += n
+        return bytes(buffer)
+
+    def _recv_frame(self, sock: socket.socket) -> bytes:
+        (length,) = _FRAME_HEADER.unpack(self._recv_exactly(sock, _FRAME_HEADER.size))
+        return self._recv_exactly(sock, length)
+
+    def _request(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        payload = json.dumps(request, ensure_ascii=False).encode("utf-8")
+        retried = False
+        while True:
+            try:
+                sock = self._connection()
+                sock.sendall(_FRAME_HEADER.pack(len(payload)) + payload)
+                header = json.loads(self._recv_frame(sock))
+                body = self._recv_frame(sock) if request.get("op") == "embed" and header.get("status") == "ok" else None
+                return header, body
+            except ConnectionError:
+                # 只在连接层面失败时重试一次（例如服务重启）；超时不重试，避免同一批文本被反复计算
+                self.close()
+                if retried:
+                    raise
+                retried = True
+            except OSError:
+                self.close()
+                raise
+
+    def info(self) -> Dict[str, Any]:
+        header, _ = self._request({"op": "info"})
+        return header
+
+    def _embed(self, kind: str, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        header, body = self._request({"op": "embed", "kind": kind, "texts": texts})
+        if header.get("status") != "ok":
+            raise RuntimeError(f"Embedding server error: {header.get('message')}")
+        return np.frombuffer(body, dtype=_VECTOR_DTYPE).reshape(header["count"], header["dim"]).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("doc", texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("query", texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one shared embedding model over a Unix socket.")
+    parser.add_argument("--socket", default=EMBEDDING_SERVER_SOCKET or DEFAULT_SOCKET_PATH, help="Unix 套接字路径。")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SERVER_MAX_BATCH, help="每批最多的文本数。")
+    parser.add_argument("--max-wait-ms", type=float, default=EMBEDDING_SERVER_MAX_WAIT_MS, help="为凑批最多等待的毫秒数。")
+    parser.add_argument("--threads", type=int, default=0, help="PyTorch 计算线程数（默认由 PyTorch 决定）。")
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="日志级别，例如 DEBUG / INFO / WARNING。")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+    start = time.perf_counter()
+    from langchain_huggingface import HuggingFaceEmbeddings as SentenceTransformerEmbeddings
+    embeddings = SentenceTransformerEmbeddings(model_name=args.model)
+    embeddings.embed_documents(["warm up"])
+    logger.info("✅ 模型 %s 加载完成，用时 %.1fs", args.model, time.perf_counter() - start)
+
+    server = EmbeddingServer(embeddings, args.socket, args.model, args.max_batch, args.max_wait_ms)
+    logger.info("🚀 Embedding server listening on %s (max batch %s, max wait %sms)", args.socket, args.max_batch,
+                args.max_wait_ms)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+嵌入模型的统一入口，以及持久化的嵌入缓存。
+
+build_rag_index.py 和 RAGTool 都通过 get_embeddings() 获取嵌入函数。缓存以
+sha256(模型名 + 文本) 为键，把向量存放在 sqlite 中：重复的文本块（模板、页眉）和重复的查询
+不再重复计算，未变化的语料重新索引时几乎不需要调用模型。底层模型只有在出现缓存未命中时才会加载。
+
+设置 EMBEDDING_SERVER_SOCKET 后，底层模型换成连接共享嵌入服务（rag/embedding_server.py）的客户端，
+多个进程共用服务中加载的一份模型；缓存仍在各进程本地。
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./rag_db/embedding_cache.sqlite3")
+# 缓存的最大条目数，超出后按最近访问时间淘汰
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+# 共享嵌入服务的 Unix 套接字路径；留空表示在本进程中加载模型
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+# sqlite 单条语句中参数数量的安全上限
+_SQLITE_BATCH = 500
+# 超出条目上限后淘汰到上限的这个比例，避免之后每次写入都触发淘汰
+_EVICT_LOW_WATER = 0.9
+
+
+class EmbeddingStore:
+    """
+    基于 sqlite 的向量存储，键为内容哈希，值为 float32 向量。线程安全，多进程间通过 WAL 共享。
+    条目数在写入时累加而不是每次 COUNT(*)；其他进程写入的条目不计入，超出上限时重新计数后再淘汰。
+    """
+    def __init__(self, path: str, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock, self._conn:
+            for i in range(0, len(keys), _SQLITE_BATCH):
+                batch = keys[i:i + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                self._conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock, self._conn:
+            # 键由模型名和文本决定，已存在的键（其他进程刚写入）向量相同，直接跳过
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()],
+            ).rowcount
+            self._entries += max(inserted, 0)
+            full = self._entries > self.max_entries
+        if full:
+            self.evict(int(self.max_entries * _EVICT_LOW_WATER))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def evict(self, max_entries: Optional[int] = None) -> int:
+        """淘汰最久未访问的条目，直到条目数不超过 max_entries。返回淘汰的数量。"""
+        max_entries = self.max_entries if max_entries is None else max_entries
+        with self._lock, self._conn:
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            excess = self._entries - max_entries
+            if excess <= 0:
+                return 0
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                (excess,),
+            )
+            self._entries -= excess
+        return excess
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+            self._entries = 0
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    给任意 langchain Embeddings 加上内容寻址缓存。
+
+    底层模型通过工厂函数惰性创建：全部命中缓存时根本不会加载模型。
+    """
+    def __init__(self, model_name: str, factory: Callable[[], Embeddings], store: EmbeddingStore):
+        self.model_name = model_name
+        self._factory = factory
+        self._underlying: Optional[Embeddings] = None
+        self._underlying_lock = threading.Lock()
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def underlying(self) -> Embeddings:
+        if self._underlying is None:
+            with self._underlying_lock:
+                if self._underlying is None:
+                    self._underlying = self._factory()
+        return self._underlying
+
+    def _key(self, kind: str, text: str) -> str:
+        # 文档和查询分开缓存：有些模型对两者使用不同的前缀/编码方式
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key("doc", text) for text in texts]
+        cached = self.store.get_many(list(set(keys)))
+
+        # 同一批中重复的文本只计算一次
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store.put_many(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key("query", text)
+        cached = self.store.get_many([key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+        self.misses += 1
+        vector = self.underlying.embed_query(text)
+        self.store.put_many({key: vector})
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量计算查询向量：缓存未命中的查询在一次模型调用中计算。"""
+        keys = [self._key("query", text) for text in texts]
+        cached = self.store.get_many(list(set(keys)))
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+
+        if missing:
+            computed = dict(zip(missing.keys(), embed_queries(self.underlying, list(missing.values()))))
+            self.store.put_many(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": self.store.count(),
+            "model_loaded": self._underlying is not None,
+        }
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    批量计算多个查询的向量。langchain 的 Embeddings 只有逐条的 embed_query；
+    HuggingFaceEmbeddings 在没有单独设置 query_encode_kwargs 时，查询和文档的编码方式相同，
+    可以直接用一次 embed_documents 完成；其他情况逐条计算。
+    """
+    if not texts:
+        return []
+    batched = getattr(embeddings, "embed_queries", None)
+    if batched is not None:
+        return batched(texts)
+    if hasattr(embeddings, "query_encode_kwargs") and not embeddings.query_encode_kwargs:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+def connect_embedding_server(socket_path: str, model_name: str) -> Optional[Embeddings]:
+    """
+    连接共享嵌入服务。服务不可用，或者服务加载的模型与 model_name 不同（向量不能混用）时
+    记录警告并返回 None，由调用方在本进程中加载模型。
+    """
+    from rag.embedding_server import EmbeddingClient
+    client = EmbeddingClient(socket_path)
+    try:
+        served = client.info().get("model")
+    except OSError as e:
+        logger.warning("⚠️ 无法连接嵌入服务 '%s'，在本进程中加载模型: %s", socket_path, e)
+        return None
+    if served != model_name:
+        logger.warning("⚠️ 嵌入服务加载的模型是 '%s' 而不是 '%s'，在本进程中加载模型。", served, model_name)
+        client.close()
+        return None
+    logger.info("🔌 使用共享嵌入服务 '%s' (%s)", socket_path, served)
+    return client
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL, cache_path: Optional[str] = None, **model_kwargs: Any) -> Embeddings:
+    """
+    返回索引器和检索器共用的嵌入函数。默认带持久化缓存（EMBEDDING_CACHE_ENABLED=0 可关闭）。
+    model_kwargs 会原样传给 HuggingFaceEmbeddings，例如 multi_process、encode_kwargs；
+    使用共享嵌入服务时它们不起作用（批处理由服务端决定）。
+    """
+    def factory() -> Embeddings:
+        if EMBEDDING_SERVER_SOCKET:
+            client = connect_embedding_server(EMBEDDING_SERVER_SOCKET, model_name)
+            if client is not None:
+                return client
+        from langchain_huggingface import HuggingFaceEmbeddings as SentenceTransformerEmbeddings
+        return SentenceTransformerEmbeddings(model_name=model_name, **model_kwargs)
+
+    if not EMBEDDING_CACHE_ENABLED:
+        return factory()
+    return CachedEmbeddings(model_name, factory, EmbeddingStore(cache_path or EMBEDDING_CACHE_PATH))
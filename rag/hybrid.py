@@ -0,0 +1,219 @@
+# rag/hybrid.py
+"""
+混合检索：Chroma 向量检索 + BM25 关键词检索，融合后可选地重排序和去重。
+
+流程（每一步都只在 fetch_k 个候选上进行，开销与知识库大小基本无关）：
+    1. 两路召回    向量检索和 BM25 各取前 fetch_k 个文本块
+    2. RRF 融合    score = Σ 1 / (rrf_k + 名次)，只用名次，不需要把两路得分归一化到同一尺度
+    3. 重排序      设置 RAG_RERANKER_MODEL 时用交叉编码器 (sentence-transformers CrossEncoder) 对候选重新打分
+    4. 去重 / MMR  丢弃内容完全相同的文本块；RAG_MMR=true 时按最大边际相关性 (MMR) 选出
+                   既相关又彼此不重复的 top_k 个，避免上下文里塞满几乎相同的段落
+
+retrieve_many 一次处理多个查询：所有查询的向量在一次模型调用中算出，向量检索也是一次批量查询，
+交叉编码器对所有查询的候选一起打分；BM25 和融合按查询逐个进行（它们本来就很便宜）。
+
+RAG_RETRIEVER 选择召回方式：hybrid（默认）、vector（只用向量，旧行为）或 bm25。
+没有 BM25 索引文件（旧版本建的库）时自动退回只用向量检索。
+"""
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag.embeddings import embed_queries
+from rag.sparse import BM25Index
+
+logger = logging.getLogger(__name__)
+
+RAG_RETRIEVER = os.getenv("RAG_RETRIEVER", "hybrid").lower()
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "2"))
+RAG_FETCH_K = int(os.getenv("RAG_FETCH_K", "20"))
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# 交叉编码器模型名，例如 cross-encoder/ms-marco-MiniLM-L-6-v2；留空表示不重排序
+RAG_RERANKER_MODEL = os.getenv("RAG_RERANKER_MODEL", "")
+RAG_MMR = os.getenv("RAG_MMR", "false").lower() in ("1", "true", "yes")
+# MMR 中相关性所占的权重，1.0 等价于不做多样化
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+
+RETRIEVER_MODES = ("hybrid", "vector", "bm25")
+
+
+@dataclass
+class RetrievedChunk:
+    """一个检索结果。sources 记录它是被哪一路召回的（vector / bm25）。"""
+    id: str
+    text: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    score: float = 0.0
+    sources: List[str] = field(default_factory=list)
+
+
+def rrf_fuse(rankings: Dict[str, Sequence[str]], rrf_k: int = RAG_RRF_K) -> List[Tuple[str, float]]:
+    """倒数排名融合 (Reciprocal Rank Fusion)：rankings 为 {来源: 按相关性排好序的 ID 列表}。"""
+    scores: Dict[str, float] = {}
+    for ids in rankings.values():
+        for rank, chunk_id in enumerate(ids, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def mmr_select(relevance: Sequence[float], vectors: np.ndarray, k: int, lambda_mult: float = RAG_MMR_LAMBDA) -> List[int]:
+    """
+    最大边际相关性：每次选出 λ·相关性 − (1−λ)·与已选结果的最大余弦相似度 最高的候选。
+    relevance 会被线性缩放到 [0, 1]，与余弦相似度处在同一尺度。返回选中候选的下标。
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+    rel = np.asarray(relevance, dtype=np.float32)
+    span = float(rel.max() - rel.min())
+    rel = (rel - rel.min()) / span if span > 0 else np.ones_like(rel)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms == 0, 1.0, norms)
+    similarity = unit @ unit.T
+
+    selected = [int(np.argmax(rel))]
+    max_sim = similarity[selected[0]].copy()
+    while len(selected) < min(k, n):
+        scores = lambda_mult * rel - (1 - lambda_mult) * max_sim
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        max_sim = np.maximum(max_sim, similarity[best])
+    return selected
+
+
+class HybridRetriever:
+    """
+    组合 Chroma 集合、嵌入函数和 BM25 索引的检索器。线程安全（交叉编码器惰性加载时加锁）。
+    """
+    def __init__(self, collection, embeddings, sparse: Optional[BM25Index] = None,
+                 mode: str = RAG_RETRIEVER, top_k: int = RAG_TOP_K, fetch_k: int = RAG_FETCH_K,
+                 rrf_k: int = RAG_RRF_K, reranker_model: str = RAG_RERANKER_MODEL,
+                 mmr: bool = RAG_MMR, mmr_lambda: float = RAG_MMR_LAMBDA):
+        if mode not in RETRIEVER_MODES:
+            raise ValueError(f"Unsupported RAG_RETRIEVER '{mode}'. Choose one of {RETRIEVER_MODES}.")
+        if mode != "vector" and sparse is None:
+            logger.warning("⚠️ 没有找到 BM25 索引，只使用向量检索（重新运行 build_rag_index.py 即可生成）。")
+            mode = "vector"
+        self.collection = collection
+        self.embeddings = embeddings
+        self.sparse = sparse
+        self.mode = mode
+        self.top_k = top_k
+        self.fetch_k = max(fetch_k, top_k)
+        self.rrf_k = rrf_k
+        self.reranker_model = reranker_model
+        self.mmr = mmr
+        self.mmr_lambda = mmr_lambda
+        self._reranker = None
+        self._reranker_lock = threading.Lock()
+
+    @property
+    def reranker(self):
+        """第一次使用时加载交叉编码器；加载失败时记录警告并不再重排序。"""
+        if self._reranker is None and self.reranker_model:
+            with self._reranker_lock:
+                if self._reranker is None and self.reranker_model:
+                    try:
+                        from sentence_transformers import CrossEncoder
+                        self._reranker = CrossEncoder(self.reranker_model)
+                    except Exception as e:
+                        logger.warning("⚠️ 无法加载重排序模型 '%s'，跳过重排序: %s", self.reranker_model, e)
+                        self.reranker_model = ""
+        return self._reranker
+
+    def _vector_candidates(self, queries: List[str], candidates: List[Dict[str, RetrievedChunk]],
+                           vectors: List[Dict[str, Any]]) -> List[List[str]]:
+        include = ["documents", "metadatas"] + (["embeddings"] if self.mmr else [])
+        result = self.collection.query(query_embeddings=embed_queries(self.embeddings, queries),
+                                       n_results=self.fetch_k, include=include)
+        all_ids = result["ids"] or [[] for _ in queries]
+        embeddings = result.get("embeddings")
+        for q, ids in enumerate(all_ids):
+            for i, chunk_id in enumerate(ids):
+                candidates[q].setdefault(chunk_id, RetrievedChunk(
+                    chunk_id, result["documents"][q][i] or "", result["metadatas"][q][i] or {}))
+                if embeddings is not None:
+                    vectors[q][chunk_id] = embeddings[q][i]
+        return all_ids
+
+    def _sparse_candidates(self, query: str, candidates: Dict[str, RetrievedChunk]) -> List[str]:
+        ids = []
+        for chunk_id, _ in self.sparse.search(query, self.fetch_k):
+            doc = self.sparse.get(chunk_id)
+            candidates.setdefault(chunk_id, RetrievedChunk(chunk_id, doc["text"], doc["metadata"]))
+            ids.append(chunk_id)
+        return ids
+
+    def _vectors_for(self, chunks: List[RetrievedChunk],
+                     vectors: Dict[str, Any]) -> Tuple[List[RetrievedChunk], np.ndarray]:
+        """
+        MMR 需要每个候选的向量；只由 BM25 召回的候选从集合中补取。
+        集合中已经没有的候选（BM25 索引比向量库旧）被跳过，返回 (保留的候选, 它们的向量矩阵)。
+        """
+        missing = [chunk.id for chunk in chunks if chunk.id not in vectors]
+        if missing:
+            fetched = self.collection.get(ids=missing, include=["embeddings"])
+            vectors.update(zip(fetched["ids"], fetched["embeddings"]))
+        kept = [chunk for chunk in chunks if chunk.id in vectors]
+        return kept, np.asarray([vectors[chunk.id] for chunk in kept], dtype=np.float32)
+
+    def _fuse(self, rankings: Dict[str, List[str]], candidates: Dict[str, RetrievedChunk]) -> List[RetrievedChunk]:
+        """RRF 融合，并丢弃内容完全相同的文本块（重叠切分、重复的模板段落）。"""
+        ranked: List[RetrievedChunk] = []
+        seen_texts = set()
+        for chunk_id, score in rrf_fuse(rankings, self.rrf_k):
+            chunk = candidates[chunk_id]
+            if chunk.text in seen_texts:
+                continue
+            seen_texts.add(chunk.text)
+            chunk.score = score
+            chunk.sources = [source for source, ids in rankings.items() if chunk_id in ids]
+            ranked.append(chunk)
+        return ranked
+
+    def _rerank(self, queries: List[str], ranked: List[List[RetrievedChunk]]):
+        """所有查询的 (查询, 文本块) 对在一次交叉编码器调用中打分。"""
+        pairs = [(query, chunk.text) for query, chunks in zip(queries, ranked) for chunk in chunks]
+        reranker = self.reranker if pairs else None
+        if reranker is None:
+            return
+        scores = iter(reranker.predict(pairs))
+        for chunks in ranked:
+            for chunk in chunks:
+                chunk.score = float(next(scores))
+            chunks.sort(key=lambda chunk: chunk.score, reverse=True)
+
+    def retrieve(self, query: str, k: Optional[int] = None) -> List[RetrievedChunk]:
+        """返回与查询最相关的 k 个文本块（默认 top_k），按相关性从高到低排列。"""
+        return self.retrieve_many([query], k)[0]
+
+    def retrieve_many(self, queries: List[str], k: Optional[int] = None) -> List[List[RetrievedChunk]]:
+        """批量检索：返回与 queries 一一对应的结果列表。"""
+        if not queries:
+            return []
+        k = k or self.top_k
+        candidates: List[Dict[str, RetrievedChunk]] = [{} for _ in queries]
+        vectors: List[Dict[str, Any]] = [{} for _ in queries]
+        rankings: List[Dict[str, List[str]]] = [{} for _ in queries]
+        if self.mode in ("hybrid", "vector"):
+            for q, ids in enumerate(self._vector_candidates(queries, candidates, vectors)):
+                rankings[q]["vector"] = ids
+        if self.mode in ("hybrid", "bm25"):
+            for q, query in enumerate(queries):
+                rankings[q]["bm25"] = self._sparse_candidates(query, candidates[q])
+
+        ranked = [self._fuse(rankings[q], candidates[q]) for q in range(len(queries))]
+        self._rerank(queries, ranked)
+
+        results = []
+        for q, chunks in enumerate(ranked):
+            if self.mmr and len(chunks) > k:
+                chunks, matrix = self._vectors_for(chunks, vectors[q])
+                chunks = [chunks[i] for i in mmr_select([chunk.score for chunk in chunks], matrix, k, self.mmr_lambda)]
+            results.append(chunks[:k])
+        return results
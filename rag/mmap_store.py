@@ -0,0 +1,383 @@
+# rag/mmap_store.py
+"""
+纯 NumPy 的内存映射向量库，可以替代 Chroma（RAG_BACKEND=mmap）。
+
+对我们这种规模的知识库，Chroma 的启动时间和常驻内存都没有必要。MmapCollection 把数据保存为几个普通文件：
+    vectors.<代>.npy   归一化后的向量矩阵 (n, d)，float32 或 float16，用 np.load(mmap_mode="r") 打开
+    chunks.<代>.jsonl  每行一个 {"id", "text", "metadata"}
+    offsets.<代>.npy   int64 (n + 1)，第 i 个文本块在 chunks 文件中的字节范围
+    ivf.<代>.npz       可选的 IVF 倒排：质心和每个列表在矩阵中的行范围
+    meta.json          当前的代号、维度、行数、dtype 等；最后原子替换，读者永远看到完整的一代
+打开时只读 meta.json 并建立内存映射，冷启动几乎为零；查询只读取命中行的文本。
+每次读操作前检查 meta.json 的 inode / mtime（一次 stat），其他进程（例如 build_rag_index.py）写出新的一代后自动重新打开。
+
+检索是批量、向量化的点积 top-k（向量已归一化，即余弦相似度），按块计算以限制内存。
+行数足够多且设置了 RAG_MMAP_IVF_LISTS 时，写入时用球面 k-means 把向量分到若干列表，
+同一列表的行在矩阵中连续存放，查询时只扫描最近的 RAG_MMAP_NPROBE 个列表。
+float16 存储把向量文件缩小一半，计算时按块转换为 float32。
+
+接口与 Chroma 集合一致（upsert / delete / get / query / count），build_rag_index.py 和 HybridRetriever 无需区分；
+不同之处是写入先暂存在内存中，调用 flush() 后才落盘并对查询可见。
+"""
+import json
+import mmap
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+RAG_MMAP_DTYPE = os.getenv("RAG_MMAP_DTYPE", "float32")
+# IVF 列表数，0 表示总是精确检索；行数少于 列表数 × IVF_MIN_ROWS_PER_LIST 时也使用精确检索
+RAG_MMAP_IVF_LISTS = int(os.getenv("RAG_MMAP_IVF_LISTS", "0"))
+RAG_MMAP_NPROBE = int(os.getenv("RAG_MMAP_NPROBE", "8"))
+
+DTYPES = ("float32", "float16")
+META_FILENAME = "meta.json"
+IVF_MIN_ROWS_PER_LIST = 39
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 256
+# 每次参与矩阵乘法的行数，限制查询时的临时内存
+_BLOCK_ROWS = 65536
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def _merge_top_k(scores: np.ndarray, rows: np.ndarray, k: int):
+    """对每一行（每个查询）保留得分最高的 k 个候选，按得分降序。"""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        rows = np.take_along_axis(rows, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+
+def spherical_kmeans(vectors: np.ndarray, n_lists: int, seed: int = 0) -> np.ndarray:
+    """在归一化向量的样本上训练球面 k-means，返回归一化的质心 (n_lists, d)。"""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    sample_rows = np.sort(rng.choice(n, size=min(n, n_lists * KMEANS_SAMPLE_PER_LIST), replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        # 空列表重新取一个随机样本作为质心
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class _Generation:
+    """一代已落盘的数据（只读）。查询先取得当前这一代的引用，flush 切换到新一代不会影响进行中的查询。"""
+    def __init__(self, directory: str, meta: Dict[str, Any]):
+        self.meta = meta
+        self.vectors = None
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.chunks = None
+        self.centroids = None
+        self.list_offsets = None
+        self._rows: Optional[Dict[str, int]] = None
+        self._rows_lock = threading.Lock()
+        if not meta["count"]:
+            return
+        generation = meta["generation"]
+        self.vectors = np.load(_generation_path(directory, "vectors", generation, "npy"), mmap_mode="r")
+        self.offsets = np.load(_generation_path(directory, "offsets", generation, "npy"), mmap_mode="r")
+        with open(_generation_path(directory, "chunks", generation, "jsonl"), "rb") as f:
+            self.chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if meta.get("ivf_lists"):
+            ivf = np.load(_generation_path(directory, "ivf", generation, "npz"))
+            self.centroids = ivf["centroids"]
+            self.list_offsets = ivf["list_offsets"]
+
+    @property
+    def count(self) -> int:
+        return self.meta["count"]
+
+    def raw_record(self, row: int) -> bytes:
+        return self.chunks[int(self.offsets[row]):int(self.offsets[row + 1])]
+
+    def record(self, row: int) -> Dict[str, Any]:
+        return json.loads(self.raw_record(row))
+
+    @property
+    def rows(self) -> Dict[str, int]:
+        """{id: 行号}；只有 get / delete / count 需要，第一次使用时才扫描文本块文件。"""
+        if self._rows is None:
+            with self._rows_lock:
+                if self._rows is None:
+                    self._rows = {self.record(row)["id"]: row for row in range(self.count)}
+        return self._rows
+
+    def search_blocks(self, queries: np.ndarray, k: int, start: int, end: int):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for block_start in range(start, end, _BLOCK_ROWS):
+            block_end = min(block_start + _BLOCK_ROWS, end)
+            scores = queries @ np.asarray(self.vectors[block_start:block_end], dtype=np.float32).T
+            rows = np.broadcast_to(np.arange(block_start, block_end), scores.shape)
+            best_scores, best_rows = _merge_top_k(np.hstack([best_scores, scores]), np.hstack([best_rows, rows]), k)
+        return best_scores, best_rows
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int):
+        if self.centroids is None:
+            return self.search_blocks(queries, k, 0, self.count)
+        # IVF：每个查询只扫描最近的 nprobe 个列表（每个列表在矩阵中是连续的一段）。
+        # 按列表分组计算：一批查询中探测同一个列表的查询一起做矩阵乘法，每个列表只读取（和转换 dtype）一次。
+        # 探测到的行不足 k 个时，用得分 -inf、行号 -1 补齐
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        parts: List[List[tuple]] = [[] for _ in range(len(queries))]
+        for list_id in np.unique(probes):
+            start, end = int(self.list_offsets[list_id]), int(self.list_offsets[list_id + 1])
+            if end <= start:
+                continue
+            members = np.nonzero((probes == list_id).any(axis=1))[0]
+            scores = queries[members] @ np.asarray(self.vectors[start:end], dtype=np.float32).T
+            rows = np.arange(start, end)
+            for member, member_scores in zip(members, scores):
+                parts[member].append((member_scores, rows))
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query_parts in enumerate(parts):
+            if not query_parts:
+                continue
+            scores, rows = _merge_top_k(np.concatenate([p[0] for p in query_parts])[None, :],
+                                        np.concatenate([p[1] for p in query_parts])[None, :], k)
+            best_scores[i, :scores.shape[1]] = scores[0]
+            best_rows[i, :rows.shape[1]] = rows[0]
+        return best_scores, best_rows
+
+
+def _generation_path(directory: str, name: str, generation: int, ext: str) -> str:
+    return os.path.join(directory, f"{name}.{generation}.{ext}")
+
+
+class MmapCollection:
+    """
+    一个内存映射的向量集合。读操作不加锁，只读取当前这一代；写操作和 flush 加锁，flush 写出新的一代后原子切换。
+    meta.json 被其他进程替换后，下一次读操作会切换到新的一代。
+    """
+    def __init__(self, directory: str, dtype: str = RAG_MMAP_DTYPE,
+                 ivf_lists: int = RAG_MMAP_IVF_LISTS, nprobe: int = RAG_MMAP_NPROBE):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported RAG_MMAP_DTYPE '{dtype}'. Choose one of {DTYPES}.")
+        self.directory = directory
+        self.dtype = dtype
+        self.ivf_lists = ivf_lists
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        # 尚未落盘的写入：{id: (向量, 文本, 元数据)} 和待删除的 ID
+        self._pending: Dict[str, tuple] = {}
+        self._deleted: set = set()
+        os.makedirs(directory, exist_ok=True)
+        self._signature = None
+        self._current = self._open()
+
+    def _meta_signature(self):
+        """meta.json 的 (inode, mtime, 大小)；每一代都是原子替换，任何一项变化都说明有了新的一代。"""
+        try:
+            st = os.stat(os.path.join(self.directory, META_FILENAME))
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _open(self) -> _Generation:
+        meta_path = os.path.join(self.directory, META_FILENAME)
+        # 先取签名再读取：读取期间又有新的一代时，下一次检查会再次重新打开
+        self._signature = self._meta_signature()
+        meta = {"generation": 0, "count": 0, "dim": 0, "dtype": self.dtype}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        return _Generation(self.directory, meta)
+
+    def _snapshot(self) -> _Generation:
+        """返回当前这一代；meta.json 已被其他进程替换时先重新打开。"""
+        if self._meta_signature() != self._signature:
+            with self._lock:
+                if self._meta_signature() != self._signature:
+                    # 写入方切换后会删除旧一代的文件，刚读到的一代也可能已经被再次替换，重试几次
+                    for attempt in range(3):
+                        try:
+                            self._current = self._open()
+                            break
+                        except FileNotFoundError:
+                            if attempt == 2:
+                                raise
+        return self._current
+
+    def _path(self, name: str, generation: int, ext: str) -> str:
+        return _generation_path(self.directory, name, generation, ext)
+
+    def count(self) -> int:
+        current = self._snapshot()
+        with self._lock:
+            committed = sum(1 for chunk_id in current.rows if chunk_id not in self._deleted)
+            return committed + sum(1 for chunk_id in self._pending if chunk_id not in current.rows)
+
+    # ---------- Chroma 兼容的写接口（暂存，flush 后生效） ----------
+
+    def upsert(self, ids: List[str], embeddings: Sequence[Sequence[float]],
+               documents: Optional[List[str]] = None, metadatas: Optional[List[Dict[str, Any]]] = None):
+        with self._lock:
+            for i, chunk_id in enumerate(ids):
+                text = documents[i] if documents else ""
+                metadata = metadatas[i] if metadatas else {}
+                self._pending[chunk_id] = (np.asarray(embeddings[i], dtype=np.float32), text, metadata)
+                self._deleted.discard(chunk_id)
+
+    add = upsert
+
+    def delete(self, ids: Iterable[str]):
+        with self._lock:
+            for chunk_id in ids:
+                self._pending.pop(chunk_id, None)
+                self._deleted.add(chunk_id)
+
+    def flush(self):
+        """把暂存的写入和删除合并进当前数据，写出新的一代文件并原子切换。"""
+        # 在磁盘上最新的一代之上合并
+        self._snapshot()
+        with self._lock:
+            current = self._current
+            if not self._pending and not self._deleted and os.path.exists(os.path.join(self.directory, META_FILENAME)):
+                return
+            generation = current.meta["generation"] + 1
+            kept = np.asarray(sorted(row for chunk_id, row in current.rows.items()
+                                     if chunk_id not in self._deleted and chunk_id not in self._pending), dtype=np.int64)
+            new_items = list(self._pending.items())
+            count = len(kept) + len(new_items)
+            dim = current.meta["dim"] or (len(new_items[0][1][0]) if new_items else 0)
+
+            meta = {"generation": generation, "count": count, "dim": dim, "dtype": self.dtype, "ivf_lists": 0}
+            if count:
+                order, ivf = self._write_vectors(current, generation, kept, new_items, count, dim)
+                self._write_chunks(current, generation, kept, new_items, order)
+                if ivf is not None:
+                    np.savez(self._path("ivf", generation, "npz"), **ivf)
+                    meta["ivf_lists"] = len(ivf["centroids"])
+
+            meta_path = os.path.join(self.directory, META_FILENAME)
+            with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(f"{meta_path}.tmp", meta_path)
+            self._pending.clear()
+            self._deleted.clear()
+            self._current = self._open()
+            # 旧文件已被映射的话，在 POSIX 上删除后映射仍然有效，进行中的查询不受影响
+            for name, ext in (("vectors", "npy"), ("offsets", "npy"), ("chunks", "jsonl"), ("ivf", "npz")):
+                try:
+                    os.remove(self._path(name, current.meta["generation"], ext))
+                except OSError:
+                    pass
+
+    def _write_vectors(self, current: _Generation, generation: int, kept: np.ndarray,
+                       new_items: List[tuple], count: int, dim: int):
+        """写出向量矩阵；需要 IVF 时按列表重排行，返回 (行的新顺序, IVF 数据或 None)。"""
+        unsorted_path = self._path("vectors-unsorted", generation, "npy")
+        merged = np.lib.format.open_memmap(unsorted_path, mode="w+", dtype=np.float32, shape=(count, dim))
+        for start in range(0, len(kept), _BLOCK_ROWS):
+            block = kept[start:start + _BLOCK_ROWS]
+            merged[start:start + len(block)] = current.vectors[block]
+        if new_items:
+            merged[len(kept):] = _normalize(np.stack([item[1][0] for item in new_items]))
+
+        order = np.arange(count)
+        ivf = None
+        if self.ivf_lists and count >= self.ivf_lists * IVF_MIN_ROWS_PER_LIST:
+            centroids = spherical_kmeans(merged, self.ivf_lists)
+            assign = np.concatenate([np.argmax(merged[start:start + _BLOCK_ROWS] @ centroids.T, axis=1)
+                                     for start in range(0, count, _BLOCK_ROWS)])
+            order = np.argsort(assign, kind="stable")
+            list_offsets = np.zeros(self.ivf_lists + 1, dtype=np.int64)
+            list_offsets[1:] = np.cumsum(np.bincount(assign, minlength=self.ivf_lists))
+            ivf = {"centroids": centroids.astype(np.float32), "list_offsets": list_offsets}
+
+        vectors = np.lib.format.open_memmap(self._path("vectors", generation, "npy"), mode="w+",
+                                            dtype=self.dtype, shape=(count, dim))
+        for start in range(0, count, _BLOCK_ROWS):
+            vectors[start:start + _BLOCK_ROWS] = merged[order[start:start + _BLOCK_ROWS]]
+        vectors.flush()
+        del vectors, merged
+        os.remove(unsorted_path)
+        return order, ivf
+
+    def _write_chunks(self, current: _Generation, generation: int, kept: np.ndarray,
+                      new_items: List[tuple], order: np.ndarray):
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        with open(self._path("chunks", generation, "jsonl"), "wb") as f:
+            for i, source in enumerate(order):
+                if source < len(kept):
+                    raw = current.raw_record(int(kept[source]))
+                else:
+                    chunk_id, (_, text, metadata) = new_items[source - len(kept)]
+                    raw = (json.dumps({"id": chunk_id, "text": text, "metadata": metadata},
+                                      ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(raw)
+                offsets[i + 1] = offsets[i] + len(raw)
+        np.save(self._path("offsets", generation, "npy"), offsets)
+
+    # ---------- Chroma 兼容的读接口 ----------
+
+    @staticmethod
+    def _result(current: _Generation, rows: List[int], include: Sequence[str]) -> Dict[str, Any]:
+        records = [current.record(row) for row in rows]
+        embeddings = None
+        if "embeddings" in include:
+            embeddings = (np.asarray(current.vectors[rows], dtype=np.float32) if rows
+                          else np.zeros((0, current.meta["dim"]), dtype=np.float32))
+        return {
+            "ids": [record["id"] for record in records],
+            "documents": [record["text"] for record in records] if "documents" in include else None,
+            "metadatas": [record["metadata"] for record in records] if "metadatas" in include else None,
+            "embeddings": embeddings,
+        }
+
+    def get(self, ids: Optional[List[str]] = None, include: Sequence[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        current = self._snapshot()
+        if ids is None:
+            rows = sorted(current.rows.values())
+        else:
+            rows = [current.rows[chunk_id] for chunk_id in ids if chunk_id in current.rows]
+        return self._result(current, rows, include)
+
+    @staticmethod
+    def _search(current: _Generation, query_embeddings: Sequence[Sequence[float]], k: int, nprobe: int):
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        k = min(k, current.count)
+        if not k:
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        return current.search(queries, k, nprobe)
+
+    def search(self, query_embeddings: Sequence[Sequence[float]], k: int):
+        """
+        批量 top-k：返回 (scores, rows)，形状都是 (查询数, k)，按余弦相似度降序。
+        IVF 模式下探测到的行不足 k 个时，多出的位置行号为 -1。
+        """
+        return self._search(self._snapshot(), query_embeddings, k, self.nprobe)
+
+    def query(self, query_embeddings: Sequence[Sequence[float]], n_results: int = 10,
+              include: Sequence[str] = ("documents", "metadatas", "distances")) -> Dict[str, Any]:
+        """与 Chroma 的 collection.query 返回相同结构；distances 为 1 - 余弦相似度。"""
+        current = self._snapshot()
+        scores, rows = self._search(current, query_embeddings, n_results, self.nprobe)
+        results, distances = [], []
+        for query_scores, query_rows in zip(scores, rows):
+            valid = query_rows >= 0
+            results.append(self._result(current, [int(row) for row in query_rows[valid]], include))
+            distances.append((1.0 - query_scores[valid]).tolist())
+        return {
+            "ids": [result["ids"] for result in results],
+            "documents": [result["documents"] for result in results] if "documents" in include else None,
+            "metadatas": [result["metadatas"] for result in results] if "metadatas" in include else None,
+            "embeddings": [result["embeddings"] for result in results] if "embeddings" in include else None,
+            "distances": distances if "distances" in include else None,
+        }
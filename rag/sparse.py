@@ -0,0 +1,124 @@
+# rag/sparse.py
+"""
+BM25 稀疏倒排索引，与 Chroma 向量索引互补。
+
+向量检索擅长语义相近的表述，但对产品名、编号这类必须逐字匹配的查询经常失手；
+BM25 正好相反。build_rag_index.py 在写入 Chroma 的同时维护这个索引（同样按文件增量更新），
+RAGTool 检索时把两路结果融合（见 rag/hybrid.py）。
+
+分词对中英文混合文本都适用：拉丁字母和数字按单词切分（"SKU-48213" 同时产生 "sku-48213"、"sku"、"48213"），
+中日韩文字没有空格，按单字加相邻双字切分。
+索引以 JSON 保存在向量库目录中，每个文本块保存原文、元数据和词频，倒排表在加载时重建。
+"""
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SPARSE_INDEX_FILENAME = "bm25_index.json"
+
+_TOKEN_RE = re.compile(
+    r"[0-9a-z]+(?:[-_.][0-9a-z]+)*"
+    r"|[぀-ヿ㐀-䶿一-鿿가-힯]+"
+)
+_SUBWORD_RE = re.compile(r"[-_.]")
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切分成检索词：英文/数字按单词（带连字符的编号额外拆出各部分），CJK 按单字 + 双字。"""
+    tokens: List[str] = []
+    for match in _TOKEN_RE.finditer(text.casefold()):
+        word = match.group()
+        if not word[0].isascii():
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+            if _SUBWORD_RE.search(word):
+                tokens.extend(part for part in _SUBWORD_RE.split(word) if part)
+    return tokens
+
+
+class BM25Index:
+    """可增量增删文本块的 BM25 索引。"""
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # {chunk_id: {"text": ..., "metadata": {...}, "tf": {词: 次数}, "length": 词数}}
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, chunk_id: str, text: str, metadata: Optional[Dict[str, Any]] = None):
+        """写入（或覆盖）一个文本块。"""
+        if chunk_id in self.docs:
+            self.remove([chunk_id])
+        tf = Counter(tokenize(text))
+        length = sum(tf.values())
+        self.docs[chunk_id] = {"text": text, "metadata": metadata or {}, "tf": dict(tf), "length": length}
+        self._index(chunk_id, tf, length)
+
+    def _index(self, chunk_id: str, tf: Dict[str, int], length: int):
+        for term, count in tf.items():
+            self._postings.setdefault(term, {})[chunk_id] = count
+        self._total_length += length
+
+    def remove(self, chunk_ids: Iterable[str]):
+        for chunk_id in chunk_ids:
+            doc = self.docs.pop(chunk_id, None)
+            if doc is None:
+                continue
+            for term in doc["tf"]:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self._postings[term]
+            self._total_length -= doc["length"]
+
+    def get(self, chunk_id: str) -> Optional[Dict[str, Any]]:
+        return self.docs.get(chunk_id)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """返回得分最高的 k 个 (chunk_id, BM25 得分)，只包含至少命中一个检索词的文本块。"""
+        n = len(self.docs)
+        if not n:
+            return []
+        avg_length = self._total_length / n or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, count in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.docs[chunk_id]["length"] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path: str):
+        """原子地写入 JSON 文件（先写临时文件再替换）。"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "docs": self.docs}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        index.docs = data.get("docs", {})
+        for chunk_id, doc in index.docs.items():
+            index._index(chunk_id, doc["tf"], doc["length"])
+        return index
+
+    @classmethod
+    def load_or_create(cls, path: str) -> "BM25Index":
+        return cls.load(path) if os.path.exists(path) else cls()
@@ -0,0 +1,220 @@
+"""
+SmartAgent 的 HTTP 服务入口。
+
+启动时只创建一个 AsyncSmartAgent 并预热所有工具（嵌入模型、Chroma 等只加载一次），之后所有请求共享这些工具；
+每个请求都在自己的 AgentSession（记忆、Prompt 状态、轮次）中执行。并发执行的目标数由 SERVER_WORKERS 限制，
+排队的请求超过 SERVER_MAX_QUEUE 时直接返回 429，而不是无限堆积。
+
+接口:
+    POST /goals          提交一个 MCPMessage，目标完成后返回结果 (MCPMessage)
+    POST /goals/stream   同上，但以 SSE 实时推送 thought / action / observation / final 事件
+                         （LLM_STREAM=1 时还有逐段的 thought_delta）
+    GET  /health         运行状态和排队统计（使用 LLM_PROVIDER=router 时包括每个服务商的延迟和失败统计）
+
+用法: python server.py --host 0.0.0.0 --port 8000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+
+from agent import AsyncSmartAgent
+from llm.router import router_stats
+from mcp.protocol import MCPMessage
+from session import AgentSession
+from tracing import LOG_LEVEL, configure_logging
+
+logger = logging.getLogger(__name__)
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# 同时执行的目标数量
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "32"))
+# 等待执行的目标数量上限，超出后返回 429
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", "64"))
+# 启动时预热所有工具（加载嵌入模型等），避免第一个请求承担冷启动开销
+SERVER_WARM_UP = os.getenv("SERVER_WARM_UP", "1") == "1"
+SERVER_MAX_TURNS = int(os.getenv("SERVER_MAX_TURNS", "50"))
+
+
+class QueueFullError(Exception):
+    """排队的目标已达上限。"""
+
+
+class AgentPool:
+    """
+    在一个共享的 AsyncSmartAgent 上执行会话，限制并发数和排队长度。
+    会话之间不共享任何可变状态，因此同一个 Agent 实例可以安全地并发使用。
+    """
+    def __init__(self, agent: AsyncSmartAgent, workers: int = SERVER_WORKERS, max_queue: int = SERVER_MAX_QUEUE):
+        self.agent = agent
+        self.workers = workers
+        self.max_queue = max_queue
+        self._slots = asyncio.Semaphore(workers)
+        self._pending = 0  # 正在执行 + 正在排队的目标数
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def reserve(self):
+        """为一个新目标占位；排队已满时抛出 QueueFullError。必须与 run 配对使用。"""
+        if self._pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise QueueFullError()
+        self._pending += 1
+
+    async def run(self, session: AgentSession) -> str:
+        """执行一个已经 reserve 过的会话。"""
+        try:
+            async with self._slots:
+                self.in_flight += 1
+                try:
+                    result = await self.agent.arun_session(session, max_turns=SERVER_MAX_TURNS)
+                    self.completed += 1
+                    return result
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.in_flight -= 1
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self._pending - self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+def warm_up_tools(agent: AsyncSmartAgent):
+    """加载并预热所有工具。单个工具预热失败只打印警告，不影响服务启动。"""
+    tools = list(agent.tools.values()) + ([agent.rag_tool] if agent.rag_tool else [])
+    for tool in tools:
+        start = time.perf_counter()
+        try:
+            tool.warm_up()
+            logger.info("🔥 Warmed up '%s' in %.0f ms", tool.name, (time.perf_counter() - start) * 1000)
+        except Exception as e:
+            logger.warning("⚠️ Failed to warm up '%s': %s", tool.name, e)
+
+
+def _response_message(pool: AgentPool, request: MCPMessage, session: AgentSession) -> MCPMessage:
+    return MCPMessage(
+        sender_id=pool.agent.agent_id,
+        receiver_id=request.sender_id,
+        task=request.task,
+        data={"result": session.result, "request_id": request.message_id, **session.summary()},
+    )
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+
+def create_app(agent: Optional[AsyncSmartAgent] = None, workers: int = SERVER_WORKERS,
+               max_queue: int = SERVER_MAX_QUEUE, warm_up: bool = SERVER_WARM_UP) -> FastAPI:
+    """创建 FastAPI 应用。Agent 在应用启动时创建（或使用传入的实例），并在那时预热工具。"""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        shared_agent = agent or AsyncSmartAgent(agent_id="smart_agent_server")
+        if warm_up:
+            # 预热是同步的 CPU/IO 密集操作，放到线程里执行
+            await asyncio.to_thread(warm_up_tools, shared_agent)
+        app.state.pool = AgentPool(shared_agent, workers=workers, max_queue=max_queue)
+        yield
+
+    app = FastAPI(title="D-Agent", lifespan=lifespan)
+
+    def reserve(pool: AgentPool):
+        try:
+            pool.reserve()
+        except QueueFullError:
+            raise HTTPException(status_code=429, detail="服务器繁忙：排队的目标已达上限，请稍后重试。",
+                                headers={"Retry-After": "1"})
+
+    @app.post("/goals", response_model=MCPMessage)
+    async def run_goal(request: MCPMessage) -> MCPMessage:
+        pool: AgentPool = app.state.pool
+        reserve(pool)
+        session = pool.agent.new_session(request)
+        await pool.run(session)
+        return _response_message(pool, request, session)
+
+    @app.post("/goals/stream")
+    async def stream_goal(request: MCPMessage) -> StreamingResponse:
+        pool: AgentPool = app.state.pool
+        reserve(pool)
+        events: asyncio.Queue = asyncio.Queue()
+        session = pool.agent.new_session(request, on_event=events.put)
+
+        async def worker():
+            try:
+                await pool.run(session)
+                await events.put({"type": "summary", **session.summary()})
+            except Exception as e:
+                await events.put({"type": "error", "message": str(e)})
+            finally:
+                await events.put(None)
+
+        # 在返回响应之前就启动目标，保证 reserve 的名额一定会被 run 释放
+        task = asyncio.create_task(worker())
+
+        async def event_stream() -> AsyncIterator[str]:
+            try:
+                yield _sse({"type": "accepted", "request_id": request.message_id, "session_id": session.session_id})
+                while True:
+                    event = await events.get()
+                    if event is None:
+                        break
+                    yield _sse(event)
+            finally:
+                # 客户端断开连接时取消仍在执行的目标
+                if not task.done():
+                    task.cancel()
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.get("/health")
+    async def health() -> Dict[str, Any]:
+        pool: AgentPool = app.state.pool
+        body = {"status": "ok", "agent_id": pool.agent.agent_id, **pool.stats(),
+                "tool_cache": pool.agent.tool_cache.stats()}
+        llm_router = router_stats()
+        if llm_router is not None:
+            body["llm_router"] = llm_router
+        return body
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve SmartAgent over HTTP.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="同时执行的目标数量。")
+    parser.add_argument("--max-queue", type=int, default=SERVER_MAX_QUEUE, help="排队目标数量上限，超出返回 429。")
+    parser.add_argument("--no-warm-up", action="store_true", help="启动时不预热工具。")
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="Agent 日志级别，例如 DEBUG / INFO / WARNING。")
+    parser.add_argument("--quiet", action="store_true", help="只输出警告和错误，等价于 --log-level WARNING。")
+    args = parser.parse_args()
+    configure_logging(args.log_level, quiet=args.quiet)
+    uvicorn.run(create_app(workers=args.workers, max_queue=args.max_queue, warm_up=not args.no_warm_up),
+                host=args.host, port=args.port)
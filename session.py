@@ -0,0 +1,69 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from memory import ConversationMemory
+from prompt import PromptBuilder
+from tracing import Tracer
+
+# 进度事件回调：接收 {"type": "thought" | "action" | "observation" | "final", ...} 形式的事件；
+# 开启 LLM_STREAM 时还会在 thought 之前收到若干 {"type": "thought_delta", "delta": ...} 事件
+EventCallback = Callable[[Dict[str, Any]], Any]
+
+
+class AgentSession:
+    """
+    一个目标的全部运行状态：记忆、Prompt 状态、轮次计数、追踪 span 和工具可用的临时数据。
+
+    SmartAgent 本身只持有共享且线程安全的部分（LLM 客户端、已加载的工具、分发器、静态系统提示词），
+    因此同一个 Agent 实例可以同时驱动任意多个会话，每个会话的开销只有它自己的历史记录。
+    """
+    def __init__(self, goal: Any, memory: ConversationMemory, prompt_builder: PromptBuilder,
+                 on_event: Optional[EventCallback] = None, session_id: Optional[str] = None):
+        self.session_id = session_id or str(uuid.uuid4())
+        self.goal = goal
+        self.memory = memory
+        self.prompt_builder = prompt_builder
+        self.on_event = on_event
+        self.turn = 0
+        self.tracer = Tracer()
+        # 供工具或扩展在一个目标内暂存数据，不会泄漏到其他会话
+        self.scratch: Dict[str, Any] = {}
+        self.result: Optional[str] = None
+        self.finished = False
+        self.started_at = time.perf_counter()
+        self.ended_at: Optional[float] = None
+
+    def emit(self, event_type: str, **data: Any) -> Any:
+        """同步触发一个进度事件，返回回调的返回值（可能是协程，由 aemit 负责等待）。"""
+        if self.on_event is None:
+            return None
+        return self.on_event({"type": event_type, "session_id": self.session_id, **data})
+
+    async def aemit(self, event_type: str, **data: Any):
+        """异步触发一个进度事件，回调可以是普通函数也可以是协程函数。"""
+        result = self.emit(event_type, **data)
+        if asyncio.iscoroutine(result):
+            await result
+
+    def complete(self, result: str, finished: bool):
+        self.result = result
+        self.finished = finished
+        self.ended_at = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.ended_at or time.perf_counter()) - self.started_at
+
+    def summary(self) -> Dict[str, Any]:
+        """会话的汇总信息：结果、轮次、耗时、Prompt、记忆统计和各阶段的耗时汇总。"""
+        return {
+            "session_id": self.session_id,
+            "finished": self.finished,
+            "turns": self.turn,
+            "elapsed_ms": round(self.elapsed * 1000, 1),
+            "prompt": self.prompt_builder.totals(),
+            "memory": self.memory.stats(),
+            "trace": self.tracer.summary(),
+        }
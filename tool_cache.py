@@ -0,0 +1,106 @@
+"""
+工具结果的记忆化 (memoization)。
+
+Agent 经常在同一个目标内、以及不同目标之间重复发出完全相同的工具调用（同一个算式、同一个搜索词、同一个 URL），
+每次重复都会重新执行，对 SerpAPI 来说每次都是一次付费请求。ToolResultCache 位于 BaseTool.execute 的边界上，
+由 ActionDispatcher 在执行前查询、执行成功后写入。
+
+每个工具通过类属性声明自己的缓存策略（清单 tools/manifest.json 中也会记录，惰性加载的工具无需导入即可判断）：
+    cacheable        是否可以缓存。有副作用的工具（例如 file_writer_tool）必须为 False
+    cache_ttl        缓存有效期（秒），None 表示永不过期
+    cache_normalize  参数中字符串的规范化方式，使等价的调用命中同一条缓存：
+                     exact（不处理）、text（合并空白并忽略大小写）、expression（按 Python 词法切分后用单个空格连接）、
+                     url（协议和域名小写、去掉 #fragment）
+只有 status 为 success 的结果会被缓存，错误总是会重试。
+"""
+import io
+import json
+import os
+import threading
+import tokenize
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from cache import LRUCache
+from mcp.interfaces import BaseTool
+
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "1024"))
+
+
+def _normalize_text(value: str) -> str:
+    return " ".join(value.split()).casefold()
+
+
+def _normalize_expression(value: str) -> str:
+    """
+    只忽略记号之间的空白：'1+2' 与 ' 1 + 2 ' 相同，但 '10 / / 3' 与 '10//3' 是不同的算式。
+    无法切分的输入（例如括号不匹配）只去掉首尾空白。
+    """
+    try:
+        tokens = [tok.string for tok in tokenize.generate_tokens(io.StringIO(value.strip()).readline)
+                  if tok.string]
+    except (tokenize.TokenError, SyntaxError):
+        return value.strip()
+    return " ".join(tokens)
+
+
+def _normalize_url(value: str) -> str:
+    try:
+        parts = urlsplit(value.strip())
+    except ValueError:
+        return value.strip()
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", parts.query, ""))
+
+
+NORMALIZERS: Dict[str, Callable[[str], str]] = {
+    "exact": lambda value: value,
+    "text": _normalize_text,
+    "expression": _normalize_expression,
+    "url": _normalize_url,
+}
+
+
+class ToolResultCache:
+    """
+    所有会话共享的工具结果 LRU 缓存。键是 (工具名, 规范化后的参数)，过期时间按工具各自的 cache_ttl 计算。
+    除了 LRU 本身的统计，还按工具记录命中、未命中和不可缓存（直接执行）的次数。
+    """
+    def __init__(self, maxsize: int = TOOL_CACHE_SIZE, enabled: bool = TOOL_CACHE_ENABLED):
+        self.enabled = enabled and maxsize > 0
+        self.store = LRUCache(maxsize=maxsize)
+        self._per_tool: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "bypassed": 0})
+        self._lock = threading.Lock()
+
+    def _count(self, tool_name: str, field: str):
+        with self._lock:
+            self._per_tool[tool_name][field] += 1
+
+    def key_for(self, tool: BaseTool, action_input: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+        """按工具的缓存策略计算缓存键；不可缓存的调用返回 None。"""
+        if not self.enabled or not tool.cacheable:
+            self._count(tool.name, "bypassed")
+            return None
+        normalize = NORMALIZERS.get(tool.cache_normalize, NORMALIZERS["exact"])
+        normalized = {name: normalize(value) if isinstance(value, str) else value for name, value in action_input.items()}
+        return tool.name, json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        cached = self.store.get(key)
+        self._count(key[0], "hits" if cached is not None else "misses")
+        # 返回副本，调用方修改结果不会影响缓存
+        return dict(cached) if cached is not None else None
+
+    def put(self, tool: BaseTool, key: Hashable, result: Dict[str, Any]):
+        if isinstance(result, dict) and result.get("status") == "success":
+            self.store.set(key, dict(result), ttl=tool.cache_ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        """LRU 的整体统计，以及每个工具的命中/未命中/不可缓存次数。"""
+        with self._lock:
+            per_tool = {name: dict(counts) for name, counts in self._per_tool.items()}
+        return {"enabled": self.enabled, **self.store.stats(), "tools": per_tool}
+
+    def clear(self):
+        self.store.clear()
@@ -0,0 +1,157 @@
+"""
+按相关性为每个目标挑选工具，缩小每轮 Prompt 中的工具 schema。
+
+Agent 加载工具时把每个工具的名称、描述和参数说明嵌入成向量（与 RAG 共用 get_embeddings()，
+向量进入持久化嵌入缓存，之后启动不需要加载模型）。每个目标开始时用目标文本的向量与之做余弦相似度，
+取最相关的 TOOL_ROUTER_TOP_K 个工具，加上 TOOL_ROUTER_PINNED 中始终保留的工具，写入这个目标的系统提示词。
+选中的工具按注册顺序排列，相同的工具组合得到字节级相同的系统提示词，服务商的前缀缓存仍然可以跨目标命中。
+
+兜底：
+- 模型调用了已注册但没有列出的工具：照常执行，并把该工具补进本目标的工具列表；
+- 模型调用了不存在的工具：本目标剩下的轮次改用全部工具；
+- 嵌入模型不可用：记录警告，所有目标都使用全部工具（与关闭路由相同）。
+
+TOOL_ROUTER_PER_TURN=true 时，每轮还会用上一轮的思考内容再选一次，把新命中的工具补进列表（只增不减，
+避免已经出现在历史中的工具突然消失）。工具列表每变化一次，系统提示词的前缀缓存就失效一次。
+"""
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from mcp.interfaces import BaseTool
+
+logger = logging.getLogger(__name__)
+
+# 每个目标保留的工具数；0 表示关闭路由，所有工具都进入 Prompt
+TOOL_ROUTER_TOP_K = int(os.getenv("TOOL_ROUTER_TOP_K", "0"))
+TOOL_ROUTER_PER_TURN = os.getenv("TOOL_ROUTER_PER_TURN", "false").lower() in ("1", "true", "yes")
+# 总是列出的工具，逗号分隔。系统提示词的规则要求找不到信息时先用 web_surfer_tool，因此默认保留它
+TOOL_ROUTER_PINNED = [name.strip() for name in os.getenv("TOOL_ROUTER_PINNED", "web_surfer_tool").split(",")
+                      if name.strip()]
+
+
+def _default_embeddings():
+    from rag.embeddings import EMBEDDING_MODEL, get_embeddings
+    return get_embeddings(EMBEDDING_MODEL)
+
+
+def tool_text(tool: BaseTool) -> str:
+    """用于嵌入的工具文本：名称、描述和每个参数的说明。"""
+    params = "; ".join(f"{param['name']}: {param.get('description', '')}" for param in tool.parameters)
+    return f"{tool.name.replace('_', ' ')}. {tool.description} {params}".strip()
+
+
+class ToolRouter:
+    """
+    为目标挑选最相关的工具。线程安全：工具向量在 prepare() 中计算一次，之后只读；统计计数在锁内更新。
+    """
+    def __init__(self, tools: Dict[str, BaseTool], top_k: int = TOOL_ROUTER_TOP_K,
+                 per_turn: bool = TOOL_ROUTER_PER_TURN, pinned: Optional[List[str]] = None,
+                 embeddings_factory: Callable[[], Any] = _default_embeddings):
+        self.tools = tools
+        self.top_k = top_k
+        self.per_turn = per_turn
+        self.pinned = [name for name in (TOOL_ROUTER_PINNED if pinned is None else pinned) if name in tools]
+        self._embeddings_factory = embeddings_factory
+        self.embeddings = None
+        self._names: List[str] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._failed = False
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.selections = 0
+        self.expansions = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        """工具数不超过 top_k 时路由没有意义，直接列出全部工具。"""
+        return self.top_k > 0 and len(self.tools) > self.top_k and not self._failed
+
+    def prepare(self) -> bool:
+        """嵌入所有工具的描述。失败时关闭路由并返回 False。"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._vectors is not None:
+                return True
+            try:
+                self.embeddings = self._embeddings_factory()
+                names = list(self.tools)
+                vectors = np.asarray(self.embeddings.embed_documents([tool_text(self.tools[name]) for name in names]),
+                                     dtype=np.float32)
+            except Exception as e:
+                logger.warning("⚠️ Tool router disabled, listing every tool: %s", e)
+                self._failed = True
+                return False
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            self._vectors = vectors / np.where(norms == 0, 1.0, norms)
+            self._names = names
+        return True
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _ranked(self, text: str) -> List[str]:
+        query = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        scores = self._vectors @ (query / norm if norm else query)
+        return [self._names[i] for i in np.argsort(-scores)]
+
+    def _ordered(self, names: set) -> List[str]:
+        # 按注册顺序排列：相同的工具组合总是得到相同的系统提示词
+        return [name for name in self.tools if name in names]
+
+    def select(self, text: str) -> List[str]:
+        """返回与 text 最相关的 top_k 个工具加上固定保留的工具；路由不可用时返回全部工具。"""
+        if not text or not self.prepare():
+            return list(self.tools)
+        try:
+            chosen = set(self._ranked(text)[:self.top_k]) | set(self.pinned)
+        except Exception as e:
+            logger.warning("⚠️ Tool routing failed, listing every tool: %s", e)
+            return list(self.tools)
+        self._count("selections")
+        return self._ordered(chosen)
+
+    def expand(self, current: List[str], text: str) -> List[str]:
+        """每轮选择：把与 text 最相关的 top_k 个工具并入当前列表（只增不减）。"""
+        if not self.per_turn or not text or len(current) >= len(self.tools) or not self.prepare():
+            return current
+        try:
+            added = set(self._ranked(text)[:self.top_k]) - set(current)
+        except Exception as e:
+            logger.warning("⚠️ Tool routing failed: %s", e)
+            return current
+        if not added:
+            return current
+        self._count("expansions")
+        return self._ordered(set(current) | added)
+
+    def resolve(self, current: List[str], requested: List[str]) -> List[str]:
+        """
+        模型请求的工具不在当前列表中时的兜底：已注册的工具补进列表，不存在的工具则改用全部工具。
+        """
+        missing = [name for name in requested if isinstance(name, str) and name and name not in current]
+        if not missing:
+            return current
+        self._count("fallbacks")
+        if any(name not in self.tools for name in missing):
+            logger.info("🧭 Model asked for unknown tool(s) %s, listing every tool from now on.", missing)
+            return list(self.tools)
+        logger.info("🧭 Model used unlisted tool(s) %s, adding them to the tool list.", missing)
+        return self._ordered(set(current) | set(missing))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "top_k": self.top_k,
+            "tools": len(self.tools),
+            "selections": self.selections,
+            "expansions": self.expansions,
+            "fallbacks": self.fallbacks,
+        }
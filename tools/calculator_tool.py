@@ -3,6 +3,10 @@ from typing import Dict, Any
 from mcp.interfaces import BaseTool
 
 class CalculatorTool(BaseTool):
+    # 纯函数：相同的算式（忽略空白）总是得到相同的结果
+    cacheable = True
+    cache_normalize = "expression"
+
     def __init__(self):
         name = "calculator_tool"
         description = "一个用于执行数学计算的工具。适用于任何需要加、减、乘、除等数学运算的场景。"
@@ -0,0 +1,101 @@
+# tools/fake_web.py
+"""
+离线的网页与搜索替身，设置 FAKE_WEB=1 后生效。
+
+- FakeGoogleSearch: 与 serpapi.GoogleSearch 接口相同，按查询确定性地生成搜索结果。
+- FakeWebAdapter:   挂载到共享 Fetcher 的 requests.Session 上，任何 URL 都返回确定性生成的 HTML 页面
+                    （带 ETag 和 Cache-Control，因此也会走 HTTP 缓存逻辑）。
+
+页面内容只取决于 URL，延迟可通过 FAKE_WEB_LATENCY_MS 注入，用于在 CI 中离线压测完整的工具链路。
+"""
+import hashlib
+import io
+import os
+import time
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+from requests.adapters import BaseAdapter
+from requests.models import PreparedRequest, Response
+from requests.structures import CaseInsensitiveDict
+from urllib3.response import HTTPResponse
+
+FAKE_WEB = os.getenv("FAKE_WEB", "0") == "1"
+FAKE_WEB_LATENCY_MS = float(os.getenv("FAKE_WEB_LATENCY_MS", "0"))
+FAKE_WEB_HOST = "fake-web.local"
+# 每个假页面的段落数，控制页面大小
+FAKE_WEB_PARAGRAPHS = int(os.getenv("FAKE_WEB_PARAGRAPHS", "20"))
+
+_WORDS = ("agent tool search page memory model index vector query result cache latency throughput "
+          "prompt token context retrieval browser document link answer").split()
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _words(seed: str, count: int) -> str:
+    digest = _digest(seed)
+    return " ".join(_WORDS[(int(digest[i % 40], 16) + i) % len(_WORDS)] for i in range(count))
+
+
+def fake_page(url: str, paragraphs: int = FAKE_WEB_PARAGRAPHS) -> str:
+    """根据 URL 确定性地生成一个 HTML 页面，包含正文段落、脚本/样式噪声和指向其他假页面的链接。"""
+    key = _digest(url)[:8]
+    body = "\n".join(f"<p>{_words(f'{url}#{i}', 40)}</p>" for i in range(paragraphs))
+    links = "\n".join(f'<a href="https://{FAKE_WEB_HOST}/pages/{key}-{i}">Related {i}</a>' for i in range(5))
+    return (f"<html><head><meta charset=\"utf-8\"><title>Fake page {key}</title>"
+            f"<style>body {{ color: #333; }}</style></head><body><h1>Fake page {key}</h1>\n"
+            f"{body}\n<nav>{links}</nav><script>console.log('ignored');</script></body></html>")
+
+
+class FakeGoogleSearch:
+    """serpapi.GoogleSearch 的离线替身：get_dict() 返回结构相同的确定性结果。"""
+    def __init__(self, params: Dict[str, Any]):
+        self.params = params
+
+    def get_dict(self) -> Dict[str, Any]:
+        if FAKE_WEB_LATENCY_MS:
+            time.sleep(FAKE_WEB_LATENCY_MS / 1000)
+        query = self.params.get("q", "")
+        key = _digest(query)[:8]
+        return {"organic_results": [
+            {
+                "title": f"Result {i} for {query}",
+                "link": f"https://{FAKE_WEB_HOST}/pages/{key}-{i}",
+                "snippet": _words(f"{query}#{i}", 20),
+            }
+            for i in range(5)
+        ]}
+
+
+class FakeWebAdapter(BaseAdapter):
+    """requests 的传输适配器：不访问网络，为任何 GET 请求返回 fake_page(url)。"""
+    def send(self, request: PreparedRequest, stream: bool = False, timeout: Any = None,
+             verify: Any = True, cert: Any = None, proxies: Any = None) -> Response:
+        if FAKE_WEB_LATENCY_MS:
+            time.sleep(FAKE_WEB_LATENCY_MS / 1000)
+        path = urlsplit(request.url).path
+        etag = f'"{_digest(request.url)[:16]}"'
+        if path.endswith("/404"):
+            status, body = 404, b"<html><body>Not Found</body></html>"
+        elif request.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        else:
+            status, body = 200, fake_page(request.url).encode("utf-8")
+
+        headers = {"Content-Type": "text/html; charset=utf-8", "Content-Length": str(len(body)),
+                   "ETag": etag, "Cache-Control": "max-age=60"}
+        response = Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=status, preload_content=False)
+        response.url = request.url
+        response.request = request
+        response.reason = {200: "OK", 304: "Not Modified", 404: "Not Found"}[status]
+        response.encoding = "utf-8"
+        return response
+
+    def close(self):
+        pass
+
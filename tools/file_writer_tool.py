@@ -6,6 +6,11 @@ from mcp.interfaces import BaseTool
 DEFAULT_OUTPUT_PATH = "./workplace"
 
 class FileWriterTool(BaseTool):
+    # 写文件有副作用，同一时间只允许一个写入，避免并行行动互相覆盖
+    max_concurrency = 1
+    # 每次调用都必须真正写入磁盘，结果绝不能被缓存
+    cacheable = False
+
     def __init__(self):
         name = "file_writer_tool"
         description = "一个用于将内容写入本地文件的工具。可以指定一个可选的文件路径（route），如果不指定，将写入默认的 'output' 文件夹。"
@@ -0,0 +1,174 @@
+# tools/html_text.py
+"""
+流式、有上限的网页可见文本提取。
+
+正文按块解码并喂给增量式 HTML 解析器，一旦收集到足够的单词（或达到字节上限）就立即停止，
+不需要先下载完整页面、做全文编码探测、再构建完整的 DOM 树。
+安装了 lxml 时使用 lxml 的增量解析器，否则退回到标准库的 html.parser。
+"""
+import codecs
+import re
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from requests.compat import chardet
+
+try:
+    from lxml import etree as _lxml_etree
+except ImportError:  # lxml 是可选依赖
+    _lxml_etree = None
+
+# 这些标签中的内容对读者不可见
+SKIP_TAGS = {"script", "style", "noscript", "template"}
+# 用于确定编码的采样大小：只对开头这一段做 <meta charset> 嗅探和编码探测
+SNIFF_BYTES = 32 * 1024
+_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+
+class _TextCollector:
+    """收集可见文本，并在单词数超过上限时标记完成。同时充当 lxml 解析器的 target。"""
+    def __init__(self, word_limit: int):
+        self.word_limit = word_limit
+        self.parts = []
+        self.words = 0
+        self.done = False
+        self._skip_depth = 0
+
+    def start(self, tag: str, attrib: Any = None):
+        if tag.lower() in SKIP_TAGS:
+            self._skip_depth += 1
+
+    def end(self, tag: str):
+        if tag.lower() in SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def data(self, text: str):
+        if self._skip_depth or self.done:
+            return
+        self.parts.append(text)
+        # 块边界可能把一个单词切成两半，这里的计数只用于决定何时停止，最终结果会重新精确切分
+        self.words += len(text.split())
+        if self.words > self.word_limit:
+            self.done = True
+
+    def close(self):
+        return None
+
+    def result(self, truncated: bool) -> str:
+        text = "".join(self.parts)
+        words = text.split()
+        if truncated or len(words) > self.word_limit:
+            return " ".join(words[:self.word_limit]) + "..."
+        lines = (line.strip() for line in text.splitlines())
+        return "\n".join(line for line in lines if line)
+
+
+class _StdlibParser(HTMLParser):
+    def __init__(self, collector: _TextCollector):
+        super().__init__(convert_charrefs=True)
+        self._collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self._collector.start(tag)
+
+    def handle_endtag(self, tag):
+        self._collector.end(tag)
+
+    def handle_data(self, data):
+        self._collector.data(data)
+
+
+def _make_parser(collector: _TextCollector, parser: str):
+    if parser == "lxml" or (parser == "auto" and _lxml_etree is not None):
+        if _lxml_etree is None:
+            raise ImportError("lxml is not installed.")
+        return _lxml_etree.HTMLParser(target=collector, recover=True)
+    return _StdlibParser(collector)
+
+
+def _detect_encoding(sample: bytes, declared: Optional[str]) -> str:
+    """依次使用：声明的编码 -> <meta charset> -> UTF-8（如果采样是合法的 UTF-8）-> 对采样做编码探测。"""
+    for candidate in (declared, sniff_meta_charset(sample)):
+        if candidate:
+            try:
+                codecs.lookup(candidate)
+                return candidate
+            except LookupError:
+                pass
+    try:
+        # final=False：采样末尾被截断的多字节字符不算错误
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return chardet.detect(sample).get("encoding") or "utf-8"
+
+
+def sniff_meta_charset(sample: bytes) -> Optional[str]:
+    match = _CHARSET_RE.search(sample[:4096])
+    return match.group(1).decode("ascii") if match else None
+
+
+def extract_visible_text(chunks: Iterable[bytes], word_limit: int, max_bytes: int,
+                         declared_encoding: Optional[str] = None, parser: str = "auto") -> Tuple[str, Dict[str, Any]]:
+    """
+    从 HTML 字节块流中提取可见文本。
+
+    收集到 word_limit 个以上的单词、或已读取 max_bytes 字节时立即停止读取。
+    返回 (文本, 统计信息)，统计信息包含实际读取的字节数、是否被截断以及使用的解析器。
+    """
+    collector = _TextCollector(word_limit)
+    html_parser = _make_parser(collector, parser)
+    decoder = None
+    pending = b""
+    bytes_read = 0
+    truncated = False
+
+    def feed(data: bytes, final: bool = False):
+        text = decoder.decode(data, final=final)
+        if text:
+            html_parser.feed(text)
+
+    for chunk in chunks:
+        if bytes_read + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - bytes_read]
+            truncated = True
+        bytes_read += len(chunk)
+
+        if decoder is None:
+            # 先攒够一段采样再确定编码
+            pending += chunk
+            if len(pending) < SNIFF_BYTES and not truncated:
+                continue
+            decoder = codecs.getincrementaldecoder(_detect_encoding(pending, declared_encoding))(errors="replace")
+            chunk, pending = pending, b""
+
+        feed(chunk)
+        if collector.done or truncated:
+            truncated = True
+            break
+
+    if decoder is None:
+        decoder = codecs.getincrementaldecoder(_detect_encoding(pending, declared_encoding))(errors="replace")
+        feed(pending, final=True)
+    elif not truncated:
+        feed(b"", final=True)
+    try:
+        html_parser.close()
+    except Exception:
+        pass  # 提前停止时文档是不完整的，解析器收尾时可能报错，已收集的文本仍然有效
+
+    stats = {
+        "bytes_read": bytes_read,
+        "truncated": truncated or collector.done,
+        "parser": "lxml" if not isinstance(html_parser, _StdlibParser) else "html.parser",
+    }
+    return collector.result(truncated or collector.done), stats
+
+
+def declared_charset(content_type: str) -> Optional[str]:
+    """从 Content-Type 响应头中取出 charset。"""
+    for part in content_type.split(";"):
+        key, _, value = part.strip().partition("=")
+        if key.lower() == "charset" and value:
+            return value.strip('"\'')
+    return None
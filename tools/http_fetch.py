@@ -0,0 +1,579 @@
+# tools/http_fetch.py
+"""
+网页工具共享的 HTTP 获取层。
+
+- 连接池：所有请求复用同一个 requests.Session，省去重复的 DNS/TCP/TLS 握手。
+- 响应缓存：内存 LRU（可选落盘），遵守 Cache-Control / Expires，并用 ETag / Last-Modified 做条件请求。
+- 大小限制：单个响应体、内存缓存和落盘缓存都有字节上限；落盘的条目还有最长保留时间，按修改时间淘汰。
+- 单飞 (single-flight)：同一 URL 的并发请求（fetch 和 stream）只会真正发出一次，其余请求等待并共享结果。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import chardet
+from requests.structures import CaseInsensitiveDict
+
+from tools.fake_web import FAKE_WEB, FakeWebAdapter
+from tools.html_text import declared_charset, sniff_meta_charset
+
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7',
+}
+
+DEFAULT_TIMEOUT = 15
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+# 单个响应体的最大字节数，超出部分会被截断（截断的响应不会进入缓存）
+MAX_BODY_BYTES = int(os.getenv("HTTP_MAX_BODY_BYTES", str(5 * 1024 * 1024)))
+# 内存缓存的总字节上限
+CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 服务器没有给出任何缓存指令时的启发式新鲜期（秒）
+CACHE_DEFAULT_TTL = float(os.getenv("HTTP_CACHE_DEFAULT_TTL", "300"))
+# 设置后，缓存条目会同时写入该目录，进程重启后仍可复用
+CACHE_DIR = os.getenv("HTTP_CACHE_DIR")
+# 落盘缓存的总字节上限，以及条目的最长保留时间（秒，<= 0 表示不按时间淘汰）
+CACHE_DIR_MAX_BYTES = int(os.getenv("HTTP_CACHE_DIR_MAX_BYTES", str(512 * 1024 * 1024)))
+CACHE_DIR_MAX_AGE = float(os.getenv("HTTP_CACHE_DIR_MAX_AGE", str(7 * 24 * 3600)))
+# 按时间淘汰时两次扫描目录之间的最短间隔（秒）
+CACHE_DIR_PRUNE_INTERVAL = 600
+
+CACHEABLE_STATUS = {200, 203, 300, 301, 308, 404, 410}
+
+
+@dataclass
+class FetchResult:
+    """一次获取的结果。接口尽量与 requests.Response 保持一致，方便工具迁移。"""
+    url: str
+    status_code: int
+    headers: CaseInsensitiveDict
+    content: bytes
+    from_cache: bool = False
+    truncated: bool = False
+    reason: str = ""
+
+    @property
+    def encoding(self) -> Optional[str]:
+        """优先使用 Content-Type 中声明的编码，其次是 HTML <meta charset>。"""
+        return declared_charset(self.headers.get("Content-Type", "")) or sniff_meta_charset(self.content)
+
+    @property
+    def text(self) -> str:
+        encoding = self.encoding
+        if encoding:
+            try:
+                return self.content.decode(encoding, errors="replace")
+            except LookupError:
+                pass
+        try:
+            return self.content.decode("utf-8")
+        except UnicodeDecodeError:
+            detected = chardet.detect(self.content).get("encoding") or "utf-8"
+            return self.content.decode(detected, errors="replace")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error: {self.reason or 'HTTP error'} for url: {self.url}")
+
+
+@dataclass
+class _CacheEntry:
+    url: str
+    status_code: int
+    headers: Dict[str, str]
+    content: bytes
+    stored_at: float
+    expires_at: float
+    must_revalidate: bool = False
+    reason: str = ""
+
+    @property
+    def etag(self) -> Optional[str]:
+        return CaseInsensitiveDict(self.headers).get("ETag")
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        return CaseInsensitiveDict(self.headers).get("Last-Modified")
+
+    def is_fresh(self) -> bool:
+        return not self.must_revalidate and time.time() < self.expires_at
+
+    def to_result(self) -> FetchResult:
+        return FetchResult(self.url, self.status_code, CaseInsensitiveDict(self.headers), self.content,
+                           from_cache=True, reason=self.reason)
+
+
+def _parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    for part in value.split(","):
+        key, _, arg = part.strip().partition("=")
+        if key:
+            directives[key.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _freshness(headers: CaseInsensitiveDict, now: float) -> Optional[Tuple[float, bool]]:
+    """
+    根据响应头计算 (expires_at, must_revalidate)。返回 None 表示响应不可缓存 (no-store)。
+    """
+    cc = _parse_cache_control(headers.get("Cache-Control", ""))
+    if "no-store" in cc:
+        return None
+    must_revalidate = "no-cache" in cc
+    max_age = cc.get("s-maxage") or cc.get("max-age")
+    if max_age is not None:
+        try:
+            ttl = max(0.0, float(max_age))
+        except ValueError:
+            ttl = 0.0
+    elif headers.get("Expires"):
+        try:
+            ttl = max(0.0, parsedate_to_datetime(headers["Expires"]).timestamp() - now)
+        except (TypeError, ValueError):
+            ttl = 0.0
+    else:
+        ttl = CACHE_DEFAULT_TTL
+    return now + ttl, must_revalidate
+
+
+class _ResponseCache:
+    """
+    按字节数限制大小的内存 LRU 缓存，可选落盘。落盘的条目超过总字节上限或最长保留时间后按修改时间淘汰
+    （从磁盘读取条目时会刷新修改时间，因此淘汰的是最久没有使用的条目）。
+    """
+    def __init__(self, max_bytes: int, cache_dir: Optional[str] = None, disk_max_bytes: int = CACHE_DIR_MAX_BYTES,
+                 disk_max_age: float = CACHE_DIR_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_age = disk_max_age if disk_max_age > 0 else None
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 落盘缓存的字节数：写入时累加（覆盖同一条目会略微高估），每次淘汰扫描目录后校正
+        self._disk_bytes = 0
+        self._last_prune = 0.0
+        self._disk_lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._prune_disk()
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def get(self, url: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+                return entry
+        return self._load_from_disk(url)
+
+    def put(self, entry: _CacheEntry):
+        if self._insert(entry):
+            self._save_to_disk(entry)
+
+    def _insert(self, entry: _CacheEntry) -> bool:
+        size = len(entry.content)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(entry.url, None)
+            if old is not None:
+                self._bytes -= len(old.content)
+            self._entries[entry.url] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.content)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+        if self.cache_dir:
+            stats["disk_bytes"] = self._disk_bytes
+        return stats
+
+    def _paths(self, url: str):
+        key = self._key(url)
+        return os.path.join(self.cache_dir, f"{key}.json"), os.path.join(self.cache_dir, f"{key}.body")
+
+    def _save_to_disk(self, entry: _CacheEntry):
+        if not self.cache_dir:
+            return
+        meta_path, body_path = self._paths(entry.url)
+        try:
+            # 正文和元数据都先写临时文件再原子替换：并发的读者要么读到旧文件，要么读到完整的新文件；
+            # 元数据记录正文的哈希，读者拿到的元数据和正文不属于同一次写入时视为未命中
+            suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(body_path + suffix, "wb") as f:
+                f.write(entry.content)
+            os.replace(body_path + suffix, body_path)
+            meta = {k: v for k, v in entry.__dict__.items() if k != "content"}
+            meta = json.dumps({**meta, "body_sha256": hashlib.sha256(entry.content).hexdigest()})
+            with open(meta_path + suffix, "w", encoding="utf-8") as f:
+                f.write(meta)
+            os.replace(meta_path + suffix, meta_path)
+        except OSError:
+            return
+        with self._disk_lock:
+            self._disk_bytes += len(entry.content) + len(meta)
+            due = self._disk_bytes > self.disk_max_bytes or (
+                self.disk_max_age is not None and time.time() - self._last_prune > CACHE_DIR_PRUNE_INTERVAL)
+        if due:
+            self._prune_disk()
+
+    def _disk_entries(self) -> List[Tuple[float, int, str]]:
+        """落盘的条目：(最近修改时间, 字节数, 键)，元数据和正文两个文件合并计算。"""
+        entries: Dict[str, Tuple[float, int]] = {}
+        try:
+            with os.scandir(self.cache_dir) as files:
+                for file in files:
+                    key, ext = os.path.splitext(file.name)
+                    if ext not in (".json", ".body"):
+                        continue
+                    try:
+                        st = file.stat()
+                    except OSError:
+                        continue
+                    mtime, size = entries.get(key, (0.0, 0))
+                    entries[key] = (max(mtime, st.st_mtime), size + st.st_size)
+        except OSError:
+            return []
+        return [(mtime, size, key) for key, (mtime, size) in entries.items()]
+
+    def _prune_disk(self):
+        """删除超过最长保留时间的条目，再从最旧的开始删除，直到总大小降到上限的 90% 以下（避免每次写入都扫描）。"""
+        with self._disk_lock:
+            now = time.time()
+            self._last_prune = now
+            entries = sorted(self._disk_entries())
+            total = sum(size for _, size, _ in entries)
+            target = self.disk_max_bytes * 0.9 if total > self.disk_max_bytes else total
+            for mtime, size, key in entries:
+                expired = self.disk_max_age is not None and now - mtime > self.disk_max_age
+                if not expired and total <= target:
+                    break
+                for suffix in (".json", ".body"):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, key + suffix))
+                    except OSError:
+                        pass
+                total -= size
+            self._disk_bytes = total
+
+    def _load_from_disk(self, url: str) -> Optional[_CacheEntry]:
+        if not self.cache_dir:
+            return None
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                content = f.read()
+            digest = meta.pop("body_sha256", None)
+            if digest is not None and digest != hashlib.sha256(content).hexdigest():
+                return None
+            os.utime(meta_path)  # 刷新修改时间，淘汰时视为最近使用
+        except (OSError, ValueError):
+            return None
+        entry = _CacheEntry(content=content, **meta)
+        self._insert(entry)
+        return entry
+
+
+class _BodyIterator:
+    """
+    按块产出响应正文，最多 max_bytes 字节，并记录已经读取的内容。
+    只有在服务器的正文被完整读完时才调用 on_complete（用于写缓存）；被截断或读取出错的正文不会被缓存，
+    出错之后的每次读取都会重新抛出同一个异常。调用者提前停止迭代后，可以用 drain() 读完剩余的正文。
+    """
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, response: requests.Response, max_bytes: int, on_complete: Callable[[bytes], None]):
+        self._chunks = response.iter_content(chunk_size=self.CHUNK_SIZE)
+        self._max_bytes = max_bytes
+        self._on_complete = on_complete
+        self._read_chunks: List[bytes] = []
+        self._size = 0
+        self.completed = False
+        self.truncated = False
+        self.error: Optional[BaseException] = None
+
+    @property
+    def content(self) -> bytes:
+        return b"".join(self._read_chunks)
+
+    def _read(self) -> Optional[bytes]:
+        """读取下一块；正文已经读完或超出大小上限时返回 None。"""
+        if self.error is not None:
+            raise self.error
+        if self.completed or self.truncated:
+            return None
+        try:
+            chunk = next(self._chunks, None)
+        except BaseException as e:
+            # 例如 ChunkedEncodingError：生成器已经结束，之后的 next 会返回 None，不能把它当成正文读完
+            self.error = e
+            raise
+        if chunk is None:
+            self.completed = True
+            self._on_complete(self.content)
+            return None
+        if self._size + len(chunk) > self._max_bytes:
+            chunk = chunk[:self._max_bytes - self._size]
+            self.truncated = True
+        self._read_chunks.append(chunk)
+        self._size += len(chunk)
+        return chunk
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self._read()
+            if chunk is None:
+                return
+            yield chunk
+
+    def drain(self) -> bytes:
+        """读完剩余的正文（仍受大小上限限制），返回已经读取的全部内容。"""
+        while self._read() is not None:
+            pass
+        return self.content
+
+
+class StreamedResponse:
+    """Fetcher.stream 产出的流式响应：先有状态码和响应头，正文通过 iter_content 逐块读取。"""
+    def __init__(self, url: str, status_code: int, headers: CaseInsensitiveDict, reason: str,
+                 body: Iterable[bytes], from_cache: bool = False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.reason = reason
+        self.from_cache = from_cache
+        self._body = body
+
+    @classmethod
+    def from_result(cls, result: FetchResult) -> "StreamedResponse":
+        chunk_size = _BodyIterator.CHUNK_SIZE
+        chunks = (result.content[i:i + chunk_size] for i in range(0, len(result.content), chunk_size))
+        return cls(result.url, result.status_code, result.headers, result.reason, chunks, result.from_cache)
+
+    def iter_content(self) -> Iterator[bytes]:
+        return iter(self._body)
+
+    def raise_for_status(self):
+        FetchResult(self.url, self.status_code, self.headers, b"", reason=self.reason).raise_for_status()
+
+
+class _Flight:
+    """一个进行中的请求，供同一 URL 的其他调用者等待。"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[FetchResult] = None
+        self.error: Optional[BaseException] = None
+
+
+class Fetcher:
+    """带连接池、响应缓存和单飞去重的 HTTP GET 客户端。线程安全。"""
+    def __init__(self, pool_size: int = POOL_SIZE, max_body_bytes: int = MAX_BODY_BYTES,
+                 cache_max_bytes: int = CACHE_MAX_BYTES, cache_dir: Optional[str] = CACHE_DIR,
+                 headers: Optional[Dict[str, str]] = None):
+        self.session = requests.Session()
+        # FAKE_WEB=1 时所有请求都由离线的假网页适配器响应（用于基准测试和 CI）
+        adapter = FakeWebAdapter() if FAKE_WEB else HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(headers or BROWSER_HEADERS)
+        self.max_body_bytes = max_body_bytes
+        self.cache = _ResponseCache(cache_max_bytes, cache_dir)
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        # stream() 的调用者提前停止读取时，剩余的正文在这里读完并写入缓存
+        self._drainer = ThreadPoolExecutor(max_workers=4, thread_name_prefix="http-drain")
+        self.metrics = {"requests": 0, "cache_hits": 0, "revalidated": 0, "deduplicated": 0}
+        self._metrics_lock = threading.Lock()
+
+    def _count(self, metric: str):
+        with self._metrics_lock:
+            self.metrics[metric] += 1
+
+    def fetch(self, url: str, timeout: float = DEFAULT_TIMEOUT) -> FetchResult:
+        """获取 URL。新鲜的缓存直接返回；过期的缓存会带上条件请求头重新验证。"""
+        entry = self.cache.get(url)
+        if entry is not None and entry.is_fresh():
+            self._count("cache_hits")
+            return entry.to_result()
+
+        flight, leader = self._join_flight(url)
+        if not leader:
+            return self._wait_flight(flight)
+
+        try:
+            result = self._fetch_and_store(url, entry, timeout)
+        except BaseException as e:
+            self._land_flight(url, flight, error=e)
+            raise
+        self._land_flight(url, flight, result=result)
+        return result
+
+    @contextmanager
+    def stream(self, url: str, timeout: float = DEFAULT_TIMEOUT) -> Iterator["StreamedResponse"]:
+        """
+        以流的方式打开 URL，响应头先于正文可用。命中新鲜缓存时正文直接从缓存切块产出；
+        否则边下载边产出，调用者可以随时停止读取以节省 CPU。
+        与 fetch() 共用单飞去重：同一 URL 正在获取时等待并复用它的结果。调用者提前停止读取时，
+        剩余的正文在后台读完并写入缓存，等待中的请求和之后的读取都能拿到完整的正文。
+        """
+        entry = self.cache.get(url)
+        if entry is not None and entry.is_fresh():
+            self._count("cache_hits")
+            yield StreamedResponse.from_result(entry.to_result())
+            return
+
+        flight, leader = self._join_flight(url)
+        if not leader:
+            yield StreamedResponse.from_result(self._wait_flight(flight))
+            return
+
+        self._count("requests")
+        try:
+            response = self.session.get(url, headers=self._conditional_headers(entry), timeout=timeout, stream=True)
+        except BaseException as e:
+            self._land_flight(url, flight, error=e)
+            raise
+        now = time.time()
+        if response.status_code == 304 and entry is not None:
+            try:
+                result = self._revalidated(entry, response, now)
+            except BaseException as e:
+                self._land_flight(url, flight, error=e)
+                raise
+            finally:
+                response.close()
+            self._land_flight(url, flight, result=result)
+            yield StreamedResponse.from_result(result)
+            return
+
+        body = self._iter_body(response, on_complete=lambda content: self._store(url, response, content, now))
+        try:
+            yield StreamedResponse(response.url, response.status_code, CaseInsensitiveDict(response.headers),
+                                   response.reason or "", body)
+        finally:
+            if body.completed or body.truncated or body.error is not None:
+                self._finish_stream(url, flight, response, body)
+            else:
+                self._drainer.submit(self._finish_stream, url, flight, response, body)
+
+    def _finish_stream(self, url: str, flight: _Flight, response: requests.Response, body: "_BodyIterator"):
+        """
+        读完正文（完整读完时由 _BodyIterator 写入缓存），把结果交给等待中的请求，然后释放连接。
+        读取出错时等待中的请求拿到同一个异常，而不是不完整的正文。
+        """
+        try:
+            content = body.drain()
+            self._land_flight(url, flight, result=FetchResult(
+                response.url, response.status_code, CaseInsensitiveDict(response.headers), content,
+                truncated=not body.completed, reason=response.reason or ""))
+        except BaseException as e:
+            self._land_flight(url, flight, error=e)
+        finally:
+            response.close()
+
+    def _join_flight(self, url: str) -> Tuple[_Flight, bool]:
+        """返回 (该 URL 的进行中请求, 是否由调用者负责发出请求)。"""
+        with self._flights_lock:
+            flight = self._flights.get(url)
+            leader = flight is None
+            if leader:
+                flight = self._flights[url] = _Flight()
+        if not leader:
+            self._count("deduplicated")
+        return flight, leader
+
+    @staticmethod
+    def _wait_flight(flight: _Flight) -> FetchResult:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _land_flight(self, url: str, flight: _Flight, result: Optional[FetchResult] = None,
+                     error: Optional[BaseException] = None):
+        flight.result, flight.error = result, error
+        with self._flights_lock:
+            self._flights.pop(url, None)
+        flight.done.set()
+
+    @staticmethod
+    def _conditional_headers(entry: Optional[_CacheEntry]) -> Dict[str, str]:
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def _revalidated(self, entry: _CacheEntry, response: requests.Response, now: float) -> FetchResult:
+        """服务器返回 304：内容没有变化，刷新新鲜期并复用缓存的正文。"""
+        self._count("revalidated")
+        merged = CaseInsensitiveDict(entry.headers)
+        merged.update(response.headers)
+        freshness = _freshness(merged, now)
+        if freshness is not None:
+            entry.headers = dict(merged)
+            entry.stored_at = now
+            entry.expires_at, entry.must_revalidate = freshness
+            self.cache.put(entry)
+        return entry.to_result()
+
+    def _store(self, url: str, response: requests.Response, content: bytes, now: float):
+        freshness = _freshness(CaseInsensitiveDict(response.headers), now)
+        if freshness is not None and response.status_code in CACHEABLE_STATUS:
+            expires_at, must_revalidate = freshness
+            self.cache.put(_CacheEntry(url, response.status_code, dict(response.headers), content, now,
+                                       expires_at, must_revalidate, response.reason or ""))
+
+    def _fetch_and_store(self, url: str, entry: Optional[_CacheEntry], timeout: float) -> FetchResult:
+        self._count("requests")
+        with self.session.get(url, headers=self._conditional_headers(entry), timeout=timeout, stream=True) as response:
+            now = time.time()
+            if response.status_code == 304 and entry is not None:
+                return self._revalidated(entry, response, now)
+
+            body = self._iter_body(response, on_complete=lambda content: self._store(url, response, content, now))
+            content = body.drain()
+            return FetchResult(response.url, response.status_code, CaseInsensitiveDict(response.headers),
+                               content, truncated=not body.completed,
+                               reason=response.reason or "")
+
+    def _iter_body(self, response: requests.Response, on_complete: Callable[[bytes], None]) -> "_BodyIterator":
+        return _BodyIterator(response, self.max_body_bytes, on_complete)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.metrics, "cache": self.cache.stats()}
+
+
+_default_fetcher: Optional[Fetcher] = None
+_default_fetcher_lock = threading.Lock()
+
+def get_fetcher() -> Fetcher:
+    """返回进程内共享的 Fetcher（惰性创建）。所有网页工具都通过它发起请求。"""
+    global _default_fetcher
+    if _default_fetcher is None:
+        with _default_fetcher_lock:
+            if _default_fetcher is None:
+                _default_fetcher = Fetcher()
+    return _default_fetcher
@@ -1,11 +1,15 @@
 # tools/link_extractor_tool.py
-import requests
 from bs4 import BeautifulSoup
 from typing import Dict, Any, Set
 from urllib.parse import urljoin
 from mcp.interfaces import BaseTool
+from tools.http_fetch import get_fetcher
 
 class LinkExtractorTool(BaseTool):
+    cacheable = True
+    cache_ttl = 600.0
+    cache_normalize = "url"
+
     def __init__(self):
         name = "link_extractor_tool"
         description = (
@@ -27,10 +31,8 @@ class LinkExtractorTool(BaseTool):
             return {"status": "error", "message": "缺少 'url' 参数。"}
 
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=15)
+            # 共享的获取层：连接池 + 响应缓存，同一页面随后被 web_browser_tool 读取时无需再次下载
+            response = get_fetcher().fetch(url)
             response.raise_for_status()
 
             soup = BeautifulSoup(response.text, 'html.parser')
@@ -1,15 +1,24 @@
 # tools/rag_tool.py
+import logging
 import os
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, List, Optional, Tuple
 from mcp.interfaces import BaseTool
+from cache import LRUCache
 
-from langchain_huggingface import HuggingFaceEmbeddings as SentenceTransformerEmbeddings
-from langchain_community.vectorstores import Chroma
+logger = logging.getLogger(__name__)
 
 PERSIST_DIRECTORY = "./rag_db"
+# 检索结果缓存的默认配置，可通过 .env 覆盖
+DEFAULT_CACHE_SIZE = int(os.getenv("RAG_CACHE_SIZE", "256"))
+DEFAULT_CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", "600"))  # 单位：秒，<= 0 表示永不过期
 
 class RAGTool(BaseTool):
-    def __init__(self):
+    # 由 Agent 在每个目标开始时自动调用，不出现在 LLM 的工具列表中
+    auto_invoke = True
+
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE, cache_ttl: Optional[float] = DEFAULT_CACHE_TTL,
+                 backend: Optional[str] = None):
         name = "internal_knowledge_retriever"
         description = "从内部知识库检索背景信息的工具。此工具会被自动调用。"
         # 注意：由于此工具是自动调用的，parameters 实际上不会被 LLM 用来“选择”，但保留它是为了接口统一
@@ -22,29 +31,146 @@ class RAGTool(BaseTool):
         ]
         super().__init__(name, description, parameters)
         
-        if not os.path.exists(PERSIST_DIRECTORY):
+        from rag.backends import index_exists
+
+        # 嵌入缓存默认也放在 ./rag_db 下，目录存在不代表索引已经建好
+        if not index_exists(PERSIST_DIRECTORY):
             raise FileNotFoundError(f"RAG数据库 '{PERSIST_DIRECTORY}' 未找到。请先运行 'build_rag_index.py'。")
-            
-        print("RAGTool: 正在加载向量数据库...")
-        embeddings = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
-        db = Chroma(persist_directory=PERSIST_DIRECTORY, embedding_function=embeddings)
-        self.retriever = db.as_retriever(search_kwargs={"k": 2})
-        print("RAGTool: 数据库加载完成，准备就绪。")
-        
+
+        # 向量库后端（chroma / mmap），None 表示按 RAG_BACKEND 或索引清单自动选择，见 rag/backends.py
+        self.backend = backend
+        # 嵌入模型和向量数据库很重（sentence-transformers、Chroma），推迟到第一次检索时才加载
+        self._retriever = None
+        self._retriever_version = None
+        self._embeddings = None
+        self._load_lock = threading.Lock()
+        # 检索缓存：相同的查询（在同一版本的索引上）不再重复做向量嵌入和 Chroma 查询
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl if cache_ttl and cache_ttl > 0 else None)
+
+    @property
+    def retriever(self):
+        """
+        第一次访问时加载嵌入模型、向量数据库和 BM25 索引（线程安全）。
+        索引版本改变（重新运行了 build_rag_index.py）后重新打开集合和 BM25 索引，两者始终来自同一次构建。
+        """
+        version = self._index_version()
+        if self._retriever is None or self._retriever_version != version:
+            with self._load_lock:
+                if self._retriever is None or self._retriever_version != version:
+                    from rag.backends import open_collection, resolve_backend
+                    from rag.embeddings import EMBEDDING_MODEL, get_embeddings
+                    from rag.hybrid import HybridRetriever
+                    from rag.sparse import SPARSE_INDEX_FILENAME, BM25Index
+
+                    if self._retriever is None:
+                        logger.info("RAGTool: 正在加载向量数据库...")
+                        # 与索引器共用同一个嵌入缓存，重复的查询不再经过模型
+                        self._embeddings = get_embeddings(EMBEDDING_MODEL)
+                    else:
+                        logger.info("RAGTool: 索引已更新，重新加载向量数据库和 BM25 索引...")
+                    backend = resolve_backend(PERSIST_DIRECTORY, self.backend)
+                    # 与 build_rag_index.py 写入的集合同名
+                    collection = open_collection(PERSIST_DIRECTORY, backend, "langchain")
+                    sparse_path = os.path.join(PERSIST_DIRECTORY, SPARSE_INDEX_FILENAME)
+                    sparse = BM25Index.load(sparse_path) if os.path.exists(sparse_path) else None
+                    self._retriever = HybridRetriever(collection, self._embeddings, sparse)
+                    self._retriever_version = version
+                    logger.info("RAGTool: 数据库加载完成（后端: %s，检索方式: %s），准备就绪。", backend, self._retriever.mode)
+        return self._retriever
+
+    def warm_up(self):
+        # 访问 retriever 即会触发加载
+        self.retriever
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """规范化查询文本：合并空白并忽略大小写，使等价的查询命中同一缓存条目。"""
+        return " ".join(query.split()).casefold()
+
+    @staticmethod
+    def _index_version() -> int:
+        """
+        返回当前索引的版本号（索引清单的修改时间，每次构建结束时都会重写；旧版本的库没有清单时用 Chroma 文件）。
+        重新运行 build_rag_index.py 后版本号改变，旧的缓存条目自然失效。
+        """
+        for name in ("index_manifest.json", "chroma.sqlite3"):
+            path = os.path.join(PERSIST_DIRECTORY, name)
+            if os.path.exists(path):
+                break
+        else:
+            path = PERSIST_DIRECTORY
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _cache_key(self, query: str, k: Optional[int] = None) -> Tuple[str, int, Optional[int]]:
+        return (self._normalize_query(query), self._index_version(), k)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """返回检索缓存的命中/未命中统计。"""
+        return self.cache.stats()
+
+    def embedding_stats(self) -> Optional[Dict[str, Any]]:
+        """返回嵌入缓存的统计；模型尚未加载或未启用缓存时返回 None。"""
+        stats = getattr(self._embeddings, "stats", None)
+        return stats() if stats else None
+
+    @staticmethod
+    def _format(chunks) -> Dict[str, Any]:
+        context = "\n\n".join(chunk.text for chunk in chunks)
+        return {
+            "retrieved_context": context or "知识库中没有找到相关信息。",
+            "chunks": [{"id": chunk.id, "score": round(chunk.score, 6), "sources": chunk.sources,
+                        "source": chunk.metadata.get("source"), "text": chunk.text} for chunk in chunks],
+        }
+
+    def retrieve_many(self, queries: List[str], k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        批量检索多个查询，返回与 queries 一一对应的 {"query", "retrieved_context", "chunks": [{id, score, ...}]}。
+        缓存未命中的查询一起交给检索器：一次批量嵌入 + 一次向量化检索。出错时抛出异常。
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+        missing: Dict[Tuple[str, int, Optional[int]], List[int]] = {}
+        for i, query in enumerate(queries):
+            key = self._cache_key(query, k)
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[i] = {"query": query, **cached}
+            else:
+                # 同一批中等价的查询只检索一次
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            positions = list(missing.values())
+            retrieved = self.retriever.retrieve_many([queries[indices[0]] for indices in positions], k)
+            for key, indices, chunks in zip(missing.keys(), positions, retrieved):
+                entry = self._format(chunks)
+                self.cache.set(key, entry)
+                for i in indices:
+                    results[i] = {"query": queries[i], **entry}
+        return results
 
     def execute(self, **kwargs: Any) -> Dict[str, Any]:
-        """从向量数据库中检索相关信息，只返回文本块内容。"""
+        """混合检索（向量 + BM25）相关信息，只返回文本块内容。"""
         query = kwargs.get("query")
         if not query:
             return {"status": "success", "retrieved_context": "No query provided for retrieval."}
-        
         try:
-            retrieved_docs = self.retriever.get_relevant_documents(query)
-            context = "\n\n".join([doc.page_content for doc in retrieved_docs])
-            
-            if not context:
-                return {"status": "success", "retrieved_context": "知识库中没有找到相关信息。"}
-            
-            return {"status": "success", "retrieved_context": context}
+            result = self.retrieve_many([query])[0]
+            return {"status": "success", "retrieved_context": result["retrieved_context"]}
+        except Exception as e:
+            return {"status": "error", "message": f"检索时出错: {str(e)}"}
+
+    def execute_batch(self, **kwargs: Any) -> Dict[str, Any]:
+        """
+        一次检索多个查询（例如一个目标拆出的多个子问题）。
+        参数 queries 为字符串列表，可选 k；返回 {"status", "results": [...]}，每个结果带各文本块的得分。
+        """
+        queries = [query for query in kwargs.get("queries") or [] if query]
+        if not queries:
+            return {"status": "success", "results": []}
+        try:
+            return {"status": "success", "results": self.retrieve_many(queries, kwargs.get("k"))}
         except Exception as e:
-            return {"status": "error", "message": f"检索时出错: {str(e)}"}
\ No newline at end of file
+            return {"status": "error", "message": f"检索时出错: {str(e)}"}
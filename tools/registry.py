@@ -0,0 +1,244 @@
+# tools/registry.py
+"""
+基于清单 (manifest) 的工具注册表。
+
+tools/manifest.json 记录了每个工具的名称、描述、参数以及实现所在的模块和类。
+Agent 启动时只读取这个 JSON 文件就能拿到所有工具的 schema，真正的模块导入（以及模型加载）
+推迟到工具第一次被调用时才发生。没有出现在清单中的 *_tool.py 仍会被立即导入，保证“放进 tools/ 就能用”。
+
+重新生成清单: python -m tools.registry --write-manifest
+"""
+import argparse
+import importlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+
+from mcp.interfaces import BaseTool
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+@dataclass
+class ToolSpec:
+    """清单中的一条工具记录。"""
+    name: str
+    description: str
+    parameters: List[Dict[str, Any]]
+    module: str
+    class_name: str
+    auto_invoke: bool = False
+    max_concurrency: int = BaseTool.max_concurrency
+    cacheable: bool = BaseTool.cacheable
+    cache_ttl: Optional[float] = BaseTool.cache_ttl
+    cache_normalize: str = BaseTool.cache_normalize
+
+    @classmethod
+    def from_tool(cls, tool: BaseTool) -> "ToolSpec":
+        return cls(
+            name=tool.name,
+            description=tool.description,
+            parameters=tool.parameters,
+            module=type(tool).__module__,
+            class_name=type(tool).__name__,
+            auto_invoke=tool.auto_invoke,
+            max_concurrency=tool.max_concurrency,
+            cacheable=tool.cacheable,
+            cache_ttl=tool.cache_ttl,
+            cache_normalize=tool.cache_normalize,
+        )
+
+
+class LazyTool(BaseTool):
+    """
+    工具的惰性代理。schema 来自清单，第一次 execute 时才导入模块并实例化真正的工具。
+    加载失败会被记住，之后的调用直接返回同样的错误，不会反复尝试导入。
+    """
+    def __init__(self, spec: ToolSpec):
+        super().__init__(spec.name, spec.description, spec.parameters)
+        self.spec = spec
+        self.auto_invoke = spec.auto_invoke
+        self.max_concurrency = spec.max_concurrency
+        # 缓存策略来自清单，ActionDispatcher 不需要加载工具就能判断结果是否可以缓存
+        self.cacheable = spec.cacheable
+        self.cache_ttl = spec.cache_ttl
+        self.cache_normalize = spec.cache_normalize
+        self._instance: Optional[BaseTool] = None
+        self._load_error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def load(self) -> BaseTool:
+        """导入并实例化真正的工具（线程安全，只执行一次）。"""
+        if self._instance is not None:
+            return self._instance
+        with self._lock:
+            if self._instance is None:
+                if self._load_error is not None:
+                    raise self._load_error
+                start = time.perf_counter()
+                try:
+                    module = importlib.import_module(self.spec.module)
+                    self._instance = getattr(module, self.spec.class_name)()
+                except Exception as e:
+                    self._load_error = e
+                    raise
+                finally:
+                    self.load_seconds = time.perf_counter() - start
+        return self._instance
+
+    def execute(self, **kwargs: Any) -> Dict[str, Any]:
+        try:
+            tool = self.load()
+        except Exception as e:
+            return {"status": "error", "message": f"加载工具 '{self.name}' 失败: {e}"}
+        return tool.execute(**kwargs)
+
+    async def aexecute(self, **kwargs: Any) -> Dict[str, Any]:
+        try:
+            tool = self.load()
+        except Exception as e:
+            return {"status": "error", "message": f"加载工具 '{self.name}' 失败: {e}"}
+        return await tool.aexecute(**kwargs)
+
+    def warm_up(self):
+        self.load().warm_up()
+
+    def __getattr__(self, item: str) -> Any:
+        # 其余属性（例如 RAGTool.cache_stats）转发给真正的工具
+        if item.startswith("_") or item in ("spec",):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+
+def _manifest_path(package_path: str) -> str:
+    return os.path.join(package_path, MANIFEST_FILENAME)
+
+
+def read_manifest(package_path: str) -> List[ToolSpec]:
+    path = _manifest_path(package_path)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [ToolSpec(**entry) for entry in json.load(f)]
+
+
+def _tool_modules(package_path: str) -> List[str]:
+    return sorted(f"{package_path}.{filename[:-3]}" for filename in os.listdir(package_path)
+                  if filename.endswith("_tool.py"))
+
+
+def _tool_classes(module: Any) -> List[type]:
+    """模块中定义的所有 BaseTool 子类（不包括从别处导入的）。"""
+    return [obj for _, obj in inspect.getmembers(module, inspect.isclass)
+            if issubclass(obj, BaseTool) and obj is not BaseTool and obj.__module__ == module.__name__]
+
+
+def _instantiate_module_tools(module_name: str) -> List[BaseTool]:
+    return [cls() for cls in _tool_classes(importlib.import_module(module_name))]
+
+
+def load_tools(package_path: str) -> List[BaseTool]:
+    """
+    加载 package_path 下的所有工具：清单中的工具返回惰性代理，不在清单中的工具立即导入。
+    """
+    if not os.path.exists(package_path):
+        return []
+    specs = read_manifest(package_path)
+    tools: List[BaseTool] = [LazyTool(spec) for spec in specs]
+    known_modules = {spec.module for spec in specs}
+    for module_name in _tool_modules(package_path):
+        if module_name in known_modules:
+            continue
+        try:
+            tools.extend(_instantiate_module_tools(module_name))
+        except Exception as e:
+            logger.warning("⚠️ Error loading tool from %s: %s", module_name, e)
+    return tools
+
+
+def write_manifest(package_path: str) -> List[ToolSpec]:
+    """导入所有工具并把它们的 schema 写入清单。无法实例化的工具保留清单中原有的记录。"""
+    existing = {spec.module: spec for spec in read_manifest(package_path)}
+    specs: List[ToolSpec] = []
+    for module_name in _tool_modules(package_path):
+        try:
+            specs.extend(ToolSpec.from_tool(tool) for tool in _instantiate_module_tools(module_name))
+        except Exception as e:
+            logger.warning("⚠️ Error loading tool from %s: %s", module_name, e)
+            if module_name in existing:
+                specs.append(existing[module_name])
+    with open(_manifest_path(package_path), "w", encoding="utf-8") as f:
+        json.dump([asdict(spec) for spec in specs], f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    return specs
+
+
+def profile_startup(package_path: str) -> List[Dict[str, Any]]:
+    """
+    逐个工具测量启动开销：读取清单、导入模块、实例化、预热（加载模型等）。
+    注意：模块导入的耗时包含它第一次引入的所有依赖，先导入的工具会“承担”共享依赖的成本。
+    """
+    rows: List[Dict[str, Any]] = []
+    start = time.perf_counter()
+    specs = read_manifest(package_path)
+    manifest_ms = (time.perf_counter() - start) * 1000
+    spec_by_module = {spec.module: spec for spec in specs}
+
+    for module_name in _tool_modules(package_path):
+        row: Dict[str, Any] = {"module": module_name, "in_manifest": module_name in spec_by_module}
+        try:
+            t0 = time.perf_counter()
+            module = importlib.import_module(module_name)
+            t1 = time.perf_counter()
+            instances = [cls() for cls in _tool_classes(module)]
+            t2 = time.perf_counter()
+            for tool in instances:
+                tool.warm_up()
+            t3 = time.perf_counter()
+            row.update({
+                "tools": [tool.name for tool in instances],
+                "import_ms": (t1 - t0) * 1000,
+                "init_ms": (t2 - t1) * 1000,
+                "warm_up_ms": (t3 - t2) * 1000,
+            })
+        except Exception as e:
+            row["error"] = str(e)
+        rows.append(row)
+
+    print(f"\n⏱️  Startup profile for '{package_path}' (manifest read: {manifest_ms:.1f} ms, {len(specs)} tools)")
+    print(f"{'module':36s} {'manifest':>8s} {'import':>10s} {'init':>10s} {'warm-up':>10s}")
+    for row in rows:
+        if "error" in row:
+            print(f"{row['module']:36s} {'yes' if row['in_manifest'] else 'no':>8s}   error: {row['error']}")
+            continue
+        print(f"{row['module']:36s} {'yes' if row['in_manifest'] else 'no':>8s} "
+              f"{row['import_ms']:8.1f}ms {row['init_ms']:8.1f}ms {row['warm_up_ms']:8.1f}ms")
+    lazy_cost = sum(r.get("import_ms", 0) + r.get("init_ms", 0) + r.get("warm_up_ms", 0)
+                    for r in rows if r["in_manifest"])
+    print(f"Deferred to first use thanks to the manifest: {lazy_cost:.1f} ms\n")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tool manifest utilities.")
+    parser.add_argument("--package", default="tools")
+    parser.add_argument("--write-manifest", action="store_true", help="重新生成 tools/manifest.json。")
+    parser.add_argument("--profile", action="store_true", help="打印每个工具的启动耗时。")
+    args = parser.parse_args()
+    if args.write_manifest:
+        written = write_manifest(args.package)
+        print(f"Wrote {len(written)} tools to {_manifest_path(args.package)}")
+    if args.profile:
+        profile_startup(args.package)
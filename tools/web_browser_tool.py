@@ -1,21 +1,19 @@
 import os
-from typing import Dict, Any
-from serpapi import GoogleSearch
-import requests
-from mcp.interfaces import BaseTool
-
-BROWSER_HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
-    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-    'Accept-Language': 'en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7',
-}
-
 import requests
-from bs4 import BeautifulSoup
 from typing import Dict, Any
 from mcp.interfaces import BaseTool
+from tools.http_fetch import get_fetcher
+from tools.html_text import extract_visible_text, declared_charset
+
+# 单个网页最多读取的字节数；可见文本够了会更早停止
+MAX_PAGE_BYTES = int(os.getenv("WEB_BROWSER_MAX_BYTES", str(2 * 1024 * 1024)))
 
 class WebBrowserTool(BaseTool):
+    # 网页下载本身由 http_fetch 按 HTTP 缓存头缓存，这里缓存的是提取后的文本，省去重复的解析
+    cacheable = True
+    cache_ttl = 600.0
+    cache_normalize = "url"
+
     def __init__(self):
         name = "web_browser_tool"
         description = (
@@ -36,26 +34,6 @@ class WebBrowserTool(BaseTool):
         ]
         super().__init__(name, description, parameters)
 
-    def _clean_html_content(self, html: str, word_limit: int) -> str:
-        """使用 BeautifulSoup 清理HTML并提取文本。"""
-        soup = BeautifulSoup(html, 'html.parser')
-
-        # 移除所有脚本和样式元素，因为它们不包含有用信息
-        for script_or_style in soup(['script', 'style']):
-            script_or_style.decompose()
-
-        # 获取文本并处理空白
-        text = soup.get_text()
-        lines = (line.strip() for line in text.splitlines())
-        clean_text = '\n'.join(line for line in lines if line)
-
-        # 截断文本到指定的单词数量
-        words = clean_text.split()
-        if len(words) > word_limit:
-            truncated_text = ' '.join(words[:word_limit]) + "..."
-            return truncated_text
-        return clean_text
-
     def execute(self, **kwargs: Any) -> Dict[str, Any]:
         url = kwargs.get("url")
         word_limit = kwargs.get("word_limit", 1000)
@@ -64,24 +42,24 @@ class WebBrowserTool(BaseTool):
             return {"status": "error", "message": "缺少 'url' 参数。"}
         
         try:
-            response = requests.get(url, headers=BROWSER_HEADERS, timeout=15, stream=True)
-            response.raise_for_status()
-
-            # --- 核心改动：在这里检查文件类型 ---
-            content_type = response.headers.get('Content-Type', '')
-            if 'text/html' not in content_type.lower():
-                # 如果文件类型不是 HTML 网页，就直接报告并停止
-                return {
-                    "status": "error", 
-                    "message": f"URL 指向的不是一个网页，而是一个 '{content_type}' 类型的文件，无法读取文本内容。"
-                }
-
-            # --- 核心改动：更智能的编码处理 ---
-            # 确保我们能正确读取内容
-            response.encoding = response.apparent_encoding
-            html_content = response.text
-
-            content = self._clean_html_content(html_content, word_limit)
+            # 流式读取：响应头先到，先检查文件类型；正文边下载边解析，收集够 word_limit 个单词就停止
+            with get_fetcher().stream(url) as response:
+                response.raise_for_status()
+
+                content_type = response.headers.get('Content-Type', '')
+                if 'text/html' not in content_type.lower():
+                    # 如果文件类型不是 HTML 网页，就直接报告并停止（不下载正文）
+                    return {
+                        "status": "error", 
+                        "message": f"URL 指向的不是一个网页，而是一个 '{content_type}' 类型的文件，无法读取文本内容。"
+                    }
+
+                content, _ = extract_visible_text(
+                    response.iter_content(),
+                    word_limit=word_limit,
+                    max_bytes=MAX_PAGE_BYTES,
+                    declared_encoding=declared_charset(content_type),
+                )
 
             if not content:
                 return {"status": "success", "result": "网页内容为空或无法提取有效文本。"}
@@ -92,5 +70,3 @@ class WebBrowserTool(BaseTool):
             return {"status": "error", "message": f"访问URL时发生网络错误: {e}"}
         except Exception as e:
             return {"status": "error", "message": f"处理网页内容时发生未知错误: {e}"}
-
-    
\ No newline at end of file
@@ -1,10 +1,20 @@
 # tools/web_surfer_tool.py
 import os
 from typing import Dict, Any
-from serpapi import GoogleSearch
 from mcp.interfaces import BaseTool
+from tools.fake_web import FAKE_WEB, FakeGoogleSearch
+
+try:
+    from serpapi import GoogleSearch
+except ImportError:  # 离线模式 (FAKE_WEB=1) 下不需要 serpapi
+    GoogleSearch = None
 
 class WebSurferTool(BaseTool):
+    # 每次搜索都是一次付费的 SerpAPI 请求；搜索结果在一小时内视为不变
+    cacheable = True
+    cache_ttl = 3600.0
+    cache_normalize = "text"
+
     def __init__(self):
         name = "web_surfer_tool"
         description = (
@@ -26,8 +36,14 @@ class WebSurferTool(BaseTool):
             return {"status": "error", "message": "缺少 'search_query' 参数。"}
 
         api_key = os.getenv("SERPAPI_API_KEY")
-        if not api_key:
+        if FAKE_WEB:
+            search_class = FakeGoogleSearch
+        elif GoogleSearch is None:
+            return {"status": "error", "message": "未安装 google-search-results (serpapi)。"}
+        elif not api_key:
             return {"status": "error", "message": "未在 .env 文件中找到 SERPAPI_API_KEY。"}
+        else:
+            search_class = GoogleSearch
 
         try:
             params = {
@@ -35,7 +51,7 @@ class WebSurferTool(BaseTool):
                 "q": search_query,
                 "api_key": api_key
             }
-            search = GoogleSearch(params)
+            search = search_class(params)
             results = search.get_dict()
 
             # 提取前3个有用的有机结果
@@ -0,0 +1,255 @@
+"""
+每个目标的结构化追踪 (tracing) 和日志配置。
+
+每个 AgentSession 拥有一个 Tracer，ReAct 循环的每个阶段都会记录一个 span：
+    goal          整个目标（根 span）
+    rag           知识库检索
+    turn          一轮 ReAct
+    prompt_build  PromptBuilder 增量构建消息列表
+    llm           LLM 调用（流式模式下包含整个流，并记录首个分块的延迟）
+    decode        决策 JSON 的解析与修复
+    tool          一次工具执行（包括缓存命中和提前分发）
+span 记录耗时、token 数和负载大小等属性。目标结束时 Tracer.summary() 按阶段汇总耗时；
+设置 TRACE_FILE 后，所有 span 会在目标结束时一次性追加写入文件（不在热路径上做 I/O）：
+    TRACE_FORMAT=jsonl  每行一个 span
+    TRACE_FORMAT=otlp   每行一个 OTLP/JSON 的 ExportTraceServiceRequest，
+                        可以直接交给 OpenTelemetry Collector 的 otlpjsonfile 接收器
+
+日志：Agent 的进度输出走 logging，LOG_LEVEL（或命令行的 --log-level / --quiet）控制输出量，
+WARNING 及以上时每轮不再向 stdout 写任何内容。
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "jsonl").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+TRACE_FORMATS = ("jsonl", "otlp")
+SERVICE_NAME = "d-agent"
+
+# perf_counter 与 Unix 时间之间的偏移，用于把单调时钟换算成 OTLP 需要的绝对时间
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+def configure_logging(level: Optional[str] = None, quiet: bool = False):
+    """配置根日志：只输出消息本身（保持原来 print 的样子），写到 stdout。quiet 等价于 WARNING。"""
+    level = "WARNING" if quiet else (level or LOG_LEVEL).upper()
+    logging.basicConfig(level=level, format="%(message)s", stream=sys.stdout)
+    logging.getLogger().setLevel(level)
+
+
+class Span:
+    """一个计时区间。attributes 中保存 token 数、字节数等附加信息。"""
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes", "status")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.status = "ok"
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def to_dict(self, trace_id: str) -> Dict[str, Any]:
+        return {
+            "trace_id": trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_unix_ms": round((_EPOCH_OFFSET + self.start) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+    def to_otlp(self, trace_id: str) -> Dict[str, Any]:
+        span = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(int((_EPOCH_OFFSET + self.start) * 1e9)),
+            "endTimeUnixNano": str(int((_EPOCH_OFFSET + (self.end or self.start)) * 1e9)),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            "status": {"code": 2 if self.status == "error" else 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)}
+    return {"key": key, "value": typed}
+
+
+class Tracer:
+    """
+    一个目标的所有 span。线程安全：并行的工具可以在不同线程（或协程）中同时记录 span。
+    没有显式指定父 span 时，新 span 挂在当前轮次 (turn) 下，没有轮次时挂在根 span 下。
+    enabled 为 False 时 span 照常计时但不保存，用于没有会话的直接调用。
+    """
+    def __init__(self, trace_id: Optional[str] = None, enabled: bool = True):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.enabled = enabled
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self.turn: Optional[Span] = None
+        self._lock = threading.Lock()
+
+    def start(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        parent = parent or self.turn or self.root
+        span = Span(name, parent.span_id if parent else None, attributes)
+        if self.enabled:
+            with self._lock:
+                self.spans.append(span)
+        return span
+
+    @staticmethod
+    def end(span: Span, **attributes: Any) -> Span:
+        if span.end is None:
+            span.end = time.perf_counter()
+        return span.set(**attributes)
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Iterator[Span]:
+        """with tracer.span("llm", model=...) as span: ...；异常会把 span 标记为 error 并继续抛出。"""
+        span = self.start(name, parent, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.set(error=str(e) or type(e).__name__)
+            raise
+        finally:
+            self.end(span)
+
+    def begin(self, name: str = "goal", **attributes: Any) -> Span:
+        """开始根 span（目标开始时调用）。"""
+        self.root = self.start(name, **attributes)
+        return self.root
+
+    @contextmanager
+    def turn_span(self, **attributes: Any) -> Iterator[Span]:
+        """一轮 ReAct 的 span；在它打开期间新建的 span 默认都挂在它下面。"""
+        with self.span("turn", parent=self.root, **attributes) as span:
+            self.turn = span
+            try:
+                yield span
+            finally:
+                self.turn = None
+
+    def finish(self, **attributes: Any):
+        """结束仍然打开的轮次和根 span（目标结束时调用，之后就可以导出）。"""
+        if self.turn is not None:
+            self.end(self.turn)
+        if self.root is not None:
+            self.end(self.root, **attributes)
+
+    def summary(self) -> Dict[str, Any]:
+        """按阶段（以及按工具）汇总的次数、总耗时和最大耗时，单位毫秒。"""
+        phases: Dict[str, Dict[str, Any]] = {}
+        tools: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            groups = [phases.setdefault(span.name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})]
+            if span.name == "tool":
+                groups.append(tools.setdefault(str(span.attributes.get("tool")), {"count": 0, "total_ms": 0.0, "max_ms": 0.0}))
+            duration = span.duration_ms
+            for group in groups:
+                group["count"] += 1
+                group["total_ms"] += duration
+                group["max_ms"] = max(group["max_ms"], duration)
+        for group in list(phases.values()) + list(tools.values()):
+            group["total_ms"] = round(group["total_ms"], 3)
+            group["max_ms"] = round(group["max_ms"], 3)
+        return {"trace_id": self.trace_id, "spans": len(spans), "phases": phases, "tools": tools}
+
+    def export(self, exporter: Optional["SpanExporter"] = None):
+        """把所有 span 交给导出器（默认是 TRACE_FILE 对应的全局导出器，未设置时什么也不做）。"""
+        exporter = exporter or get_exporter()
+        if exporter is not None and self.enabled:
+            with self._lock:
+                spans = list(self.spans)
+            exporter.export(self.trace_id, spans)
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """一行形式的阶段耗时汇总，例如 'rag=12ms llm=840ms(4) tool=310ms(3)'。"""
+    parts = []
+    for name, group in summary["phases"].items():
+        if name in ("goal", "turn"):
+            continue
+        count = f"({group['count']})" if group["count"] > 1 else ""
+        parts.append(f"{name}={group['total_ms']:.0f}ms{count}")
+    return " ".join(parts)
+
+
+class SpanExporter:
+    """把 span 追加写入文件，格式为 jsonl 或 otlp。多个会话共享同一个导出器，写入时加锁。"""
+    def __init__(self, path: str, fmt: str = TRACE_FORMAT):
+        if fmt not in TRACE_FORMATS:
+            raise ValueError(f"Unsupported TRACE_FORMAT '{fmt}'. Choose one of {TRACE_FORMATS}.")
+        self.path = path
+        self.format = fmt
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _lines(self, trace_id: str, spans: List[Span]) -> List[str]:
+        if self.format == "jsonl":
+            return [json.dumps(span.to_dict(trace_id), ensure_ascii=False, default=str) for span in spans]
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": [span.to_otlp(trace_id) for span in spans]}],
+        }]}
+        return [json.dumps(request, ensure_ascii=False, default=str)]
+
+    def export(self, trace_id: str, spans: List[Span]):
+        if not spans:
+            return
+        payload = "\n".join(self._lines(trace_id, spans)) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(payload)
+
+
+_exporter: Optional[SpanExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> Optional[SpanExporter]:
+    """TRACE_FILE 对应的全局导出器；未设置 TRACE_FILE 时返回 None。"""
+    global _exporter
+    if not TRACE_FILE:
+        return None
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = SpanExporter(TRACE_FILE, TRACE_FORMAT)
+    return _exporter